@@ -0,0 +1,412 @@
+import logging
+import os
+import threading
+import itertools
+from collections import OrderedDict
+from typing import Optional, Dict, List, Callable, Iterable, Tuple
+
+from asterisk_manager import AsteriskManager
+
+logger = logging.getLogger(__name__)
+
+
+# هدرهایی که Eventها بر اساس آن‌ها ایندکس می‌شوند
+INDEX_FIELDS = ('Uniqueid', 'Linkedid', 'ActionID', 'DestUniqueid')
+
+EventKey = Tuple[str, str]
+
+
+def event_keys(event: Dict[str, str]) -> List[EventKey]:
+    """
+    کلیدهای ایندکس یک Event
+
+    Args:
+        event: دیکشنری هدرهای Event
+
+    Returns:
+        لیست (نام هدر، مقدار)؛ DestUniqueid با کلید Uniqueid ثبت می‌شود
+    """
+    keys = []
+    for field in INDEX_FIELDS:
+        value = event.get(field)
+        if value:
+            name = 'Uniqueid' if field == 'DestUniqueid' else field
+            keys.append((name, value))
+    return keys
+
+
+class _Waiter:
+    """یک انتظار ثبت شده برای Event مطابق با predicate"""
+
+    __slots__ = ('predicate', 'ready', 'result')
+
+    def __init__(self, predicate: Callable[[Dict[str, str]], bool]):
+        self.predicate = predicate
+        self.ready = threading.Event()
+        self.result: Optional[Dict[str, str]] = None
+
+
+class AMIEventBus:
+    """
+    گذرگاه Eventهای AMI روی یک اتصال اختصاصی و طولانی‌مدت
+
+    Eventها یک بار از socket خوانده می‌شوند، بر اساس Uniqueid / Linkedid /
+    ActionID در ساختارهای محدود ایندکس می‌شوند و به subscriberها و
+    انتظارهای ثبت شده تحویل داده می‌شوند. session‌های pool با Events: off
+    login می‌کنند و برای پیگیری تماس از این گذرگاه استفاده می‌کنند.
+    """
+
+    def __init__(
+        self,
+        config_name: str,
+        settings_provider: Callable[[], AsteriskManager],
+        max_keys: Optional[int] = None,
+        max_events_per_key: int = 32,
+        keepalive_interval: Optional[float] = None
+    ):
+        """
+        مقداردهی اولیه گذرگاه Event
+
+        Args:
+            config_name: نام پیکربندی Asterisk
+            settings_provider: تابعی که AsteriskManager حامل تنظیمات را برمی‌گرداند
+            max_keys: حداکثر تعداد کلید ایندکس (پیش‌فرض: AMI_EVENT_INDEX_SIZE یا 10000)
+            max_events_per_key: حداکثر تعداد Event نگهداری شده برای هر کلید
+            keepalive_interval: فاصله ارسال Ping روی اتصال Event (ثانیه)
+        """
+        self.config_name = config_name
+        self._settings_provider = settings_provider
+        self.max_keys = max_keys or int(
+            os.getenv('AMI_EVENT_INDEX_SIZE', '10000')
+        )
+        self.max_events_per_key = max_events_per_key
+        self.keepalive_interval = keepalive_interval or float(
+            os.getenv('AMI_KEEPALIVE_INTERVAL', '30')
+        )
+
+        self._lock = threading.Lock()
+        # (هدر، مقدار) -> آخرین Eventهای آن کلید
+        self._index: 'OrderedDict[EventKey, List[Dict[str, str]]]' = (
+            OrderedDict()
+        )
+        # Uniqueid -> نام کانال (مثال: SIP/trunk-0000002a)
+        self.channel_events: 'OrderedDict[str, str]' = OrderedDict()
+
+        self._waiters: Dict[EventKey, List[_Waiter]] = {}
+        self._subscribers: Dict[int, Callable[[Dict[str, str]], None]] = {}
+        self._keyed_subscribers: Dict[
+            EventKey, Dict[int, Callable[[Dict[str, str]], None]]
+        ] = {}
+        self._subscription_keys: Dict[int, List[EventKey]] = {}
+        self._subscriber_ids = itertools.count(1)
+
+        self._manager: Optional[AsteriskManager] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._restart = threading.Event()
+        self._connected = threading.Event()
+        self.events_received = 0
+
+    # ------------------------------------------------------------------
+    # اتصال
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """شروع thread نگهدارنده اتصال Event"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name=f"ami-event-bus-{self.config_name}",
+                daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        """اتصال، login و اتصال مجدد با backoff در صورت قطع شدن"""
+        backoff = 1.0
+        while not self._stopped.is_set():
+            settings = self._settings_provider()
+            manager = AsteriskManager(
+                host=settings.host,
+                port=settings.port,
+                username=settings.username,
+                secret=settings.secret,
+                config_name=self.config_name
+            )
+            success, error = manager.connect()
+            if not success:
+                logger.warning(
+                    "خطا در اتصال AMI event bus (%s): %s",
+                    self.config_name, error
+                )
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+
+            backoff = 1.0
+            token = manager.subscribe(self.publish)
+            self._manager = manager
+            self._restart.clear()
+            self._connected.set()
+            logger.info("AMI event bus (%s) متصل شد", self.config_name)
+
+            while (
+                manager.is_connected() and
+                not self._stopped.is_set() and
+                not self._restart.is_set()
+            ):
+                self._restart.wait(self.keepalive_interval)
+                if manager.is_connected() and not self._restart.is_set():
+                    manager.ping()
+
+            self._connected.clear()
+            manager.unsubscribe(token)
+            self._manager = None
+            manager.disconnect()
+
+    def is_connected(self) -> bool:
+        """بررسی برقرار بودن اتصال Event"""
+        manager = self._manager
+        return manager is not None and manager.is_connected()
+
+    def wait_connected(self, timeout: float) -> bool:
+        """
+        انتظار برای برقراری اتصال Event (مثلاً بلافاصله بعد از start)
+
+        Args:
+            timeout: حداکثر زمان انتظار (ثانیه)
+
+        Returns:
+            True اگر اتصال برقرار باشد
+        """
+        return self._connected.wait(timeout) and self.is_connected()
+
+    def restart(self):
+        """اتصال مجدد با تنظیمات جدید"""
+        self._restart.set()
+
+    def stop(self):
+        """توقف گذرگاه و بستن اتصال"""
+        self._stopped.set()
+        self._restart.set()
+
+    # ------------------------------------------------------------------
+    # انتشار و ایندکس
+    # ------------------------------------------------------------------
+
+    def publish(self, event: Dict[str, str]):
+        """
+        ثبت و توزیع یک Event (از thread خواننده صدا زده می‌شود)
+
+        Args:
+            event: دیکشنری هدرهای Event
+        """
+        keys = event_keys(event)
+        ready: List[_Waiter] = []
+        callbacks: List[Callable[[Dict[str, str]], None]] = []
+
+        with self._lock:
+            self.events_received += 1
+            for key in keys:
+                events = self._index.get(key)
+                if events is None:
+                    events = self._index[key] = []
+                    if len(self._index) > self.max_keys:
+                        self._index.popitem(last=False)
+                else:
+                    self._index.move_to_end(key)
+                events.append(event)
+                if len(events) > self.max_events_per_key:
+                    del events[0]
+
+                waiters = self._waiters.get(key)
+                if waiters:
+                    for waiter in list(waiters):
+                        if waiter.predicate(event):
+                            waiter.result = event
+                            waiters.remove(waiter)
+                            ready.append(waiter)
+
+                subscribers = self._keyed_subscribers.get(key)
+                if subscribers:
+                    callbacks.extend(subscribers.values())
+
+            uniqueid = event.get('Uniqueid')
+            channel = event.get('Channel')
+            if uniqueid and channel:
+                self.channel_events[uniqueid] = channel
+                self.channel_events.move_to_end(uniqueid)
+                if len(self.channel_events) > self.max_keys:
+                    self.channel_events.popitem(last=False)
+
+            callbacks.extend(self._subscribers.values())
+
+        for waiter in ready:
+            waiter.ready.set()
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception(
+                    "خطا در پردازش Event %s", event.get('Event')
+                )
+
+    def find(
+        self,
+        uniqueid: Optional[str] = None,
+        linkedid: Optional[str] = None,
+        action_id: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """
+        دریافت Eventهای اخیر یک کانال، تماس یا action
+
+        Returns:
+            لیست Eventها به ترتیب دریافت
+        """
+        key = self._key(uniqueid, linkedid, action_id)
+        with self._lock:
+            return list(self._index.get(key, ()))
+
+    @staticmethod
+    def _key(
+        uniqueid: Optional[str],
+        linkedid: Optional[str],
+        action_id: Optional[str]
+    ) -> EventKey:
+        """ساخت کلید ایندکس از یکی از شناسه‌ها"""
+        if uniqueid:
+            return ('Uniqueid', uniqueid)
+        if linkedid:
+            return ('Linkedid', linkedid)
+        if action_id:
+            return ('ActionID', action_id)
+        raise ValueError("یکی از uniqueid، linkedid یا action_id الزامی است")
+
+    # ------------------------------------------------------------------
+    # اشتراک و انتظار
+    # ------------------------------------------------------------------
+
+    def subscribe(
+        self,
+        callback: Callable[[Dict[str, str]], None],
+        keys: Optional[Iterable[EventKey]] = None
+    ) -> int:
+        """
+        ثبت callback برای Eventها
+
+        callback در thread خواننده اجرا می‌شود و نباید بلاک شود.
+
+        Args:
+            callback: تابعی که دیکشنری هدرهای Event را می‌گیرد
+            keys: اگر مشخص شود فقط Eventهای این کلیدها تحویل داده می‌شوند،
+                مثلاً [('ActionID', ...), ('Uniqueid', ...)]
+
+        Returns:
+            شناسه اشتراک برای unsubscribe
+        """
+        with self._lock:
+            token = next(self._subscriber_ids)
+            if keys is None:
+                self._subscribers[token] = callback
+                return token
+            keys = list(keys)
+            self._subscription_keys[token] = keys
+            for key in keys:
+                self._keyed_subscribers.setdefault(key, {})[token] = callback
+            return token
+
+    def unsubscribe(self, token: int):
+        """لغو اشتراک"""
+        with self._lock:
+            self._subscribers.pop(token, None)
+            for key in self._subscription_keys.pop(token, ()):
+                subscribers = self._keyed_subscribers.get(key)
+                if subscribers is not None:
+                    subscribers.pop(token, None)
+                    if not subscribers:
+                        del self._keyed_subscribers[key]
+
+    def wait_for(
+        self,
+        predicate: Callable[[Dict[str, str]], bool],
+        timeout: float,
+        uniqueid: Optional[str] = None,
+        linkedid: Optional[str] = None,
+        action_id: Optional[str] = None
+    ) -> Optional[Dict[str, str]]:
+        """
+        انتظار برای Event مطابق با predicate روی یک کلید
+
+        ابتدا Eventهای ایندکس شده بررسی می‌شوند تا Eventی که قبل از
+        فراخوانی رسیده از دست نرود؛ سپس thread تا رسیدن Event مطابق
+        (بدون polling) منتظر می‌ماند.
+
+        Args:
+            predicate: شرط روی دیکشنری Event
+            timeout: حداکثر زمان انتظار (ثانیه)
+            uniqueid / linkedid / action_id: کلید Event مورد انتظار
+
+        Returns:
+            Event مطابق یا None در صورت timeout
+        """
+        key = self._key(uniqueid, linkedid, action_id)
+        waiter = _Waiter(predicate)
+        with self._lock:
+            for event in self._index.get(key, ()):
+                if predicate(event):
+                    return event
+            self._waiters.setdefault(key, []).append(waiter)
+
+        if waiter.ready.wait(timeout):
+            return waiter.result
+
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                self._waiters.pop(key, None)
+        return waiter.result
+
+    def channel_for(
+        self,
+        uniqueid: str,
+        timeout: float
+    ) -> Optional[str]:
+        """
+        نام واقعی کانال بر اساس Uniqueid
+
+        Args:
+            uniqueid: Uniqueid کانال (مثلاً ChannelId ارسال شده با Originate)
+            timeout: حداکثر زمان انتظار برای Event کانال (ثانیه)
+
+        Returns:
+            نام کانال یا None
+        """
+        with self._lock:
+            channel = self.channel_events.get(uniqueid)
+        if channel:
+            return channel
+        event = self.wait_for(
+            lambda e: bool(e.get('Channel')),
+            timeout,
+            uniqueid=uniqueid
+        )
+        return event.get('Channel') if event else None
+
+    def stats(self) -> Dict[str, int]:
+        """وضعیت گذرگاه"""
+        with self._lock:
+            return {
+                'connected': self.is_connected(),
+                'events_received': self.events_received,
+                'indexed_keys': len(self._index),
+                'tracked_channels': len(self.channel_events),
+                'subscribers': (
+                    len(self._subscribers) + len(self._subscription_keys)
+                ),
+                'waiters': sum(len(w) for w in self._waiters.values()),
+            }
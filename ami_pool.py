@@ -0,0 +1,380 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional, Dict, List
+
+from asterisk_manager import AsteriskManager
+from ami_events import AMIEventBus
+from config_cache import get_config_cache
+
+logger = logging.getLogger(__name__)
+
+
+class AMIConnectionPool:
+    """
+    pool سراسری از session‌های احراز هویت‌شده AMI
+
+    هر worker در gunicorn pool مخصوص به خود را دارد. session‌ها یک بار
+    login می‌کنند و بین درخواست‌ها دوباره استفاده می‌شوند؛ یک thread
+    پس‌زمینه با Action: Ping آن‌ها را زنده نگه می‌دارد و در صورت قطع شدن
+    دوباره login می‌کند.
+
+    چون actionها با ActionID تفکیک می‌شوند، یک session می‌تواند هم‌زمان
+    بین چند درخواست مشترک باشد (تا سقف AMI_SESSION_MAX_SHARED).
+
+    session‌های pool با Events: off login می‌کنند؛ Eventها فقط یک بار روی
+    اتصال اختصاصی event_bus دریافت می‌شوند.
+    """
+
+    def __init__(
+        self,
+        config_name: str = 'default',
+        size: Optional[int] = None,
+        keepalive_interval: Optional[float] = None,
+        acquire_timeout: Optional[float] = None,
+        max_shared: Optional[int] = None
+    ):
+        """
+        مقداردهی اولیه pool
+
+        Args:
+            config_name: نام پیکربندی Asterisk در دیتابیس
+            size: حداکثر تعداد session (پیش‌فرض: AMI_POOL_SIZE یا 4)
+            keepalive_interval: فاصله ارسال Ping به session‌های بیکار (ثانیه)
+            acquire_timeout: حداکثر زمان انتظار برای session آزاد (ثانیه)
+            max_shared: حداکثر تعداد درخواست هم‌زمان روی یک session
+        """
+        self.config_name = config_name
+        self.size = size or int(os.getenv('AMI_POOL_SIZE', '4'))
+        self.keepalive_interval = keepalive_interval or float(
+            os.getenv('AMI_KEEPALIVE_INTERVAL', '30')
+        )
+        self.acquire_timeout = acquire_timeout or float(
+            os.getenv('AMI_POOL_ACQUIRE_TIMEOUT', '10')
+        )
+        self.max_shared = max_shared or int(
+            os.getenv('AMI_SESSION_MAX_SHARED', '32')
+        )
+
+        self._sessions: List[AsteriskManager] = []
+        # تعداد درخواست‌هایی که هم‌اکنون از هر session استفاده می‌کنند
+        self._leases: Dict[int, int] = {}
+        # session‌های کنار گذاشته شده با reload که هنوز در حال استفاده‌اند
+        self._retired: Dict[int, AsteriskManager] = {}
+        self._condition = threading.Condition()
+        self._settings: Optional[AsteriskManager] = None
+        self._keepalive_thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.event_bus = AMIEventBus(
+            config_name=config_name,
+            settings_provider=self.settings,
+            keepalive_interval=self.keepalive_interval
+        )
+
+    def settings(self) -> AsteriskManager:
+        """
+        تنظیمات اتصال pool (host/port/username/secret)
+
+        تنظیمات فقط یک بار از دیتابیس یا environment خوانده می‌شود و
+        session‌های جدید از همین نمونه ساخته می‌شوند.
+
+        Returns:
+            یک AsteriskManager بدون اتصال که فقط حامل تنظیمات است
+        """
+        with self._condition:
+            if self._settings is None:
+                self._settings = AsteriskManager(config_name=self.config_name)
+            return self._settings
+
+    def _create_session(self) -> AsteriskManager:
+        """ساخت یک session جدید (بدون اتصال)"""
+        settings = self.settings()
+        manager = AsteriskManager(
+            host=settings.host,
+            port=settings.port,
+            username=settings.username,
+            secret=settings.secret,
+            config_name=self.config_name,
+            events=False
+        )
+        manager.event_bus = self.event_bus
+        return manager
+
+    def is_configured(self) -> bool:
+        """بررسی کامل بودن تنظیمات Asterisk برای این pool"""
+        settings = self.settings()
+        return all([
+            settings.host,
+            settings.port,
+            settings.username,
+            settings.secret
+        ])
+
+    def acquire(self) -> tuple[Optional[AsteriskManager], str]:
+        """
+        دریافت یک session آماده از pool
+
+        session بیکار، در صورت نبود session جدید و در غیر این صورت
+        کم‌بارترین session انتخاب می‌شود.
+
+        Returns:
+            tuple (manager, error_message)؛ در صورت خطا manager برابر None است
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None, "AMI pool بسته شده است"
+                manager = self._pick_session()
+                if manager is not None:
+                    self._leases[id(manager)] += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, (
+                        f"Timeout: هیچ session آزادی در AMI pool "
+                        f"({self.size} session) وجود ندارد"
+                    )
+                self._condition.wait(remaining)
+
+        # login خارج از قفل pool انجام می‌شود تا بقیه درخواست‌ها معطل نشوند
+        success, error = manager.ensure_connected()
+        if not success:
+            # session در pool می‌ماند و acquire بعدی دوباره login می‌کند
+            self.release(manager)
+            return None, error
+        return manager, ""
+
+    def warm(self, count: Optional[int] = None) -> tuple[int, str]:
+        """
+        login session‌ها و اتصال event bus قبل از اولین درخواست
+
+        Args:
+            count: تعداد session (پیش‌فرض: اندازه pool)
+
+        Returns:
+            tuple (تعداد session‌های login شده، آخرین پیام خطا)
+        """
+        count = min(count or self.size, self.size)
+        managers = []
+        error = ""
+        try:
+            # session‌های گرفته شده بیکار نیستند؛ هر acquire session جدیدی
+            # می‌سازد تا به اندازه pool برسد
+            for _ in range(count):
+                manager, error = self.acquire()
+                if manager is None:
+                    break
+                managers.append(manager)
+        finally:
+            for manager in managers:
+                self.release(manager)
+        if managers and not self.event_bus.wait_connected(
+            timeout=self.acquire_timeout
+        ):
+            error = "اتصال Event به Asterisk برقرار نشد"
+        return len(managers), error
+
+    def _pick_session(self) -> Optional[AsteriskManager]:
+        """انتخاب session برای درخواست بعدی (باید داخل قفل صدا زده شود)"""
+        least_loaded = None
+        for manager in self._sessions:
+            leases = self._leases[id(manager)]
+            if leases == 0:
+                return manager
+            if least_loaded is None or (
+                leases < self._leases[id(least_loaded)]
+            ):
+                least_loaded = manager
+
+        if len(self._sessions) < self.size:
+            manager = self._create_session()
+            self._sessions.append(manager)
+            self._leases[id(manager)] = 0
+            return manager
+
+        if least_loaded is not None and (
+            self._leases[id(least_loaded)] < self.max_shared
+        ):
+            return least_loaded
+        return None
+
+    def release(self, manager: Optional[AsteriskManager]):
+        """
+        بازگرداندن session به pool
+
+        Args:
+            manager: sessionی که از acquire گرفته شده است
+        """
+        if manager is None:
+            return
+        with self._condition:
+            leases = self._leases.get(id(manager), 1) - 1
+            self._leases[id(manager)] = leases
+            if manager in self._sessions and not self._closed:
+                # session قطع‌شده در acquire بعدی دوباره login می‌کند
+                self._condition.notify()
+                return
+            # sessionی که بعد از reload کنار گذاشته شده، پس از آخرین
+            # استفاده بسته می‌شود
+            if leases > 0:
+                return
+            self._retired.pop(id(manager), None)
+        self._discard(manager)
+
+    def _discard(self, manager: AsteriskManager):
+        """حذف session خراب از pool و آزاد کردن جای آن"""
+        manager.disconnect()
+        with self._condition:
+            if manager in self._sessions:
+                self._sessions.remove(manager)
+            if id(manager) not in self._retired:
+                self._leases.pop(id(manager), None)
+            self._condition.notify()
+
+    def start(self):
+        """شروع thread پس‌زمینه keepalive و اتصال event bus"""
+        self.event_bus.start()
+        with self._condition:
+            if self._keepalive_thread and self._keepalive_thread.is_alive():
+                return
+            self._keepalive_thread = threading.Thread(
+                target=self._keepalive_loop,
+                name=f"ami-pool-keepalive-{self.config_name}",
+                daemon=True
+            )
+            self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        """ارسال دوره‌ای Ping به session‌های بیکار و login مجدد در صورت نیاز"""
+        while not self._closed:
+            time.sleep(self.keepalive_interval)
+            # اگر NOTIFY از دست رفته باشد، پایان TTL تغییر را اعمال می‌کند
+            get_config_cache().get(self.config_name)
+            now = time.monotonic()
+            with self._condition:
+                # فقط session‌هایی که مدتی استفاده نشده‌اند بررسی می‌شوند
+                stale = [
+                    manager for manager in self._sessions
+                    if now - manager.last_activity >= self.keepalive_interval
+                ]
+
+            for manager in stale:
+                if manager.is_connected() and manager.ping():
+                    continue
+                logger.warning(
+                    "AMI session (%s) پاسخ Ping نداد؛ login مجدد",
+                    self.config_name
+                )
+                manager.disconnect()
+                success, error = manager.ensure_connected()
+                if not success:
+                    logger.warning("خطا در login مجدد AMI: %s", error)
+                    self._discard(manager)
+
+    def reload(self):
+        """
+        خواندن دوباره تنظیمات و بستن session‌های بیکار
+
+        session‌های در حال استفاده هنگام release کنار گذاشته می‌شوند و
+        session‌های بعدی با تنظیمات جدید login می‌کنند.
+        """
+        with self._condition:
+            self._settings = None
+            idle = []
+            for manager in self._sessions:
+                if self._leases[id(manager)] == 0:
+                    idle.append(manager)
+                    self._leases.pop(id(manager))
+                else:
+                    self._retired[id(manager)] = manager
+            self._sessions.clear()
+            self._condition.notify_all()
+        for manager in idle:
+            manager.disconnect()
+        self.event_bus.restart()
+
+    def on_config_changed(self, config_name: str):
+        """
+        listener تغییر تنظیمات در cache
+
+        Args:
+            config_name: نام پیکربندی تغییر کرده
+        """
+        if config_name != self.config_name:
+            return
+        current = self._settings
+        if current is not None:
+            # تغییر weight/enabled/trunks فقط روی مسیریابی اثر دارد
+            settings = AsteriskManager(config_name=self.config_name)
+            if (current.host, current.port, current.username,
+                    current.secret) == (settings.host, settings.port,
+                                        settings.username, settings.secret):
+                return
+        self.reload()
+
+    def stats(self) -> Dict[str, int]:
+        """وضعیت فعلی pool"""
+        with self._condition:
+            in_use = sum(
+                1 for manager in self._sessions if self._leases[id(manager)]
+            )
+            return {
+                'size': self.size,
+                'open': len(self._sessions),
+                'idle': len(self._sessions) - in_use,
+                'in_use': in_use,
+                'leases': sum(
+                    self._leases[id(manager)] for manager in self._sessions
+                ),
+                'pending_actions': sum(
+                    manager.pending_actions() for manager in self._sessions
+                ),
+                'event_bus': self.event_bus.stats()
+            }
+
+    def close(self):
+        """بستن تمام session‌ها"""
+        with self._condition:
+            self._closed = True
+            sessions = list(self._sessions) + list(self._retired.values())
+            self._sessions.clear()
+            self._retired.clear()
+            self._condition.notify_all()
+        self.event_bus.stop()
+        for manager in sessions:
+            manager.disconnect()
+
+
+_pools: Dict[str, AMIConnectionPool] = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def get_ami_pool(config_name: str = 'default') -> AMIConnectionPool:
+    """
+    دریافت pool سراسری برای یک پیکربندی Asterisk
+
+    pool به ازای هر process ساخته می‌شود تا socketها بعد از fork در
+    workerهای gunicorn به اشتراک گذاشته نشوند.
+
+    Args:
+        config_name: نام پیکربندی در دیتابیس (پیش‌فرض: 'default')
+
+    Returns:
+        AMIConnectionPool
+    """
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # بعد از fork، pool والد قابل استفاده نیست
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(config_name)
+        if pool is None:
+            pool = AMIConnectionPool(config_name=config_name)
+            pool.start()
+            get_config_cache().add_listener(pool.on_config_changed)
+            _pools[config_name] = pool
+        return pool
@@ -0,0 +1,565 @@
+import hashlib
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, List, Set, Callable, Iterable
+
+from ami_pool import AMIConnectionPool, get_ami_pool
+from asterisk_manager import AsteriskManager, LeaseReleaser
+from config_cache import get_config_cache
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+AMI_ROUTED_CALLS = REGISTRY.counter(
+    'ami_routed_calls_total',
+    'Calls routed to each Asterisk server',
+    ('server', 'strategy')
+)
+AMI_SERVER_STATE_CHANGES = REGISTRY.counter(
+    'ami_server_state_changes_total',
+    'Asterisk servers taken out of or returned to the routing set',
+    ('server', 'state')
+)
+
+# استراتژی‌های انتخاب سرور
+LEAST_ACTIVE = 'least_active'
+WEIGHTED = 'weighted'
+AFFINITY = 'affinity'
+STRATEGIES = (LEAST_ACTIVE, WEIGHTED, AFFINITY)
+
+
+class AsteriskServer:
+    """وضعیت مسیریابی یک سرور Asterisk (یک ردیف asterisk_config)"""
+
+    __slots__ = (
+        'name', 'weight', 'trunks', 'healthy', 'failures', 'message',
+        'channels', 'inflight', 'current_weight', 'routed', 'checked_at',
+        'token',
+    )
+
+    def __init__(self, name: str):
+        self.name = name
+        self.weight = 1
+        # None یعنی تمام trunkها روی این سرور تعریف شده‌اند
+        self.trunks: Optional[Set[str]] = None
+        # تا اولین بررسی سالم فرض می‌شود تا تماس‌های شروع worker رد نشوند
+        self.healthy = True
+        self.failures = 0
+        self.message = ""
+        # Uniqueid کانال‌های فعال این سرور (از Newchannel / Hangup)
+        self.channels: Set[str] = set()
+        # تماس‌هایی که سرور برایشان انتخاب شده ولی هنوز کانالی نساخته‌اند
+        self.inflight = 0
+        # وزن جاری smooth weighted round-robin
+        self.current_weight = 0
+        self.routed = 0
+        self.checked_at: Optional[float] = None
+        self.token: Optional[int] = None
+
+    def serves(self, trunk_name: Optional[str]) -> bool:
+        """آیا این سرور trunk را دارد و وزن آن صفر نیست"""
+        if self.weight <= 0:
+            return False
+        return trunk_name is None or self.trunks is None or (
+            trunk_name in self.trunks
+        )
+
+    def load(self) -> float:
+        """بار نسبی سرور برای least_active"""
+        return (len(self.channels) + self.inflight) / self.weight
+
+    def affinity(self, trunk_name: str) -> float:
+        """امتیاز rendezvous hashing (وزن‌دار) این سرور برای یک trunk"""
+        digest = hashlib.sha1(f"{trunk_name}:{self.name}".encode()).digest()
+        # عدد یکنواخت در بازه (0, 1)
+        point = (int.from_bytes(digest[:8], 'big') + 1) / (2 ** 64 + 2)
+        return -self.weight / math.log(point)
+
+
+class AsteriskRouter:
+    """
+    انتخاب سرور Asterisk برای هر تماس بین چند پیکربندی asterisk_config
+
+    هر ردیف فعال asterisk_config یک سرور است که AMI pool و event bus
+    خودش را دارد. سرور هر تماس با یکی از استراتژی‌های زیر انتخاب می‌شود:
+
+    - least_active: کمترین (کانال فعال + تماس در حال شروع) / weight
+    - weighted: smooth weighted round-robin بر اساس weight
+    - affinity: هر trunk همیشه به یک سرور ثابت می‌رود (rendezvous
+      hashing)؛ با خارج شدن آن سرور فقط trunkهای همان سرور جابه‌جا می‌شوند
+
+    فقط سرورهایی که trunk درخواستی در ستون trunks آن‌ها هست (یا trunks
+    خالی است) و weight آن‌ها صفر نیست انتخاب می‌شوند. thread این کلاس هر
+    check_interval ثانیه فهرست سرورها را از cache تنظیمات به‌روز می‌کند،
+    به هر سرور Ping می‌زند و تعداد کانال‌های فعال را با CoreShowChannels
+    همگام می‌کند. سروری که max_failures بار پشت سر هم در بررسی یا
+    acquire شکست بخورد تا اولین بررسی موفق بعدی از مسیریابی خارج می‌شود.
+    """
+
+    def __init__(
+        self,
+        strategy: Optional[str] = None,
+        check_interval: Optional[float] = None,
+        max_failures: Optional[int] = None
+    ):
+        """
+        Args:
+            strategy: استراتژی انتخاب (پیش‌فرض: AMI_ROUTING_STRATEGY یا
+                least_active)
+            check_interval: فاصله بررسی سرورها (پیش‌فرض:
+                AMI_ROUTER_CHECK_INTERVAL یا 5 ثانیه)
+            max_failures: تعداد شکست پیاپی تا خروج سرور (پیش‌فرض:
+                AMI_ROUTER_MAX_FAILURES یا 2)
+        """
+        self.strategy = strategy or os.getenv(
+            'AMI_ROUTING_STRATEGY', LEAST_ACTIVE
+        )
+        if self.strategy not in STRATEGIES:
+            logger.warning(
+                "استراتژی مسیریابی %s نامعتبر است؛ از %s استفاده می‌شود",
+                self.strategy, LEAST_ACTIVE
+            )
+            self.strategy = LEAST_ACTIVE
+        self.check_interval = check_interval or float(
+            os.getenv('AMI_ROUTER_CHECK_INTERVAL', '5')
+        )
+        self.max_failures = max_failures or int(
+            os.getenv('AMI_ROUTER_MAX_FAILURES', '2')
+        )
+        self._servers: Dict[str, AsteriskServer] = {}
+        self._lock = threading.Lock()
+        # subscriberهایی که Eventهای تمام سرورها را می‌گیرند
+        self._subscribers: Dict[int, Callable[[Dict[str, str]], None]] = {}
+        self._subscriber_ids = itertools.count(1)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._check_lock = threading.Lock()
+
+    def start(self):
+        """بارگذاری سرورها و شروع thread بررسی"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self.sync_servers()
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='ami-router',
+                daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """توقف thread بررسی و لغو اشتراک event busها"""
+        self._stopped.set()
+        self._wakeup.set()
+        with self._lock:
+            servers = list(self._servers.values())
+        for server in servers:
+            self._detach(server)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sync_servers()
+                self.check_servers()
+            except Exception:
+                logger.exception("خطا در بررسی سرورهای Asterisk")
+            self._wakeup.wait(self.check_interval)
+            self._wakeup.clear()
+
+    # ------------------------------------------------------------------
+    # فهرست سرورها
+    # ------------------------------------------------------------------
+
+    def sync_servers(self):
+        """
+        همگام کردن سرورها با پیکربندی‌های فعال cache تنظیمات
+
+        اگر هیچ پیکربندی فعالی در دیتابیس نباشد، پیکربندی 'default'
+        (معمولاً از environment) تنها سرور است.
+        """
+        configs = {
+            name: config
+            for name, config in get_config_cache().configs().items()
+            if config.get('enabled', True)
+        }
+        if not configs:
+            configs = {'default': {}}
+
+        added = []
+        removed = []
+        with self._lock:
+            for name in list(self._servers):
+                if name not in configs:
+                    removed.append(self._servers.pop(name))
+            for name, config in configs.items():
+                server = self._servers.get(name)
+                if server is None:
+                    server = self._servers[name] = AsteriskServer(name)
+                    added.append(server)
+                server.weight = max(0, int(config.get('weight', 1)))
+                trunks = config.get('trunks')
+                server.trunks = set(trunks) if trunks else None
+
+        for server in removed:
+            logger.info("سرور Asterisk %s از مسیریابی حذف شد", server.name)
+            self._detach(server)
+        for server in added:
+            self._attach(server)
+            logger.info("سرور Asterisk %s به مسیریابی اضافه شد", server.name)
+
+    def on_config_changed(self, config_name: str):
+        """listener cache تنظیمات؛ weight/enabled/trunks فوراً اعمال می‌شوند"""
+        self.sync_servers()
+
+    def _attach(self, server: AsteriskServer):
+        """اشتراک روی event bus سرور برای شمارش کانال‌ها"""
+        pool = self.pool(server.name)
+        server.token = pool.event_bus.subscribe(
+            lambda event: self._handle_event(server, event)
+        )
+
+    def _detach(self, server: AsteriskServer):
+        """لغو اشتراک event bus (pool برای تماس‌های جاری باز می‌ماند)"""
+        if server.token is not None:
+            self.pool(server.name).event_bus.unsubscribe(server.token)
+            server.token = None
+
+    @staticmethod
+    def pool(config_name: Optional[str] = None) -> AMIConnectionPool:
+        """AMI pool یک سرور (پیش‌فرض: 'default')"""
+        return get_ami_pool(config_name or 'default')
+
+    def servers(self) -> List[str]:
+        """نام سرورهای فعلی"""
+        with self._lock:
+            return list(self._servers)
+
+    # ------------------------------------------------------------------
+    # Eventها
+    # ------------------------------------------------------------------
+
+    def _handle_event(self, server: AsteriskServer, event: Dict[str, str]):
+        """شمارش کانال‌های فعال و ارسال Event به subscriberها (thread event bus)"""
+        name = event.get('Event')
+        uniqueid = event.get('Uniqueid')
+        with self._lock:
+            if uniqueid and name == 'Newchannel':
+                server.channels.add(uniqueid)
+            elif uniqueid and name == 'Hangup':
+                server.channels.discard(uniqueid)
+            subscribers = list(self._subscribers.values())
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception("خطا در subscriber Eventهای %s", server.name)
+
+    def subscribe(self, callback: Callable[[Dict[str, str]], None]) -> int:
+        """
+        ثبت callback برای Eventهای تمام سرورها (شامل سرورهای بعدی)
+
+        callback در thread event bus هر سرور اجرا می‌شود و نباید بلاک شود.
+
+        Returns:
+            شناسه اشتراک برای unsubscribe
+        """
+        with self._lock:
+            token = next(self._subscriber_ids)
+            self._subscribers[token] = callback
+            return token
+
+    def unsubscribe(self, token: int):
+        """لغو اشتراک"""
+        with self._lock:
+            self._subscribers.pop(token, None)
+
+    # ------------------------------------------------------------------
+    # سلامت
+    # ------------------------------------------------------------------
+
+    def check_servers(self) -> Dict[str, tuple[bool, str]]:
+        """
+        Ping و همگام‌سازی کانال‌های تمام سرورها
+
+        Returns:
+            {نام سرور: (ok, message)}
+        """
+        with self._check_lock:
+            return self._check_all()
+
+    def _check_all(self) -> Dict[str, tuple[bool, str]]:
+        # health monitor و thread router هم‌زمان بررسی نمی‌کنند تا شکست‌ها
+        # دو بار شمرده نشوند
+        with self._lock:
+            servers = list(self._servers.values())
+        results = {}
+        for server in servers:
+            try:
+                ok, message = self._check(server)
+            except Exception as e:
+                ok, message = False, str(e)
+            server.checked_at = time.monotonic()
+            if ok:
+                self.report_success(server.name)
+            else:
+                self.report_failure(server.name, message)
+            results[server.name] = (ok, message)
+        return results
+
+    def _check(self, server: AsteriskServer) -> tuple[bool, str]:
+        pool = self.pool(server.name)
+        if not pool.is_configured():
+            return False, "تنظیمات Asterisk کامل نیست"
+        manager, error = pool.acquire()
+        if manager is None:
+            return False, error
+        try:
+            if not manager.ping():
+                return False, "پاسخ Ping دریافت نشد"
+            with self._lock:
+                before = set(server.channels)
+            started = time.monotonic()
+            channels = manager.list_channels()
+        finally:
+            pool.release(manager)
+        if channels is not None:
+            # Eventهای از دست رفته (مثلاً هنگام قطع event bus) جبران می‌شوند؛
+            # کانال‌هایی که در حین دریافت لیست ساخته شده‌اند حفظ می‌شوند
+            uniqueids = {
+                channel['Uniqueid']
+                for channel in channels if channel.get('Uniqueid')
+            }
+            with self._lock:
+                server.channels = uniqueids | (server.channels - before)
+            # leaseهایی که Hangup آن‌ها از دست رفته آزاد می‌شوند
+            LeaseReleaser.reconcile(server.name, uniqueids, started)
+        if not pool.event_bus.is_connected():
+            return False, "اتصال event bus برقرار نیست"
+        return True, ""
+
+    def report_success(self, config_name: str):
+        """ثبت بررسی یا اتصال موفق؛ سرور خارج شده برمی‌گردد"""
+        with self._lock:
+            server = self._servers.get(config_name)
+            if server is None:
+                return
+            server.failures = 0
+            server.message = ""
+            if server.healthy:
+                return
+            server.healthy = True
+        AMI_SERVER_STATE_CHANGES.labels(config_name, 'up').inc()
+        logger.info("سرور Asterisk %s دوباره در مسیریابی است", config_name)
+
+    def report_failure(self, config_name: str, message: str):
+        """
+        ثبت شکست یک سرور
+
+        پس از max_failures شکست پیاپی سرور از مسیریابی خارج می‌شود.
+        """
+        with self._lock:
+            server = self._servers.get(config_name)
+            if server is None:
+                return
+            server.failures += 1
+            server.message = message
+            if not server.healthy or server.failures < self.max_failures:
+                return
+            server.healthy = False
+        AMI_SERVER_STATE_CHANGES.labels(config_name, 'down').inc()
+        logger.warning(
+            "سرور Asterisk %s از مسیریابی خارج شد: %s", config_name, message
+        )
+
+    # ------------------------------------------------------------------
+    # انتخاب سرور
+    # ------------------------------------------------------------------
+
+    def is_configured(self) -> bool:
+        """آیا حداقل یک سرور تنظیمات کامل دارد"""
+        return any(
+            self.pool(name).is_configured() for name in self.servers()
+        )
+
+    def route(
+        self,
+        trunk_name: Optional[str] = None,
+        exclude: Iterable[str] = ()
+    ) -> Optional[str]:
+        """
+        انتخاب سرور برای یک تماس
+
+        اگر هیچ سرور سالمی برای trunk نباشد، بین سرورهای خارج شده انتخاب
+        می‌شود تا تماس بی‌دلیل رد نشود (acquire در صورت خرابی خطا می‌دهد).
+
+        Args:
+            trunk_name: نام trunk تماس
+            exclude: سرورهایی که در همین تماس امتحان شده‌اند
+
+        Returns:
+            نام پیکربندی سرور یا None اگر هیچ سروری این trunk را نداشته باشد
+        """
+        excluded = set(exclude)
+        with self._lock:
+            candidates = [
+                server for server in self._servers.values()
+                if server.name not in excluded and server.serves(trunk_name)
+            ]
+            healthy = [server for server in candidates if server.healthy]
+            candidates = healthy or candidates
+            if not candidates:
+                return None
+            server = self._select(candidates, trunk_name)
+            return server.name
+
+    def _select(
+        self,
+        candidates: List[AsteriskServer],
+        trunk_name: Optional[str]
+    ) -> AsteriskServer:
+        """اجرای استراتژی روی سرورهای کاندید (داخل قفل)"""
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == AFFINITY and trunk_name:
+            return max(
+                candidates, key=lambda server: server.affinity(trunk_name)
+            )
+        if self.strategy == WEIGHTED:
+            # smooth weighted round-robin (مانند nginx)
+            total = 0
+            for server in candidates:
+                server.current_weight += server.weight
+                total += server.weight
+            selected = max(
+                candidates, key=lambda server: server.current_weight
+            )
+            selected.current_weight -= total
+            return selected
+        return min(
+            candidates,
+            key=lambda server: (server.load(), server.routed / server.weight)
+        )
+
+    def begin(self, config_name: str):
+        """ثبت شروع یک تماس روی سرور انتخاب شده"""
+        with self._lock:
+            server = self._servers.get(config_name)
+            if server is not None:
+                server.inflight += 1
+                server.routed += 1
+        AMI_ROUTED_CALLS.labels(config_name, self.strategy).inc()
+
+    def end(self, config_name: Optional[str]):
+        """پایان مرحله originate؛ از این به بعد کانال‌ها شمرده می‌شوند"""
+        with self._lock:
+            server = self._servers.get(config_name)
+            if server is not None and server.inflight > 0:
+                server.inflight -= 1
+
+    def acquire(
+        self,
+        trunk_name: Optional[str] = None
+    ) -> tuple[Optional[AsteriskManager], str, Optional[str]]:
+        """
+        انتخاب سرور و دریافت یک session از pool آن
+
+        در صورت شکست acquire سرور بعدی امتحان می‌شود.
+
+        Args:
+            trunk_name: نام trunk تماس
+
+        Returns:
+            tuple (manager, error_message, config_name)؛ session باید با
+            release(config_name, manager) برگردانده شود
+        """
+        tried: List[str] = []
+        error = "هیچ سرور Asterisk فعالی برای این trunk وجود ندارد"
+        while True:
+            config_name = self.route(trunk_name, exclude=tried)
+            if config_name is None:
+                return None, error, None
+            tried.append(config_name)
+            pool = self.pool(config_name)
+            if not pool.is_configured():
+                error = "تنظیمات Asterisk کامل نیست"
+                self.report_failure(config_name, error)
+                continue
+            manager, error = pool.acquire()
+            if manager is not None:
+                self.begin(config_name)
+                return manager, "", config_name
+            self.report_failure(config_name, error)
+            logger.warning(
+                "اتصال به سرور Asterisk %s ممکن نشد: %s", config_name, error
+            )
+
+    def release(
+        self,
+        config_name: Optional[str],
+        manager: Optional[AsteriskManager]
+    ):
+        """برگرداندن session به pool سرور و پایان شمارش تماس در حال شروع"""
+        if config_name is None:
+            return
+        self.end(config_name)
+        self.pool(config_name).release(manager)
+
+    def stats(self) -> Dict[str, Any]:
+        """وضعیت مسیریابی و هر سرور"""
+        now = time.monotonic()
+        with self._lock:
+            servers = {
+                server.name: {
+                    'healthy': server.healthy,
+                    'weight': server.weight,
+                    'trunks': (
+                        sorted(server.trunks)
+                        if server.trunks is not None else None
+                    ),
+                    'active_channels': len(server.channels),
+                    'inflight': server.inflight,
+                    'routed': server.routed,
+                    'failures': server.failures,
+                    'message': server.message,
+                    'checked_age': (
+                        round(now - server.checked_at, 3)
+                        if server.checked_at is not None else None
+                    ),
+                }
+                for server in self._servers.values()
+            }
+        return {
+            'strategy': self.strategy,
+            'check_interval': self.check_interval,
+            'servers': servers,
+        }
+
+
+_router: Optional[AsteriskRouter] = None
+_router_lock = threading.Lock()
+_router_pid = os.getpid()
+
+
+def get_asterisk_router() -> AsteriskRouter:
+    """
+    دریافت router این process (در اولین فراخوانی شروع می‌شود)
+
+    مانند AMI poolها به ازای هر process ساخته می‌شود.
+    """
+    global _router, _router_pid
+    with _router_lock:
+        if _router is None or _router_pid != os.getpid():
+            _router = AsteriskRouter()
+            _router_pid = os.getpid()
+            get_config_cache().add_listener(_router.on_config_changed)
+            _router.start()
+        return _router
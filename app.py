@@ -1,53 +1,58 @@
+import itertools
+import json
+import logging
 import os
-from flask import Flask, jsonify, request
-import psycopg2
+from typing import Optional, Dict, Any
+from flask import Flask, Response, jsonify, request
 from psycopg2.extras import Json
-from asterisk_manager import AsteriskManager
+from ami_pool import get_ami_pool
+from ami_router import get_asterisk_router
+from asterisk_manager import new_channel_uniqueid
+from db import get_db_connection, get_db_pool
+from config_cache import get_config_cache, CONFIG_CHANNEL
+from trunk_registry import get_trunk_registry, TRUNKS_CHANNEL
+from migrations import ensure_migrated
 from call_state_machine import CallSessionStateMachine, CallState
+from call_orchestrator import get_orchestrator
+from call_batch import (
+    CallBatch,
+    get_batch_dispatcher,
+    load_batch,
+    normalize_entry,
+    parse_answer_timeout,
+    parse_batch_body,
+)
 from trunk_config import TrunkConfig
+from rate_limit import RateLimitExceeded, get_trunk_limiter
+from logging_config import configure_logging
+from metrics import REGISTRY, CONTENT_TYPE, record_call_transition
+from session_registry import get_session_registry
+from call_supervisor import get_call_supervisor
+from trunk_status import get_trunk_status_cache
+from warmup import get_warmup
+from health import get_health_monitor
+from session_store import (
+    get_session_store,
+    list_sessions,
+    load_session,
+    record_session_transition,
+)
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# زمان ماندن در هر حالت تماس و شمارش حالت‌های نهایی
+CallSessionStateMachine.add_transition_listener(record_call_transition)
+# ثبت write-behind تاریخچه جلسه‌ها در call_sessions
+CallSessionStateMachine.add_transition_listener(record_session_transition)
 
-def get_db_connection():
-    """ایجاد اتصال به دیتابیس از طریق environment variables"""
-    db_host = os.getenv('DB_HOST')
-    db_port = os.getenv('DB_PORT')
-    db_name = os.getenv('DB_NAME')
-    db_user = os.getenv('DB_USER')
-    db_password = os.getenv('DB_PASSWORD')
+# حداکثر زمان انتظار برای پاسخ شماره A قبل از تماس با شماره B (ثانیه)
+CALL_ANSWER_TIMEOUT = float(os.getenv('CALL_ANSWER_TIMEOUT', '30'))
 
-    # بررسی وجود تمام environment variables
-    if not all([db_host, db_port, db_name, db_user, db_password]):
-        missing_vars = []
-        if not db_host:
-            missing_vars.append('DB_HOST')
-        if not db_port:
-            missing_vars.append('DB_PORT')
-        if not db_name:
-            missing_vars.append('DB_NAME')
-        if not db_user:
-            missing_vars.append('DB_USER')
-        if not db_password:
-            missing_vars.append('DB_PASSWORD')
-        print(
-            f"خطا: environment variables زیر تنظیم نشده‌اند: "
-            f"{', '.join(missing_vars)}"
-        )
-        return None
-
-    try:
-        conn = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            database=db_name,
-            user=db_user,
-            password=db_password
-        )
-        return conn
-    except Exception as e:
-        print(f"خطا در اتصال به دیتابیس: {e}")
-        return None
+# حداکثر تعداد تماس در یک درخواست /api/call/batch
+CALL_BATCH_MAX = int(os.getenv('CALL_BATCH_MAX', '10000'))
 
 
 def get_tables():
@@ -71,7 +76,7 @@ def get_tables():
         conn.close()
         return tables
     except Exception as e:
-        print(f"خطا در دریافت جداول: {e}")
+        logger.error("خطا در دریافت جداول: %s", e)
         if conn:
             conn.close()
         return []
@@ -91,13 +96,32 @@ def hello():
 
 @app.route('/health')
 def health():
-    """بررسی سلامت سرویس"""
-    return jsonify({'status': 'healthy'})
+    """
+    بررسی سلامت سرویس و وابستگی‌ها (از نتایج cache شده health monitor)
+
+    برای liveness همیشه 200 برمی‌گرداند؛ با ?strict=1 در صورت در دسترس
+    نبودن یک وابستگی 503 و با ?refresh=1 بررسی فوری (با محدودیت نرخ)
+    انجام می‌شود.
+    """
+    monitor = get_health_monitor()
+    if request.args.get('refresh', '').lower() in ('1', 'true', 'yes'):
+        monitor.refresh()
+    snapshot = monitor.snapshot()
+    status = 'healthy' if snapshot['healthy'] else 'degraded'
+    strict = request.args.get('strict', '').lower() in ('1', 'true', 'yes')
+    code = 503 if strict and not snapshot['healthy'] else 200
+    return jsonify({'status': status, **snapshot}), code
+
+
+@app.route('/metrics')
+def metrics():
+    """متریک‌های این worker در فرمت متنی Prometheus"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 
 @app.route('/is-ready')
 def is_ready():
-    """بررسی آماده‌بودن سرویس"""
+    """بررسی آماده‌بودن سرویس (پس از پایان warm-up)"""
     # بررسی وجود environment variables
     db_host = os.getenv('DB_HOST')
     db_port = os.getenv('DB_PORT')
@@ -111,8 +135,33 @@ def is_ready():
             'reason': 'missing environment variables'
         }), 503
 
-    # اگر environment variables تنظیم شده‌اند، اپلیکیشن آماده است
-    return jsonify({'status': 'ready'}), 200
+    # بدون ASGI lifespan (مثلاً اجرای مستقیم Flask) warm-up اینجا شروع می‌شود
+    warmup = get_warmup()
+    warmup.start()
+    if not warmup.is_finished():
+        return jsonify({
+            'status': 'not ready',
+            'reason': 'warming up',
+            'warmup': warmup.report()
+        }), 503
+
+    return jsonify({'status': 'ready', 'warmup': warmup.report()}), 200
+
+
+@app.route('/api/system/pools', methods=['GET'])
+def get_pool_stats():
+    """وضعیت pool دیتابیس و pool اتصال‌های AMI"""
+    return jsonify({
+        'status': 'success',
+        'db': get_db_pool().stats(),
+        'ami': get_ami_pool().stats(),
+        'ami_router': get_asterisk_router().stats(),
+        'trunks': get_trunk_limiter().stats(),
+        'sessions': get_session_store().stats(),
+        'live_sessions': get_session_registry().stats(),
+        'supervisor': get_call_supervisor().stats(),
+        'trunk_status': get_trunk_status_cache().stats()
+    })
 
 
 @app.route('/api/system/my-ip', methods=['GET'])
@@ -206,19 +255,18 @@ def test_asterisk_connection():
 def asterisk_connect():
     """اتصال به سرور Asterisk"""
     try:
-        # خواندن تنظیمات از دیتابیس
-        manager = AsteriskManager()
+        # خواندن تنظیمات از pool (فقط یک بار از دیتابیس خوانده می‌شود)
+        pool = get_ami_pool()
+        manager = pool.settings()
         
-        print("=" * 80)
-        print("CONNECTING TO ASTERISK:")
-        print(f"Host: {manager.host}")
-        print(f"Port: {manager.port}")
-        print(f"Username: {manager.username}")
-        secret_length = len(manager.secret) if manager.secret else 0
-        secret_repr = repr(manager.secret) if manager.secret else 'None'
-        print(f"Secret length: {secret_length}")
-        print(f"Secret repr: {secret_repr}")
-        print("=" * 80)
+        logger.info(
+            "اتصال به Asterisk",
+            extra={
+                'host': manager.host,
+                'port': manager.port,
+                'username': manager.username,
+            }
+        )
         
         # بررسی تنظیمات
         missing_vars = []
@@ -244,9 +292,12 @@ def asterisk_connect():
                 }
             }), 400
         
-        success, error_message = manager.connect()
+        session, error_message = pool.acquire()
+        success = session is not None and session.ping()
+        pool.release(session)
+        if session is not None and not success:
+            error_message = "پاسخ Ping از Asterisk دریافت نشد"
         if success:
-            manager.disconnect()
             return jsonify({
                 'status': 'success',
                 'message': 'اتصال به Asterisk موفق بود',
@@ -335,6 +386,9 @@ def get_asterisk_config():
         'username': config.get('username'),
         'secret': '***' if config.get('secret') else None,
         'source': source,
+        'weight': config.get('weight', 1),
+        'enabled': config.get('enabled', True),
+        'trunks': config.get('trunks'),
         'all_configured': all([
             config.get('host'),
             config.get('port'),
@@ -372,8 +426,24 @@ def save_asterisk_config():
                 'message': 'اطلاعات ناقص است'
             }), 400
 
+        # تنظیمات مسیریابی بین چند سرور (اختیاری)
+        weight = data.get('weight', 1)
+        enabled = bool(data.get('enabled', True))
+        trunks = data.get('trunks')
+        if not isinstance(weight, int) or weight < 0 or (
+            trunks is not None and (
+                not isinstance(trunks, list) or
+                not all(isinstance(trunk, str) for trunk in trunks)
+            )
+        ):
+            return jsonify({
+                'status': 'error',
+                'message': (
+                    'weight باید عدد نامنفی و trunks لیست نام trunkها باشد'
+                )
+            }), 400
+
         # ذخیره در دیتابیس
-        init_asterisk_config_table()
         conn = get_db_connection()
         if not conn:
             return jsonify({
@@ -385,23 +455,38 @@ def save_asterisk_config():
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO asterisk_config
-                (name, host, port, username, secret)
-                VALUES (%s, %s, %s, %s, %s)
+                (name, host, port, username, secret, weight, enabled, trunks)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                 ON CONFLICT (name)
                 DO UPDATE SET
                     host = EXCLUDED.host,
                     port = EXCLUDED.port,
                     username = EXCLUDED.username,
                     secret = EXCLUDED.secret,
+                    weight = EXCLUDED.weight,
+                    enabled = EXCLUDED.enabled,
+                    trunks = EXCLUDED.trunks,
                     updated_at = CURRENT_TIMESTAMP
                 RETURNING id, created_at, updated_at
-            """, (config_name, host, port, username, secret))
+            """, (
+                config_name, host, port, username, secret,
+                weight, enabled, trunks
+            ))
 
             result = cursor.fetchone()
+            # workerهای دیگر پس از commit با NOTIFY از تغییر مطلع می‌شوند
+            cursor.execute(
+                "SELECT pg_notify(%s, %s)", (CONFIG_CHANNEL, config_name)
+            )
             conn.commit()
             cursor.close()
             conn.close()
 
+            # pool فقط در صورت تغییر واقعی تنظیمات اتصال دوباره login می‌کند؛
+            # سرور جدید یا غیرفعال شده فوراً در مسیریابی worker اعمال می‌شود
+            get_config_cache().refresh(config_name)
+            get_asterisk_router().sync_servers()
+
             return jsonify({
                 'status': 'success',
                 'message': f'تنظیمات Asterisk با نام "{config_name}" ذخیره شد',
@@ -429,24 +514,25 @@ def save_asterisk_config():
 
 @app.route('/api/asterisk/trunks', methods=['GET'])
 def list_trunks():
-    """دریافت لیست trunk‌ها"""
+    """دریافت لیست trunk‌ها و وضعیت آن‌ها (از snapshot حافظه)"""
     try:
-        manager = AsteriskManager()
-        success, error_msg = manager.connect()
-        if not success:
+        cache = get_trunk_status_cache()
+        if request.args.get('refresh', '').lower() in ('1', 'true', 'yes'):
+            cache.refresh()
+        entries, error_msg = cache.snapshot()
+        if entries is None:
             return jsonify({
                 'status': 'error',
                 'message': 'امکان اتصال به Asterisk وجود ندارد',
                 'error_details': error_msg
             }), 500
 
-        trunks = manager.list_trunks()
-        manager.disconnect()
-
         return jsonify({
             'status': 'success',
-            'trunks': trunks,
-            'count': len(trunks)
+            'trunks': [entry['name'] for entry in entries],
+            'endpoints': entries,
+            'count': len(entries),
+            'age': cache.age()
         }), 200
     except Exception as e:
         return jsonify({
@@ -457,24 +543,24 @@ def list_trunks():
 
 @app.route('/api/asterisk/trunk/<trunk_name>', methods=['GET'])
 def get_trunk_status(trunk_name):
-    """دریافت وضعیت یک trunk"""
+    """دریافت وضعیت یک trunk (از snapshot حافظه)"""
     try:
-        manager = AsteriskManager()
-        success, error_msg = manager.connect()
-        if not success:
+        available, entry, error_msg = get_trunk_status_cache().get(trunk_name)
+        if not available:
             return jsonify({
                 'status': 'error',
                 'message': 'امکان اتصال به Asterisk وجود ندارد',
                 'error_details': error_msg
             }), 500
 
-        status = manager.get_trunk_status(trunk_name)
-        manager.disconnect()
-
+        if entry is None:
+            info = {'status': 'not_found'}
+        else:
+            info = {'status': 'exists', **entry}
         return jsonify({
             'status': 'success',
             'trunk': trunk_name,
-            'info': status
+            'info': info
         }), 200
     except Exception as e:
         return jsonify({
@@ -483,69 +569,9 @@ def get_trunk_status(trunk_name):
         }), 500
 
 
-def init_trunks_table():
-    """ایجاد جدول trunks در دیتابیس در صورت عدم وجود"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS trunks (
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) UNIQUE NOT NULL,
-                config JSONB NOT NULL,
-                asterisk_config TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"خطا در ایجاد جدول trunks: {e}")
-        if conn:
-            conn.close()
-        return False
-
-
-def init_asterisk_config_table():
-    """ایجاد جدول asterisk_config در دیتابیس در صورت عدم وجود"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS asterisk_config (
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) UNIQUE NOT NULL DEFAULT 'default',
-                host VARCHAR(255),
-                port INTEGER DEFAULT 5038,
-                username VARCHAR(255),
-                secret VARCHAR(255),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"خطا در ایجاد جدول asterisk_config: {e}")
-        if conn:
-            conn.close()
-        return False
-
-
 def get_asterisk_config_from_db(name: str = 'default'):
     """
-    خواندن تنظیمات Asterisk از دیتابیس
+    خواندن تنظیمات Asterisk از دیتابیس (از طریق cache تنظیمات)
 
     Args:
         name: نام پیکربندی (پیش‌فرض: 'default')
@@ -553,35 +579,7 @@ def get_asterisk_config_from_db(name: str = 'default'):
     Returns:
         دیکشنری تنظیمات یا None
     """
-    init_asterisk_config_table()
-    conn = get_db_connection()
-    if not conn:
-        return None
-
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT host, port, username, secret
-            FROM asterisk_config
-            WHERE name = %s
-        """, (name,))
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
-
-        if row and row[0]:  # اگر host موجود باشد
-            return {
-                'host': row[0],
-                'port': row[1] or 5038,
-                'username': row[2],
-                'secret': row[3]
-            }
-        return None
-    except Exception as e:
-        print(f"خطا در خواندن تنظیمات Asterisk از دیتابیس: {e}")
-        if conn:
-            conn.close()
-        return None
+    return get_config_cache().get(name)
 
 
 @app.route('/api/asterisk/trunk', methods=['POST'])
@@ -622,7 +620,13 @@ def create_trunk():
                 'disallow': data.get('disallow', 'all'),
                 'context': data.get('context', 'from-trunk'),
                 'allow': data.get('allow', 'ulaw,alaw'),
+                # technology کانال هنگام تماس (SIP یا PJSIP)
+                'technology': data.get('technology', 'SIP'),
             }
+            # محدودیت ظرفیت trunk (در صورت عدم ارسال، مقدار پیش‌فرض)
+            for key in ('max_channels', 'cps'):
+                if data.get(key) is not None:
+                    config[key] = data[key]
 
         # اعتبارسنجی
         is_valid, error_msg = TrunkConfig.validate(config)
@@ -636,7 +640,6 @@ def create_trunk():
         asterisk_config = TrunkConfig.to_asterisk_config(trunk_name, config)
 
         # ذخیره در دیتابیس
-        init_trunks_table()
         conn = get_db_connection()
         if not conn:
             return jsonify({
@@ -658,9 +661,16 @@ def create_trunk():
             """, (trunk_name, Json(config), asterisk_config))
 
             result = cursor.fetchone()
+            # workerهای دیگر پس از commit فهرست trunk را دوباره می‌خوانند
+            cursor.execute(
+                "SELECT pg_notify(%s, %s)", (TRUNKS_CHANNEL, trunk_name)
+            )
             conn.commit()
             cursor.close()
             conn.close()
+            get_trunk_registry().load()
+            # وضعیت endpoint جدید در درخواست بعدی از Asterisk خوانده می‌شود
+            get_trunk_status_cache().invalidate()
 
             return jsonify({
                 'status': 'success',
@@ -701,7 +711,6 @@ def get_trunk_config():
         asterisk_config = None
 
         # اول از دیتابیس بخوان
-        init_trunks_table()
         conn = get_db_connection()
         if conn:
             try:
@@ -720,7 +729,7 @@ def get_trunk_config():
                     asterisk_config = row[1]
                     source = 'database'
             except Exception as e:
-                print(f"خطا در خواندن از دیتابیس: {e}")
+                logger.error("خطا در خواندن trunk از دیتابیس: %s", e)
                 if conn:
                     conn.close()
 
@@ -763,7 +772,6 @@ def get_trunk_config():
 def list_trunks_from_db():
     """دریافت لیست trunk‌ها از دیتابیس"""
     try:
-        init_trunks_table()
         conn = get_db_connection()
         if not conn:
             return jsonify({
@@ -817,7 +825,6 @@ def list_trunks_from_db():
 def get_trunk_from_db(trunk_name):
     """دریافت پیکربندی trunk از دیتابیس"""
     try:
-        init_trunks_table()
         conn = get_db_connection()
         if not conn:
             return jsonify({
@@ -889,80 +896,48 @@ def make_simple_call():
                 'message': 'شماره تماس الزامی است'
             }), 400
 
-        # اتصال به Asterisk
-        manager = AsteriskManager()
-        if not all([
-            manager.host,
-            manager.port,
-            manager.username,
-            manager.secret
-        ]):
+        # انتخاب سرور Asterisk و دریافت session آماده از AMI pool آن
+        router = get_asterisk_router()
+        if not router.is_configured():
             return jsonify({
                 'status': 'error',
                 'message': 'تنظیمات Asterisk کامل نیست'
             }), 400
 
-        success, error = manager.connect()
-        if not success:
+        # trunk واقعی از فهرست trunkهای داخل حافظه؛ سرور بر اساس آن
+        # انتخاب می‌شود
+        trunk = get_trunk_registry().resolve(trunk_name)
+        manager, error, server = router.acquire(trunk.name)
+        if manager is None:
             return jsonify({
                 'status': 'error',
                 'message': f'خطا در اتصال به Asterisk: {error}'
             }), 500
 
         try:
-            # خواندن trunk name واقعی از دیتابیس
-            # اگر trunk name مشخص نشده یا trunk_external است، از trunk واقعی استفاده می‌کنیم
-            actual_trunk_name = trunk_name
-            
-            # خواندن trunk config از دیتابیس
-            init_trunks_table()
-            conn = get_db_connection()
-            if conn:
-                try:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        SELECT name, config
-                        FROM trunks
-                        WHERE name = %s
-                        LIMIT 1
-                    """, (trunk_name,))
-                    row = cursor.fetchone()
-                    cursor.close()
-                    conn.close()
-                    
-                    if row:
-                        # اگر trunk در دیتابیس پیدا شد، از نام آن استفاده می‌کنیم
-                        actual_trunk_name = row[0]
-                        print(f"Found trunk in database: {actual_trunk_name}")
-                except Exception as e:
-                    print(f"خطا در خواندن trunk از دیتابیس: {e}")
-                    if conn:
-                        conn.close()
-            
-            # اگر trunk_external است و در دیتابیس پیدا نشد، از trunk واقعی استفاده می‌کنیم
-            # از لیست Issabel مشخص است که trunk name واقعی 0utgoing-2191012787 است
-            if actual_trunk_name == 'trunk_external' or not actual_trunk_name:
-                # از لیست Issabel، trunk name واقعی 0utgoing-2191012787 است
-                actual_trunk_name = '0utgoing-2191012787'
-                print(f"Using default trunk: {actual_trunk_name}")
-            
             # ساخت کانال برای تماس
-            # برای تماس مستقیم از trunk، از SIP/trunk/number استفاده می‌کنیم
             # توجه: در Issabel، trunk name باید دقیقاً همان باشد که در sip show peers نشان داده می‌شود
-            channel = f"SIP/{actual_trunk_name}/{number}"
+            channel = trunk.dial_string(number)
             if not caller_id:
                 caller_id = number
 
             # برقراری تماس
-            print(f"Calling {number} via {channel}")
-            print(f"Using trunk: {actual_trunk_name}")
-            success_call, message, action_id = manager.originate_call(
-                channel=channel,
-                number=number,
-                caller_id=caller_id,
-                context="from-trunk",
-                timeout=30
+            logger.info(
+                "Calling %s via %s", number, channel,
+                extra={'trunk': trunk.name}
             )
+            try:
+                success_call, message, action_id = manager.originate_call(
+                    channel=channel,
+                    number=number,
+                    caller_id=caller_id,
+                    context="from-trunk",
+                    timeout=30,
+                    dial_string=channel,
+                    trunk=trunk
+                )
+            except RateLimitExceeded as e:
+                return json_response(rate_limited_payload(e), 429)
 
             if not success_call:
                 return jsonify({
@@ -974,12 +949,13 @@ def make_simple_call():
                 'status': 'success',
                 'message': f'تماس با {number} با موفقیت آغاز شد',
                 'number': number,
-                'action_id': action_id
+                'action_id': action_id,
+                'server': server
             }), 200
 
         finally:
-            # در واقعیت باید پس از پایان تماس قطع شود
-            pass
+            # session به pool برمی‌گردد و برای تماس بعدی دوباره استفاده می‌شود
+            router.release(server, manager)
 
     except Exception as e:
         return jsonify({
@@ -988,9 +964,318 @@ def make_simple_call():
         }), 500
 
 
+def run_masked_call(
+    state_machine: CallSessionStateMachine,
+    number_a: str,
+    number_b: str,
+    caller_id: Optional[str],
+    trunk_name: str,
+    answer_timeout: float,
+    limit_wait: Optional[float] = None
+) -> tuple[Dict[str, Any], int]:
+    """
+    اجرای کامل یک تماس مسدود: A → انتظار پاسخ → B
+
+    هم در endpoint هم‌زمان و هم در orchestrator پس‌زمینه استفاده می‌شود.
+
+    Args:
+        state_machine: ماشین حالت جلسه
+        number_a: شماره تماس گیرنده
+        number_b: شماره مقصد
+        caller_id: شماره نمایش داده شده (اختیاری)
+        trunk_name: نام trunk
+        answer_timeout: حداکثر زمان انتظار برای پاسخ شماره A (ثانیه)
+        limit_wait: حداکثر انتظار برای ظرفیت trunk
+            (پیش‌فرض: TRUNK_LIMIT_WAIT)
+
+    Returns:
+        tuple (payload, http_status)
+    """
+    session_id = state_machine.get_session_id()
+    # جلسه در registry ثبت می‌شود تا Eventهای AMI کانال‌هایش به آن برسند
+    registry = get_session_registry()
+    entry = registry.register(state_machine)
+    # Hangupها جلسه را COMPLETED و legهای یتیم را قطع می‌کنند
+    get_call_supervisor()
+
+    # انتخاب سرور Asterisk و دریافت session آماده از AMI pool آن
+    router = get_asterisk_router()
+    if not router.is_configured():
+        state_machine.transition_to(CallState.FAILED_SYSTEM)
+        return {
+            'status': 'error',
+            'message': 'تنظیمات Asterisk کامل نیست',
+            'session_id': session_id,
+            'state': state_machine.get_current_state().value
+        }, 400
+
+    # trunk واقعی از فهرست trunkهای داخل حافظه؛ سرور بر اساس آن انتخاب می‌شود
+    trunk = get_trunk_registry().resolve(trunk_name)
+    manager, error, server = router.acquire(trunk.name)
+    if manager is None:
+        state_machine.transition_to(CallState.FAILED_SYSTEM)
+        return {
+            'status': 'error',
+            'message': f'خطا در اتصال به Asterisk: {error}',
+            'session_id': session_id,
+            'state': state_machine.get_current_state().value
+        }, 500
+    # supervisor legها را روی همین سرور قطع می‌کند
+    entry.server = server
+
+    try:
+        # شروع تماس: انتقال به حالت CALLING_A؛ جلسه‌ای که sweeper یا مسیر
+        # دیگری بسته است نباید Originate واقعی ارسال کند
+        if not state_machine.transition_to(CallState.CALLING_A):
+            return session_closed_payload(session_id, state_machine), 409
+
+        # ساخت کانال برای شماره A
+        channel_a = trunk.dial_string(number_a)
+        if not caller_id:
+            caller_id = number_a
+
+        # برای bridge کردن دو تماس بدون وابستگی به dialplan:
+        # 1. تماس اول را برقرار می‌کنیم و منتظر می‌مانیم تا پاسخ دهد
+        # 2. پس از پاسخ، تماس دوم را برقرار می‌کنیم و مستقیماً به channel تماس اول dial می‌کنیم
+        # 3. این باعث می‌شود که دو تماس مستقیماً bridge شوند
+
+        # برقراری تماس با شماره A (مستقیم بدون dialplan) و انتظار
+        # برای پاسخ او بر اساس Eventهای AMI
+        logger.info(
+            "Calling %s via %s", number_a, channel_a,
+            extra={'session_id': session_id}
+        )
+        uniqueid_a = new_channel_uniqueid()
+        registry.bind(session_id, 'a', uniqueid=uniqueid_a)
+        try:
+            success_a, message_a, channel_a_id = (
+                manager.originate_call_direct(
+                    channel=channel_a,
+                    number=number_a,
+                    caller_id=caller_id,
+                    timeout=30,
+                    answer_timeout=answer_timeout,
+                    dial_string=channel_a,
+                    trunk=trunk,
+                    limit_wait=limit_wait,
+                    uniqueid=uniqueid_a
+                )
+            )
+        except RateLimitExceeded as e:
+            # تماسی برقرار نشده است؛ ظرفیت trunk پر است
+            state_machine.transition_to(CallState.FAILED_SYSTEM)
+            return rate_limited_payload(e, session_id, state_machine), 429
+
+        if not success_a:
+            state_machine.transition_to(CallState.FAILED_A)
+            return {
+                'status': 'error',
+                'message': f'خطا در تماس با {number_a}: {message_a}',
+                'session_id': session_id,
+                'state': state_machine.get_current_state().value
+            }, 500
+
+        # انتقال به حالت CONNECTED_A فقط پس از پاسخ واقعی
+        registry.bind(session_id, 'a', channel=channel_a_id)
+        # تماس با شماره B و bridge مستقیم با تماس اول؛ اگر جلسه در این
+        # فاصله بسته شده باشد B شماره‌گیری نمی‌شود
+        if not (
+            state_machine.transition_to(CallState.CONNECTED_A) and
+            state_machine.transition_to(CallState.CALLING_B)
+        ):
+            payload = session_closed_payload(session_id, state_machine)
+            payload['number_a_connected'] = True
+            payload['channel_a_id'] = channel_a_id
+            return payload, 409
+        channel_b = trunk.dial_string(number_b)
+
+        # استفاده از originate_bridge_call که مستقیماً به channel تماس اول dial می‌کند
+        logger.info(
+            "Calling %s via %s to bridge with %s",
+            number_b, channel_b, channel_a_id,
+            extra={'session_id': session_id}
+        )
+        uniqueid_b = new_channel_uniqueid()
+        registry.bind(session_id, 'b', uniqueid=uniqueid_b)
+        try:
+            success_b, message_b, action_id_b = manager.originate_bridge_call(
+                channel=channel_b,
+                bridge_channel=channel_a_id,  # Dial مستقیم به channel تماس اول
+                caller_id=caller_id,
+                timeout=30,
+                trunk=trunk,
+                limit_wait=limit_wait,
+                uniqueid=uniqueid_b
+            )
+        except RateLimitExceeded as e:
+            state_machine.transition_to(CallState.FAILED_B)
+            payload = rate_limited_payload(e, session_id, state_machine)
+            payload['number_a_connected'] = True
+            payload['channel_a_id'] = channel_a_id
+            return payload, 429
+
+        if not success_b:
+            state_machine.transition_to(CallState.FAILED_B)
+            return {
+                'status': 'error',
+                'message': f'خطا در bridge کردن با {number_b}: {message_b}',
+                'session_id': session_id,
+                'state': state_machine.get_current_state().value,
+                'number_a_connected': True,
+                'channel_a_id': channel_a_id
+            }, 500
+
+        # انتقال به حالت BRIDGED؛ اگر یکی از legها در حین شماره‌گیری B قطع
+        # شده باشد supervisor جلسه را بسته است و B هم قطع می‌شود
+        if not state_machine.transition_to(CallState.BRIDGED):
+            get_call_supervisor().teardown(
+                session_id, 'aborted', recheck=('b',)
+            )
+            payload = session_closed_payload(session_id, state_machine)
+            payload['number_a_connected'] = True
+            payload['channel_a_id'] = channel_a_id
+            return payload, 409
+
+        return {
+            'status': 'success',
+            'message': 'تماس با موفقیت برقرار شد',
+            'session_id': session_id,
+            'state': state_machine.get_current_state().value,
+            'number_a': number_a,
+            'number_b': number_b,
+            'channel_ids': {
+                'a': channel_a_id,
+                'b': None
+            },
+            'uniqueids': {
+                'a': uniqueid_a,
+                'b': uniqueid_b
+            },
+            'bridge_method': 'direct_dial',
+            'server': server,
+            'state_history': [
+                state.value for state in state_machine.get_state_history()
+            ]
+        }, 200
+
+    finally:
+        # session به pool برمی‌گردد و برای تماس بعدی دوباره استفاده می‌شود
+        router.release(server, manager)
+
+
+def rate_limited_payload(
+    error: RateLimitExceeded,
+    session_id: Optional[str] = None,
+    state_machine: Optional[CallSessionStateMachine] = None
+) -> Dict[str, Any]:
+    """
+    پاسخ 429 برای تماسی که به دلیل پر بودن ظرفیت trunk ارسال نشد
+
+    Args:
+        error: خطای limiter
+        session_id: شناسه جلسه (اختیاری)
+        state_machine: ماشین حالت جلسه (اختیاری)
+    """
+    payload = {
+        'status': 'error',
+        'code': 'rate_limited',
+        'message': str(error),
+        'trunk': error.trunk_name,
+        'reason': error.reason,
+        'retry_after': round(error.retry_after, 3),
+    }
+    if session_id is not None:
+        payload['session_id'] = session_id
+    if state_machine is not None:
+        payload['state'] = state_machine.get_current_state().value
+    return payload
+
+
+def session_closed_payload(
+    session_id: str,
+    state_machine: CallSessionStateMachine
+) -> Dict[str, Any]:
+    """
+    پاسخ 409 برای جلسه‌ای که قبل از مرحله بعدی تماس بسته شده است
+
+    Args:
+        session_id: شناسه جلسه
+        state_machine: ماشین حالت جلسه
+    """
+    return {
+        'status': 'error',
+        'code': 'session_closed',
+        'message': 'جلسه تماس قبل از ادامه تماس بسته شده است',
+        'session_id': session_id,
+        'state': state_machine.get_current_state().value
+    }
+
+
+def json_response(payload: Dict[str, Any], status: int):
+    """پاسخ JSON؛ برای 429 هدر Retry-After هم ارسال می‌شود"""
+    response = jsonify(payload)
+    response.status_code = status
+    if status == 429 and 'retry_after' in payload:
+        response.headers['Retry-After'] = str(
+            max(1, int(payload['retry_after'] + 0.999))
+        )
+    return response
+
+
+def submit_masked_call(
+    number_a: str,
+    number_b: str,
+    caller_id: Optional[str],
+    trunk_name: str,
+    answer_timeout: float
+) -> tuple[Dict[str, Any], int]:
+    """
+    ثبت تماس مسدود در orchestrator پس‌زمینه و بازگشت فوری
+
+    Returns:
+        tuple (payload, http_status) با وضعیت 202
+    """
+    state_machine = CallSessionStateMachine()
+    session_id = get_orchestrator().submit(
+        state_machine,
+        run_masked_call,
+        number_a=number_a,
+        number_b=number_b,
+        caller_id=caller_id,
+        trunk_name=trunk_name,
+        answer_timeout=answer_timeout
+    )
+    return {
+        'status': 'accepted',
+        'message': 'تماس در صف برقراری قرار گرفت',
+        'session_id': session_id,
+        'state': state_machine.get_current_state().value,
+        'status_url': f'/api/call/{session_id}'
+    }, 202
+
+
+def wants_background(data: Dict[str, Any], args) -> bool:
+    """
+    بررسی درخواست اجرای تماس در پس‌زمینه (فیلد async یا ?async=1)
+
+    Args:
+        data: body درخواست
+        args: پارامترهای query string
+    """
+    flag = data.get('async', args.get('async', False))
+    if isinstance(flag, str):
+        return flag.lower() in ('1', 'true', 'yes')
+    return bool(flag)
+
+
 @app.route('/api/call/make', methods=['POST'])
 def make_call():
-    """برقراری تماس مسدود بین دو شماره"""
+    """
+    برقراری تماس مسدود بین دو شماره
+
+    با "async": true جلسه در پس‌زمینه اجرا می‌شود و پاسخ 202 همراه با
+    session_id بلافاصله برمی‌گردد.
+    """
     try:
         data = request.get_json()
         if not data:
@@ -1010,179 +1295,227 @@ def make_call():
                 'message': 'شماره تماس گیرنده و مقصد الزامی است'
             }), 400
 
-        # ایجاد State Machine
+        # حداکثر زمان انتظار برای پاسخ شماره A (ثانیه)
+        answer_timeout, error = parse_answer_timeout(
+            data.get('answer_timeout', CALL_ANSWER_TIMEOUT)
+        )
+        if answer_timeout is None:
+            return jsonify({'status': 'error', 'message': error}), 400
+
+        if wants_background(data, request.args):
+            payload, status = submit_masked_call(
+                number_a, number_b, caller_id, trunk_name, answer_timeout
+            )
+            return json_response(payload, status)
+
+        # ایجاد State Machine و اجرای تماس در همین درخواست
         state_machine = CallSessionStateMachine()
-        session_id = state_machine.get_session_id()
-
-        # اتصال به Asterisk
-        manager = AsteriskManager()
-        if not all([
-            manager.host,
-            manager.port,
-            manager.username,
-            manager.secret
-        ]):
-            state_machine.transition_to(CallState.FAILED_SYSTEM)
-            return jsonify({
-                'status': 'error',
-                'message': 'تنظیمات Asterisk کامل نیست',
-                'session_id': session_id,
-                'state': state_machine.get_current_state().value
-            }), 400
+        payload, status = run_masked_call(
+            state_machine,
+            number_a=number_a,
+            number_b=number_b,
+            caller_id=caller_id,
+            trunk_name=trunk_name,
+            answer_timeout=answer_timeout
+        )
+        return json_response(payload, status)
 
-        success, error = manager.connect()
-        if not success:
-            state_machine.transition_to(CallState.FAILED_SYSTEM)
-            return jsonify({
-                'status': 'error',
-                'message': f'خطا در اتصال به Asterisk: {error}',
-                'session_id': session_id,
-                'state': state_machine.get_current_state().value
-            }), 500
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'خطا: {str(e)}'
+        }), 500
 
-        try:
-            # خواندن trunk name واقعی از دیتابیس
-            actual_trunk_name = trunk_name
-            init_trunks_table()
-            conn = get_db_connection()
-            if conn:
-                try:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        SELECT name, config
-                        FROM trunks
-                        WHERE name = %s
-                        LIMIT 1
-                    """, (trunk_name,))
-                    row = cursor.fetchone()
-                    cursor.close()
-                    conn.close()
-                    
-                    if row:
-                        actual_trunk_name = row[0]
-                        print(f"Found trunk in database: {actual_trunk_name}")
-                except Exception as e:
-                    print(f"خطا در خواندن trunk از دیتابیس: {e}")
-                    if conn:
-                        conn.close()
-            
-            # اگر trunk_external است و در دیتابیس پیدا نشد، از trunk واقعی استفاده می‌کنیم
-            if actual_trunk_name == 'trunk_external' or not actual_trunk_name:
-                actual_trunk_name = '0utgoing-2191012787'
-                print(f"Using default trunk: {actual_trunk_name}")
-
-            # شروع تماس: انتقال به حالت CALLING_A
-            state_machine.transition_to(CallState.CALLING_A)
-
-            # ساخت کانال برای شماره A
-            channel_a = f"SIP/{actual_trunk_name}/{number_a}"
-            if not caller_id:
-                caller_id = number_a
-
-            # برای bridge کردن دو تماس بدون وابستگی به dialplan:
-            # 1. تماس اول را برقرار می‌کنیم و منتظر می‌مانیم تا پاسخ دهد
-            # 2. پس از پاسخ، تماس دوم را برقرار می‌کنیم و مستقیماً به channel تماس اول dial می‌کنیم
-            # 3. این باعث می‌شود که دو تماس مستقیماً bridge شوند
-            
-            # برقراری تماس با شماره A (مستقیم بدون dialplan)
-            print(f"Calling {number_a} via {channel_a}")
-            success_a, message_a, channel_a_id = manager.originate_call_direct(
-                channel=channel_a,
-                number=number_a,
-                caller_id=caller_id,
-                timeout=30
-            )
 
-            if not success_a:
-                state_machine.transition_to(CallState.FAILED_A)
-                return jsonify({
-                    'status': 'error',
-                    'message': f'خطا در تماس با {number_a}: {message_a}',
-                    'session_id': session_id,
-                    'state': state_machine.get_current_state().value
-                }), 500
+def _ndjson_response(lines, status: int = 200) -> Response:
+    """پاسخ NDJSON که هر شیء را به محض آماده شدن ارسال می‌کند"""
+    def generate():
+        for line in lines:
+            yield json.dumps(line, ensure_ascii=False) + '\n'
+    return Response(
+        generate(), status=status, mimetype='application/x-ndjson'
+    )
 
-            # Channel ID واقعی از originate_call_direct برگردانده شده است
-            # اگر Channel ID نداریم یا Channel ID همان channel name است، از response استخراج می‌کنیم
-            if not channel_a_id or channel_a_id == channel_a:
-                # استخراج Channel ID واقعی از response (از Events)
-                import re
-                channel_match = re.search(
-                    r'Channel:\s*(SIP/[^\r\n]+-\d+)',
-                    message_a
-                )
-                if channel_match:
-                    channel_a_id = channel_match.group(1)
-                    print(f"Found real Channel ID from Events: {channel_a_id}")
-                else:
-                    # اگر پیدا نشد، از channel name استفاده می‌کنیم
-                    channel_a_id = channel_a
-                    print(f"Using channel name as Channel ID: {channel_a_id}")
-
-            # منتظر می‌مانیم تا تماس اول پاسخ دهد
-            # در واقعیت، باید از Events استفاده کنیم تا بفهمیم تماس پاسخ داده است
-            # برای حالا، یک تاخیر کوتاه اضافه می‌کنیم تا کاربر پاسخ دهد
-            import time
-            print(f"Waiting for {number_a} to answer...")
-            time.sleep(5)  # منتظر می‌مانیم تا کاربر پاسخ دهد
-            
-            # انتقال به حالت CONNECTED_A (پس از پاسخ)
-            state_machine.transition_to(CallState.CONNECTED_A)
-
-            # تماس با شماره B و bridge مستقیم با تماس اول
-            state_machine.transition_to(CallState.CALLING_B)
-            channel_b = f"SIP/{actual_trunk_name}/{number_b}"
 
-            # استفاده از originate_bridge_call که مستقیماً به channel تماس اول dial می‌کند
-            print(f"Calling {number_b} via {channel_b} to bridge with {channel_a_id}")
-            success_b, message_b, action_id_b = manager.originate_bridge_call(
-                channel=channel_b,
-                bridge_channel=channel_a_id,  # Dial مستقیم به channel تماس اول
-                caller_id=caller_id,
-                timeout=30
-            )
+def submit_batch(
+    body: bytes,
+    ndjson: bool = False
+) -> tuple[Dict[str, Any], int, Optional[CallBatch]]:
+    """
+    اعتبارسنجی و ثبت یک batch (مشترک بین Flask و asgi)
 
-            if not success_b:
-                state_machine.transition_to(CallState.FAILED_B)
-                return jsonify({
-                    'status': 'error',
-                    'message': f'خطا در bridge کردن با {number_b}: {message_b}',
-                    'session_id': session_id,
-                    'state': state_machine.get_current_state().value,
-                    'number_a_connected': True,
-                    'channel_a_id': channel_a_id
-                }), 500
+    Args:
+        body: body درخواست
+        ndjson: آیا body به صورت NDJSON است
 
-            # انتقال به حالت BRIDGED
-            state_machine.transition_to(CallState.BRIDGED)
+    Returns:
+        tuple (payload، کد وضعیت HTTP، batch ثبت شده یا None)
+    """
+    success, entries = parse_batch_body(body, ndjson=ndjson)
+    if not success:
+        return {'status': 'error', 'message': entries}, 400, None
 
-            return jsonify({
-                'status': 'success',
-                'message': 'تماس با موفقیت برقرار شد',
-                'session_id': session_id,
-                'state': state_machine.get_current_state().value,
-                'number_a': number_a,
-                'number_b': number_b,
-                'channel_ids': {
-                    'a': channel_a_id,
-                    'b': None
-                },
-                'bridge_method': 'direct_dial',
-                'state_history': [
-                    state.value for state in state_machine.get_state_history()
-                ]
-            }), 200
+    if len(entries) > CALL_BATCH_MAX:
+        return {
+            'status': 'error',
+            'message': f'حداکثر {CALL_BATCH_MAX} تماس در هر batch مجاز است'
+        }, 413, None
+
+    valid, rejected = [], []
+    for position, entry in enumerate(entries):
+        params, error = normalize_entry(entry, CALL_ANSWER_TIMEOUT)
+        if params is None:
+            rejected.append({'position': position, 'message': error})
+        else:
+            valid.append(params)
 
-        finally:
-            # در واقعیت باید پس از پایان تماس قطع شود
-            pass
+    if not valid:
+        return {
+            'status': 'error',
+            'message': 'هیچ ورودی معتبری ارسال نشده است',
+            'rejected': rejected
+        }, 400, None
+
+    batch, error = get_batch_dispatcher().submit(valid, run_masked_call)
+    if batch is None:
+        return {'status': 'error', 'message': error}, 500, None
+
+    return {
+        'status': 'accepted',
+        'batch_id': batch.batch_id,
+        'accepted': batch.total,
+        'rejected': rejected,
+        'sessions': [item['session_id'] for item in batch.items],
+        'status_url': f'/api/call/batch/{batch.batch_id}',
+        'results_url': f'/api/call/batch/{batch.batch_id}/results',
+    }, 202, batch
+
+
+@app.route('/api/call/batch', methods=['POST'])
+def make_batch_call():
+    """
+    ثبت batch از تماس‌های مسدود
 
-    except Exception as e:
+    body یک لیست JSON (یا {"calls": [...]}) یا NDJSON از
+    {number_a, number_b, caller_id, trunk} است. ورودی‌های نامعتبر در
+    rejected برگردانده می‌شوند. با ?stream=1 نتیجه هر جلسه پس از پایان
+    در همین پاسخ (NDJSON) ارسال می‌شود.
+    """
+    ndjson = 'ndjson' in (request.content_type or '')
+    payload, status, batch = submit_batch(request.get_data(), ndjson)
+    if batch is not None and wants_stream(request.args):
+        return _ndjson_response(
+            itertools.chain([payload], batch.stream()), status=status
+        )
+    return jsonify(payload), status
+
+
+def wants_stream(args) -> bool:
+    """بررسی ?stream=1 برای ارسال نتایج به صورت NDJSON"""
+    return args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+@app.route('/api/call/batch/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    """خلاصه وضعیت یک batch"""
+    batch = get_batch_dispatcher().get(batch_id)
+    if batch is not None:
+        return jsonify({'status': 'success', 'batch': batch.summary()}), 200
+
+    stored = load_batch(batch_id)
+    if stored is None:
         return jsonify({
             'status': 'error',
-            'message': f'خطا: {str(e)}'
+            'message': f'batch {batch_id} یافت نشد'
+        }), 404
+    return jsonify({'status': 'success', 'batch': stored['summary']}), 200
+
+
+@app.route('/api/call/batch/<batch_id>/results', methods=['GET'])
+def get_batch_results(batch_id):
+    """
+    نتایج جلسه‌های یک batch به صورت NDJSON
+
+    برای batchی که در همین worker اجرا می‌شود نتایج تا پایان batch
+    stream می‌شوند؛ در غیر این صورت وضعیت فعلی از دیتابیس برگردانده
+    می‌شود.
+    """
+    batch = get_batch_dispatcher().get(batch_id)
+    if batch is not None:
+        return _ndjson_response(batch.stream())
+
+    stored = load_batch(batch_id)
+    if stored is None:
+        return jsonify({
+            'status': 'error',
+            'message': f'batch {batch_id} یافت نشد'
+        }), 404
+    return _ndjson_response([*stored['results'], stored['summary']])
+
+
+@app.route('/api/call/sessions', methods=['GET'])
+def get_call_sessions():
+    """فهرست آخرین جلسه‌های تماس ثبت شده در دیتابیس"""
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'limit باید عدد باشد'
+        }), 400
+
+    sessions = list_sessions(request.args.get('state'), limit)
+    if sessions is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'خطا در خواندن جلسه‌ها از دیتابیس'
         }), 500
 
+    return jsonify({
+        'status': 'success',
+        'sessions': sessions,
+        'count': len(sessions)
+    }), 200
+
+
+@app.route('/api/call/<session_id>', methods=['GET'])
+def get_call_status(session_id):
+    """
+    دریافت وضعیت و تاریخچه یک جلسه تماس
+
+    جلسه‌های در حال اجرا از orchestrator و بقیه (از جمله جلسه‌های
+    پیش از restart یا worker دیگر) از جدول call_sessions خوانده می‌شوند.
+    """
+    info = get_orchestrator().get(session_id) or load_session(session_id)
+    if info is None:
+        return jsonify({
+            'status': 'error',
+            'message': f'جلسه {session_id} یافت نشد'
+        }), 404
+
+    return jsonify({
+        'status': 'success',
+        'session': info
+    }), 200
+
+
+@app.route('/api/call/<session_id>/hangup', methods=['POST'])
+def hangup_call(session_id):
+    """قطع تمام legهای زنده یک جلسه تماس"""
+    if not get_call_supervisor().teardown(session_id, 'api'):
+        return jsonify({
+            'status': 'error',
+            'message': f'جلسه {session_id} یافت نشد'
+        }), 404
+
+    return jsonify({
+        'status': 'success',
+        'message': 'درخواست قطع تماس ثبت شد',
+        'session_id': session_id
+    }), 202
+
 
 if __name__ == '__main__':
+    ensure_migrated()
+    get_warmup().start()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,502 @@
+import asyncio
+import json
+import os
+import re
+from urllib.parse import parse_qsl
+from typing import Optional, Dict, Any, AsyncIterator, Iterable
+
+from a2wsgi import WSGIMiddleware
+
+from app import (
+    app,
+    submit_masked_call,
+    wants_background,
+    rate_limited_payload,
+    session_closed_payload,
+    submit_batch,
+    wants_stream,
+    CALL_ANSWER_TIMEOUT,
+)
+from call_batch import (
+    get_batch_dispatcher,
+    load_batch,
+    parse_answer_timeout,
+)
+from rate_limit import RateLimitExceeded
+from ami_router import get_asterisk_router
+from session_store import get_session_store
+from trunk_registry import get_trunk_registry
+from async_asterisk_manager import (
+    AsyncAsteriskManager,
+    get_async_ami,
+    close_async_ami,
+)
+from asterisk_manager import new_channel_uniqueid
+from session_registry import get_session_registry
+from call_supervisor import get_call_supervisor
+from call_state_machine import CallSessionStateMachine, CallState
+from warmup import get_warmup
+
+
+# بقیه endpointها همچنان توسط Flask و در thread pool اجرا می‌شوند
+wsgi_application = WSGIMiddleware(
+    app,
+    workers=int(os.getenv('WSGI_THREADS', '10'))
+)
+
+
+# نتایج batch به صورت native stream می‌شوند تا هر stream یک thread از
+# WSGI_THREADS را تا پایان batch اشغال نکند
+BATCH_RESULTS_PATH = re.compile(r'^/api/call/batch/([^/]+)/results$')
+
+
+async def _read_body(receive) -> bytes:
+    """خواندن کامل body درخواست"""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return body
+
+
+async def _read_json(receive) -> Optional[Dict[str, Any]]:
+    """خواندن body درخواست و تبدیل آن به JSON"""
+    body = await _read_body(receive)
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def _send_json(send, payload: Dict[str, Any], status: int):
+    """ارسال پاسخ JSON؛ برای 429 هدر Retry-After هم ارسال می‌شود"""
+    body = json.dumps(payload).encode()
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+    ]
+    if status == 429 and 'retry_after' in payload:
+        retry_after = max(1, int(payload['retry_after'] + 0.999))
+        headers.append((b'retry-after', str(retry_after).encode()))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers,
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_ndjson(
+    send,
+    lines: Iterable[Dict[str, Any]],
+    status: int = 200,
+    stream: Optional[AsyncIterator[Dict[str, Any]]] = None
+):
+    """ارسال پاسخ NDJSON؛ ابتدا lines و سپس هر خروجی stream به محض آماده شدن"""
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/x-ndjson')],
+    })
+
+    async def chunk(line: Dict[str, Any]):
+        await send({
+            'type': 'http.response.body',
+            'body': (json.dumps(line, ensure_ascii=False) + '\n').encode(),
+            'more_body': True,
+        })
+
+    for line in lines:
+        await chunk(line)
+    if stream is not None:
+        async for line in stream:
+            await chunk(line)
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _acquire_async_ami(
+    trunk_name: str
+) -> tuple[Optional[AsyncAsteriskManager], str, Optional[str]]:
+    """
+    انتخاب سرور Asterisk و دریافت اتصال async مشترک آن
+
+    در صورت شکست login سرور بعدی امتحان می‌شود. تا router.end(server)
+    تماس در حال شروع روی سرور انتخاب شده شمرده می‌شود.
+
+    Returns:
+        tuple (manager, error_message, config_name)
+    """
+    router = get_asterisk_router()
+    tried = []
+    error = "هیچ سرور Asterisk فعالی برای این trunk وجود ندارد"
+    while True:
+        server = router.route(trunk_name, exclude=tried)
+        if server is None:
+            return None, error, None
+        tried.append(server)
+        manager, error = await get_async_ami(router.pool(server).settings())
+        if manager is not None:
+            router.begin(server)
+            return manager, "", server
+        router.report_failure(server, error)
+
+
+async def make_simple_call(
+    data: Optional[Dict[str, Any]],
+    query: Dict[str, str]
+):
+    """نسخه async از /api/call/simple"""
+    if not data:
+        return {
+            'status': 'error',
+            'message': 'اطلاعات ارسالی نامعتبر است'
+        }, 400
+
+    number = data.get('number')
+    caller_id = data.get('caller_id')
+    trunk_name = data.get('trunk', 'trunk_external')
+
+    if not number:
+        return {
+            'status': 'error',
+            'message': 'شماره تماس الزامی است'
+        }, 400
+
+    # تنظیمات و trunk از دیتابیس خوانده می‌شوند؛ خارج از event loop
+    router = get_asterisk_router()
+    if not await asyncio.to_thread(router.is_configured):
+        return {
+            'status': 'error',
+            'message': 'تنظیمات Asterisk کامل نیست'
+        }, 400
+
+    # trunk ناشناخته ممکن است از دیتابیس خوانده شود
+    trunk = await asyncio.to_thread(get_trunk_registry().resolve, trunk_name)
+    manager, error, server = await _acquire_async_ami(trunk.name)
+    if manager is None:
+        return {
+            'status': 'error',
+            'message': f'خطا در اتصال به Asterisk: {error}'
+        }, 500
+
+    try:
+        channel = trunk.dial_string(number)
+        if not caller_id:
+            caller_id = number
+
+        try:
+            success_call, message, action_id = await manager.originate_call(
+                channel=channel,
+                number=number,
+                caller_id=caller_id,
+                timeout=30,
+                dial_string=channel,
+                trunk=trunk
+            )
+        except RateLimitExceeded as e:
+            return rate_limited_payload(e), 429
+        if not success_call:
+            return {
+                'status': 'error',
+                'message': f'خطا در تماس با {number}: {message}'
+            }, 500
+
+        return {
+            'status': 'success',
+            'message': f'تماس با {number} با موفقیت آغاز شد',
+            'number': number,
+            'action_id': action_id,
+            'server': server
+        }, 200
+    finally:
+        router.end(server)
+
+
+async def make_call(
+    data: Optional[Dict[str, Any]],
+    query: Dict[str, str]
+):
+    """نسخه async از /api/call/make"""
+    if not data:
+        return {
+            'status': 'error',
+            'message': 'اطلاعات ارسالی نامعتبر است'
+        }, 400
+
+    number_a = data.get('number_a')
+    number_b = data.get('number_b')
+    caller_id = data.get('caller_id')
+    trunk_name = data.get('trunk', 'trunk_external')
+
+    if not number_a or not number_b:
+        return {
+            'status': 'error',
+            'message': 'شماره تماس گیرنده و مقصد الزامی است'
+        }, 400
+
+    answer_timeout, error = parse_answer_timeout(
+        data.get('answer_timeout', CALL_ANSWER_TIMEOUT)
+    )
+    if answer_timeout is None:
+        return {'status': 'error', 'message': error}, 400
+
+    if wants_background(data, query):
+        # ثبت در orchestrator بلاک نمی‌کند
+        return submit_masked_call(
+            number_a, number_b, caller_id, trunk_name, answer_timeout
+        )
+
+    state_machine = CallSessionStateMachine()
+    session_id = state_machine.get_session_id()
+    registry = get_session_registry()
+    entry = registry.register(state_machine)
+
+    router = get_asterisk_router()
+    if not await asyncio.to_thread(router.is_configured):
+        state_machine.transition_to(CallState.FAILED_SYSTEM)
+        return {
+            'status': 'error',
+            'message': 'تنظیمات Asterisk کامل نیست',
+            'session_id': session_id,
+            'state': state_machine.get_current_state().value
+        }, 400
+
+    trunk = await asyncio.to_thread(get_trunk_registry().resolve, trunk_name)
+    manager, error, server = await _acquire_async_ami(trunk.name)
+    if manager is None:
+        state_machine.transition_to(CallState.FAILED_SYSTEM)
+        return {
+            'status': 'error',
+            'message': f'خطا در اتصال به Asterisk: {error}',
+            'session_id': session_id,
+            'state': state_machine.get_current_state().value
+        }, 500
+    # supervisor legها را روی همین سرور قطع می‌کند
+    entry.server = server
+
+    try:
+        if not state_machine.transition_to(CallState.CALLING_A):
+            return session_closed_payload(session_id, state_machine), 409
+        channel_a = trunk.dial_string(number_a)
+        if not caller_id:
+            caller_id = number_a
+
+        uniqueid_a = new_channel_uniqueid()
+        registry.bind(session_id, 'a', uniqueid=uniqueid_a)
+        try:
+            success_a, message_a, channel_a_id = (
+                await manager.originate_call_direct(
+                    channel=channel_a,
+                    number=number_a,
+                    caller_id=caller_id,
+                    timeout=30,
+                    answer_timeout=answer_timeout,
+                    dial_string=channel_a,
+                    trunk=trunk,
+                    uniqueid=uniqueid_a
+                )
+            )
+        except RateLimitExceeded as e:
+            state_machine.transition_to(CallState.FAILED_SYSTEM)
+            return rate_limited_payload(e, session_id, state_machine), 429
+        if not success_a:
+            state_machine.transition_to(CallState.FAILED_A)
+            return {
+                'status': 'error',
+                'message': f'خطا در تماس با {number_a}: {message_a}',
+                'session_id': session_id,
+                'state': state_machine.get_current_state().value
+            }, 500
+
+        # CONNECTED_A فقط پس از پاسخ واقعی؛ event loop در این مدت آزاد است
+        registry.bind(session_id, 'a', channel=channel_a_id)
+        if not (
+            state_machine.transition_to(CallState.CONNECTED_A) and
+            state_machine.transition_to(CallState.CALLING_B)
+        ):
+            payload = session_closed_payload(session_id, state_machine)
+            payload['number_a_connected'] = True
+            payload['channel_a_id'] = channel_a_id
+            return payload, 409
+        channel_b = trunk.dial_string(number_b)
+        uniqueid_b = new_channel_uniqueid()
+        registry.bind(session_id, 'b', uniqueid=uniqueid_b)
+        try:
+            success_b, message_b, action_id_b = (
+                await manager.originate_bridge_call(
+                    channel=channel_b,
+                    bridge_channel=channel_a_id,
+                    caller_id=caller_id,
+                    timeout=30,
+                    trunk=trunk,
+                    uniqueid=uniqueid_b
+                )
+            )
+        except RateLimitExceeded as e:
+            state_machine.transition_to(CallState.FAILED_B)
+            payload = rate_limited_payload(e, session_id, state_machine)
+            payload['number_a_connected'] = True
+            payload['channel_a_id'] = channel_a_id
+            return payload, 429
+        if not success_b:
+            state_machine.transition_to(CallState.FAILED_B)
+            return {
+                'status': 'error',
+                'message': f'خطا در bridge کردن با {number_b}: {message_b}',
+                'session_id': session_id,
+                'state': state_machine.get_current_state().value,
+                'number_a_connected': True,
+                'channel_a_id': channel_a_id
+            }, 500
+
+        # انتقال به حالت BRIDGED؛ اگر یکی از legها در حین شماره‌گیری B قطع
+        # شده باشد supervisor جلسه را بسته است و B هم قطع می‌شود
+        if not state_machine.transition_to(CallState.BRIDGED):
+            get_call_supervisor().teardown(
+                session_id, 'aborted', recheck=('b',)
+            )
+            payload = session_closed_payload(session_id, state_machine)
+            payload['number_a_connected'] = True
+            payload['channel_a_id'] = channel_a_id
+            return payload, 409
+        return {
+            'status': 'success',
+            'message': 'تماس با موفقیت برقرار شد',
+            'session_id': session_id,
+            'state': state_machine.get_current_state().value,
+            'number_a': number_a,
+            'number_b': number_b,
+            'channel_ids': {
+                'a': channel_a_id,
+                'b': None
+            },
+            'uniqueids': {
+                'a': uniqueid_a,
+                'b': uniqueid_b
+            },
+            'bridge_method': 'direct_dial',
+            'server': server,
+            'state_history': [
+                state.value for state in state_machine.get_state_history()
+            ]
+        }, 200
+    finally:
+        router.end(server)
+
+
+async def make_batch_call(scope, receive, send):
+    """
+    ثبت batch (معادل POST /api/call/batch در Flask)
+
+    ثبت در دیتابیس در thread انجام می‌شود و با ?stream=1 نتایج روی
+    event loop stream می‌شوند.
+    """
+    body = await _read_body(receive)
+    headers = dict(scope.get('headers') or [])
+    ndjson = b'ndjson' in headers.get(b'content-type', b'')
+    query = dict(parse_qsl(scope.get('query_string', b'').decode()))
+    payload, status, batch = await asyncio.to_thread(
+        submit_batch, body, ndjson
+    )
+    if batch is None or not wants_stream(query):
+        await _send_json(send, payload, status)
+        return
+    await _send_ndjson(send, [payload], status, batch.stream_async())
+
+
+async def get_batch_results(batch_id: str, send):
+    """نتایج جلسه‌های یک batch به صورت NDJSON (معادل endpoint Flask)"""
+    batch = get_batch_dispatcher().get(batch_id)
+    if batch is not None:
+        await _send_ndjson(send, [], 200, batch.stream_async())
+        return
+
+    stored = await asyncio.to_thread(load_batch, batch_id)
+    if stored is None:
+        await _send_json(send, {
+            'status': 'error',
+            'message': f'batch {batch_id} یافت نشد'
+        }, 404)
+        return
+    await _send_ndjson(send, [*stored['results'], stored['summary']])
+
+
+ASYNC_ROUTES = {
+    ('POST', '/api/call/make'): make_call,
+    ('POST', '/api/call/simple'): make_simple_call,
+}
+
+
+def _warm_async_ami(loop: asyncio.AbstractEventLoop) -> tuple[bool, str]:
+    """login اتصال async مشترک هر سرور روی event loop (از thread warm-up)"""
+    router = get_asterisk_router()
+    errors = []
+    for server in router.servers():
+        settings = router.pool(server).settings()
+        manager, error = asyncio.run_coroutine_threadsafe(
+            get_async_ami(settings), loop
+        ).result(timeout=30)
+        if manager is None:
+            errors.append(f"{server}: {error}")
+    return not errors, '; '.join(errors)
+
+
+async def _lifespan(receive, send):
+    """مدیریت startup/shutdown سرور ASGI"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # migration، poolها و cacheها در پس‌زمینه آماده می‌شوند تا
+            # worker زودتر به /health پاسخ دهد؛ /is-ready تا پایان 503 است
+            warmup = get_warmup()
+            loop = asyncio.get_running_loop()
+            warmup.add_step('async_ami', lambda: _warm_async_ami(loop))
+            warmup.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_ami()
+            get_call_supervisor().stop()
+            # انتقال‌های باقی‌مانده در صف قبل از خروج نوشته می‌شوند
+            await asyncio.to_thread(get_session_store().stop)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """
+    برنامه ASGI
+
+    endpointهای تماس به صورت native async روی event loop اجرا می‌شوند
+    و بقیه مسیرها به برنامه Flask سپرده می‌شوند.
+    """
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+
+    if scope['type'] == 'http':
+        handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+        if handler is not None:
+            data = await _read_json(receive)
+            query = dict(parse_qsl(scope.get('query_string', b'').decode()))
+            try:
+                payload, status = await handler(data, query)
+            except Exception as e:
+                payload, status = {
+                    'status': 'error',
+                    'message': f'خطا: {str(e)}'
+                }, 500
+            await _send_json(send, payload, status)
+            return
+
+        if scope['method'] == 'POST' and scope['path'] == '/api/call/batch':
+            await make_batch_call(scope, receive, send)
+            return
+        match = BATCH_RESULTS_PATH.match(scope['path'])
+        if match is not None and scope['method'] == 'GET':
+            await get_batch_results(match.group(1), send)
+            return
+
+    await wsgi_application(scope, receive, send)
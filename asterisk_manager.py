@@ -1,9 +1,541 @@
+import asyncio
+import logging
 import os
 import socket
-import psycopg2
 import time
 import threading
-from typing import Optional, Dict, List, Any
+import itertools
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Optional, Dict, List, Any, Callable, Iterator, Set
+
+from config_cache import get_config_cache
+from trunk_registry import Trunk, get_trunk_registry
+from rate_limit import TrunkLease, SharedTrunkLimiter, get_trunk_limiter
+from logging_config import LogSampler
+from metrics import (
+    AMI_LOGIN_SECONDS,
+    AMI_ACTION_SECONDS,
+    AMI_ACTION_TIMEOUTS,
+    AMI_ANSWER_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# نمونه‌برداری از لاگ debug هر chunk دریافتی از socket
+_chunk_sampler = LogSampler()
+
+
+# پیشوند ActionID برای یکتا بودن بین processها و workerها
+_ACTION_ID_PREFIX = uuid.uuid4().hex[:8]
+_action_counter = itertools.count(1)
+
+
+def next_action_id() -> str:
+    """ساخت ActionID یکتا برای هر action"""
+    return f"{_ACTION_ID_PREFIX}-{os.getpid()}-{next(_action_counter)}"
+
+
+def build_action(
+    action: str,
+    action_id: str,
+    params: Optional[Dict[str, str]] = None
+) -> bytes:
+    """
+    ساخت متن یک action در فرمت AMI
+
+    Args:
+        action: نام action
+        action_id: شناسه یکتای action
+        params: پارامترهای اضافی
+
+    Returns:
+        بایت‌های آماده ارسال روی socket
+    """
+    command = f"Action: {action}\r\nActionID: {action_id}\r\n"
+    if params:
+        for key, value in params.items():
+            command += f"{key}: {value}\r\n"
+    command += "\r\n"
+    return command.encode()
+
+
+def parse_frame(frame: str) -> Dict[str, str]:
+    """
+    تبدیل یک frame متنی AMI به دیکشنری هدرها
+
+    Args:
+        frame: متن frame بدون جداکننده انتهایی
+
+    Returns:
+        دیکشنری کلید/مقدار
+    """
+    headers: Dict[str, str] = {}
+    for line in frame.split('\r\n'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip()] = value.strip()
+    return headers
+
+
+class AMIMessage:
+    """
+    یک frame تجزیه شده AMI (پاسخ یا Event)
+
+    هدرها یک بار هنگام دریافت frame تجزیه می‌شوند و متدها به جای جستجو
+    در متن خام فقط یک کلید را در dict می‌خوانند. متن خام برای لاگ و
+    پیام‌های خطا نگه داشته می‌شود.
+    """
+
+    __slots__ = ('headers', 'raw')
+
+    def __init__(self, headers: Dict[str, str], raw: str = ""):
+        self.headers = headers
+        self.raw = raw
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """مقدار یک هدر"""
+        return self.headers.get(key, default)
+
+    def __getitem__(self, key: str) -> str:
+        return self.headers[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.headers
+
+    @property
+    def name(self) -> Optional[str]:
+        """نام Event (برای پاسخ‌ها None)"""
+        return self.headers.get('Event')
+
+    @property
+    def action_id(self) -> Optional[str]:
+        return self.headers.get('ActionID')
+
+    def __str__(self) -> str:
+        return self.raw
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.headers!r})"
+
+
+class AMIResponse(AMIMessage):
+    """
+    پاسخ یک action همراه با Eventهای لیست آن
+
+    actionهای لیستی (مثل PJSIPShowEndpoints) ابتدا پاسخی با
+    `EventList: start` می‌فرستند، سپس یک Event برای هر آیتم با همان
+    ActionID و در پایان Eventی با `EventList: Complete`. این Eventها در
+    events جمع می‌شوند و complete فقط با رسیدن Event پایانی True می‌شود.
+
+    پاسخ‌هایی که از Asterisk نرسیده‌اند (اتصال قطع، timeout) هدر ندارند و
+    raw دلیل آن‌ها را نگه می‌دارد.
+    """
+
+    __slots__ = ('events', 'complete')
+
+    def __init__(self, headers: Dict[str, str], raw: str = ""):
+        super().__init__(headers, raw)
+        self.events: List[AMIMessage] = []
+        self.complete = not self.is_list
+
+    @classmethod
+    def failed(cls, reason: str) -> 'AMIResponse':
+        """
+        پاسخ جایگزین برای actionی که پاسخی از Asterisk نگرفت
+
+        Args:
+            reason: دلیل (مثلاً "Not connected")؛ رشته خالی برای timeout
+        """
+        return cls({}, reason)
+
+    @property
+    def success(self) -> bool:
+        return self.headers.get('Response') == 'Success'
+
+    @property
+    def error(self) -> bool:
+        return self.headers.get('Response') == 'Error'
+
+    @property
+    def message(self) -> str:
+        """هدر Message پاسخ (رشته خالی اگر نباشد)"""
+        return self.headers.get('Message', '')
+
+    @property
+    def is_list(self) -> bool:
+        """آیا پاسخ شروع یک لیست Event است"""
+        return self.headers.get('EventList', '').lower() == 'start'
+
+    def add_event(self, event: AMIMessage) -> bool:
+        """
+        افزودن یک Event لیست
+
+        Args:
+            event: Event با ActionID همین action
+
+        Returns:
+            True اگر این Event پایان لیست باشد
+        """
+        if event.get('EventList', '').lower() == 'complete':
+            self.complete = True
+        else:
+            self.events.append(event)
+        return self.complete
+
+    def events_named(self, name: str) -> List[AMIMessage]:
+        """Eventهای لیست با نام مشخص"""
+        return [event for event in self.events if event.name == name]
+
+
+class AMIFrameParser:
+    """
+    parser افزایشی برای جریان بایت AMI
+
+    بایت‌های دریافتی در یک bytearray نگهداری می‌شوند و جستجوی جداکننده
+    فقط روی بایت‌های جدید انجام می‌شود؛ بنابراین پاسخ‌های بزرگ (مثل
+    PJSIPShowEndpoints) و جریان پرترافیک Eventها در زمان خطی تجزیه
+    می‌شوند. بایت‌های باقی‌مانده بعد از آخرین frame کامل برای frame بعدی
+    نگه داشته می‌شوند.
+    """
+
+    DELIMITER = b"\r\n\r\n"
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # ابتدای اولین بایت مصرف نشده
+        self._start = 0
+        # از این موقعیت به بعد جداکننده جستجو نشده است
+        self._scan_from = 0
+
+    def feed(self, data: bytes):
+        """
+        افزودن بایت‌های دریافت شده از socket
+
+        Args:
+            data: بایت‌های خوانده شده
+        """
+        self._buffer += data
+
+    def read_line(self) -> Optional[str]:
+        """
+        خواندن یک خط کامل (برای پیام خوش‌آمدگویی که جداکننده frame ندارد)
+
+        Returns:
+            متن خط بدون CRLF یا None اگر خط کامل نشده باشد
+        """
+        end = self._buffer.find(b"\r\n", self._start)
+        if end < 0:
+            return None
+        line = self._decode(self._start, end)
+        self._start = end + 2
+        self._scan_from = max(self._scan_from, self._start)
+        return line
+
+    def frames(self) -> Iterator[tuple[Dict[str, str], str]]:
+        """
+        برگرداندن frameهای کامل موجود در buffer
+
+        هر frame فقط هنگام برگردانده شدن مصرف می‌شود؛ اگر فراخواننده
+        زودتر متوقف شود، بقیه frameها برای فراخوانی بعدی باقی می‌مانند.
+
+        Yields:
+            tuple (headers, frame) که frame متن بدون جداکننده انتهایی است
+        """
+        delimiter = self.DELIMITER
+        while True:
+            end = self._buffer.find(delimiter, self._scan_from)
+            if end < 0:
+                # سه بایت آخر ممکن است ابتدای جداکننده باشند
+                self._scan_from = max(
+                    self._start, len(self._buffer) - len(delimiter) + 1
+                )
+                self._compact()
+                return
+            start = self._start
+            self._start = self._scan_from = end + len(delimiter)
+            if end == start:
+                continue
+            frame = self._decode(start, end)
+            yield parse_frame(frame), frame
+
+    def pending_bytes(self) -> int:
+        """تعداد بایت‌های دریافت شده‌ای که هنوز frame کامل نشده‌اند"""
+        return len(self._buffer) - self._start
+
+    def _decode(self, start: int, end: int) -> str:
+        """تبدیل بخشی از buffer به متن بدون کپی میانی"""
+        with memoryview(self._buffer) as view:
+            return str(view[start:end], 'utf-8', 'ignore')
+
+    def _compact(self):
+        """حذف بایت‌های مصرف شده از ابتدای buffer"""
+        if self._start:
+            del self._buffer[:self._start]
+            self._scan_from -= self._start
+            self._start = 0
+
+
+def new_channel_uniqueid() -> str:
+    """ساخت Uniqueid یکتا برای پارامتر ChannelId در Originate"""
+    return f"mc-{uuid.uuid4().hex}"
+
+
+def trunk_name_from_channel(channel: str) -> Optional[str]:
+    """
+    استخراج نام trunk از رشته کانال
+
+    Args:
+        channel: مثال: SIP/trunk/0914... یا PJSIP/0914...@trunk
+
+    Returns:
+        نام trunk یا None
+    """
+    if '@' in channel:
+        return channel.rsplit('@', 1)[1] or None
+    parts = channel.split('/')
+    return parts[1] if len(parts) > 2 else None
+
+
+class LeaseReleaser:
+    """
+    آزاد کردن کانال رزرو شده trunk پس از پایان کانال
+
+    lease با Hangup کانال (بر اساس ChannelId) یا OriginateResponse ناموفق
+    آزاد می‌شود. اگر Event از دست برود (قطع event bus، restart شدن
+    Asterisk یا اتصال async جدید)، reconcile آن را با لیست CoreShowChannels
+    سرور مقایسه و آزاد می‌کند؛ انقضای lease آخرین پشتیبان است.
+    """
+
+    # حداقل عمر lease قبل از مقایسه با CoreShowChannels (ثانیه)؛ کانال
+    # Originate تازه ارسال شده ممکن است هنوز در لیست نباشد
+    RECONCILE_GRACE = 30.0
+
+    # releaserهای فعال این process بر اساس Uniqueid کانال
+    _active: Dict[str, 'LeaseReleaser'] = {}
+    _active_lock = threading.Lock()
+
+    def __init__(
+        self,
+        lease: TrunkLease,
+        action_id: str,
+        uniqueid: str,
+        limiter: SharedTrunkLimiter,
+        server: Optional[str] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        """
+        Args:
+            lease: lease گرفته شده از limiter
+            action_id: ActionID ارسال شده با Originate
+            uniqueid: ChannelId ارسال شده با Originate
+            limiter: limiter صاحب lease
+            server: نام پیکربندی سرور Asterisk که کانال روی آن ساخته می‌شود
+            loop: event loop اتصال async؛ آزادسازی روی این loop در executor
+                انجام می‌شود تا flock آن را بلاک نکند
+        """
+        self.lease = lease
+        self.action_id = action_id
+        self.uniqueid = uniqueid
+        self.limiter = limiter
+        self.server = server
+        self.loop = loop
+        self.created = time.monotonic()
+        self._events = None
+        self._token: Optional[int] = None
+
+    def attach(self, events):
+        """
+        اشتراک روی Eventهای کانال (قبل از ارسال Originate)
+
+        Args:
+            events: AMIEventBus یا manager با متد subscribe
+        """
+        with self._active_lock:
+            self._active[self.uniqueid] = self
+        self._events = events
+        self._token = events.subscribe(
+            self.handle_event,
+            keys=[('ActionID', self.action_id), ('Uniqueid', self.uniqueid)]
+        )
+
+    def handle_event(self, event: Dict[str, str]):
+        """پردازش Event؛ در پایان کانال lease آزاد می‌شود"""
+        name = event.get('Event')
+        if name == 'OriginateResponse':
+            if (
+                event.get('ActionID') != self.action_id or
+                event.get('Response') == 'Success'
+            ):
+                return
+        elif name != 'Hangup' or event.get('Uniqueid') != self.uniqueid:
+            return
+        self.release()
+
+    def release(self):
+        """آزاد کردن lease و لغو اشتراک (چند بار صدا زدن بی‌خطر است)"""
+        with self._active_lock:
+            if self._active.get(self.uniqueid) is self:
+                del self._active[self.uniqueid]
+        if not self._release_in_executor():
+            self.limiter.release(self.lease)
+        if self._events is not None and self._token is not None:
+            self._events.unsubscribe(self._token)
+
+    def _release_in_executor(self) -> bool:
+        """
+        آزادسازی lease در executor اگر روی event loop اتصال async هستیم
+
+        Returns:
+            False اگر آزادسازی باید مستقیم (در همین thread) انجام شود
+        """
+        if self.loop is None:
+            return False
+        try:
+            if asyncio.get_running_loop() is not self.loop:
+                return False
+            self.loop.run_in_executor(
+                None, self.limiter.release, self.lease
+            )
+        except RuntimeError:
+            # thread بدون event loop یا loop در حال بسته شدن
+            return False
+        return True
+
+    @classmethod
+    def reconcile(
+        cls,
+        server: str,
+        uniqueids: Set[str],
+        started: float
+    ) -> int:
+        """
+        آزاد کردن leaseهایی که کانال آن‌ها دیگر روی سرور وجود ندارد
+
+        Args:
+            server: نام پیکربندی سرور
+            uniqueids: Uniqueid کانال‌های زنده از CoreShowChannels
+            started: زمان monotonic ارسال CoreShowChannels
+
+        Returns:
+            تعداد leaseهای آزاد شده
+        """
+        deadline = started - cls.RECONCILE_GRACE
+        with cls._active_lock:
+            stale = [
+                releaser for releaser in cls._active.values()
+                if releaser.server == server and
+                releaser.created < deadline and
+                releaser.uniqueid not in uniqueids
+            ]
+        for releaser in stale:
+            logger.warning(
+                "کانال %s روی %s وجود ندارد؛ lease trunk %s آزاد شد",
+                releaser.uniqueid, server, releaser.lease.trunk_name
+            )
+            releaser.release()
+        return len(stale)
+
+
+class OriginateWatcher:
+    """
+    پیگیری Eventهای یک Originate تا پاسخ دادن یا شکست کانال
+
+    Eventها بر اساس ActionID (OriginateResponse) و Uniqueid کانال
+    (Newstate / DialEnd / Hangup) با این Originate تطبیق داده می‌شوند.
+    """
+
+    # ChannelState برای کانال پاسخ داده شده (Up)
+    STATE_UP = '6'
+
+    # کدهای Reason در OriginateResponse
+    REASONS = {
+        '0': 'کانال ایجاد نشد',
+        '1': 'تماس قطع شد',
+        '3': 'پاسخ داده نشد',
+        '5': 'مشغول است',
+        '8': 'شبکه شلوغ است (congestion)',
+    }
+
+    def __init__(self, action_id: str, uniqueid: str):
+        """
+        Args:
+            action_id: ActionID ارسال شده با Originate
+            uniqueid: ChannelId ارسال شده با Originate
+        """
+        self.action_id = action_id
+        self.uniqueid = uniqueid
+        self.channel: Optional[str] = None
+        self.answered = False
+        self.answered_at: Optional[float] = None
+        self.reason: Optional[str] = None
+        self.done = threading.Event()
+
+    def handle_event(self, event: Dict[str, str]):
+        """
+        پردازش یک Event (از thread خواننده یا event loop صدا زده می‌شود)
+
+        Args:
+            event: دیکشنری هدرهای Event
+        """
+        if self.done.is_set():
+            return
+
+        name = event.get('Event')
+        if name == 'OriginateResponse':
+            if event.get('ActionID') != self.action_id:
+                return
+            if event.get('Response') == 'Success':
+                self._answer(event.get('Channel'))
+            else:
+                self._fail(self.REASONS.get(
+                    event.get('Reason', ''),
+                    f"Originate ناموفق (Reason: {event.get('Reason')})"
+                ))
+            return
+
+        if event.get('Uniqueid') != self.uniqueid:
+            return
+        self.channel = event.get('Channel') or self.channel
+
+        if name == 'Newstate' and event.get('ChannelState') == self.STATE_UP:
+            self._answer(event.get('Channel'))
+        elif name == 'DialEnd' and event.get('DialStatus') == 'ANSWER':
+            self._answer(event.get('Channel'))
+        elif name == 'Hangup':
+            self._fail(
+                f"تماس قطع شد (Cause: {event.get('Cause-txt') or event.get('Cause')})"
+            )
+
+    def _answer(self, channel: Optional[str]):
+        """ثبت پاسخ دادن کانال"""
+        self.channel = channel or self.channel
+        self.answered = True
+        self.answered_at = time.monotonic()
+        self.done.set()
+
+    def _fail(self, reason: str):
+        """ثبت شکست کانال"""
+        self.reason = reason
+        self.done.set()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        انتظار برای پاسخ دادن کانال
+
+        Args:
+            timeout: حداکثر زمان انتظار (ثانیه)
+
+        Returns:
+            True اگر کانال پاسخ داده باشد
+        """
+        if not self.done.wait(timeout):
+            self.reason = f"Timeout: پس از {timeout} ثانیه پاسخ داده نشد"
+        return self.answered
+
+    def error_message(self) -> str:
+        """پیام خطا برای حالتی که کانال پاسخ نداده است"""
+        return self.reason or "پاسخ داده نشد"
 
 
 class AsteriskManager:
@@ -15,7 +547,8 @@ class AsteriskManager:
         port: Optional[int] = None,
         username: Optional[str] = None,
         secret: Optional[str] = None,
-        config_name: str = 'default'
+        config_name: str = 'default',
+        events: bool = True
     ):
         """
         مقداردهی اولیه Asterisk Manager
@@ -27,6 +560,8 @@ class AsteriskManager:
             username: نام کاربری AMI (مستقیم)
             secret: رمز عبور AMI (مستقیم)
             config_name: نام پیکربندی در دیتابیس (پیش‌فرض: 'default')
+            events: اگر False باشد با Events: off login می‌کند و Eventها
+                از event_bus خوانده می‌شوند
         """
         # اگر به صورت مستقیم داده شده، استفاده کن
         if host and port and username and secret:
@@ -45,14 +580,6 @@ class AsteriskManager:
                 # رمز عبور را بدون تغییر از دیتابیس بگیر
                 secret_from_db = db_config.get('secret')
                 self.secret = secret_from_db if secret_from_db else ''
-                
-                print("=" * 80)
-                print("SECRET ASSIGNED FROM DATABASE:")
-                print(f"Secret type: {type(self.secret)}")
-                print(f"Secret value: {repr(self.secret)}")
-                secret_len = len(self.secret) if self.secret else 0
-                print(f"Secret length: {secret_len}")
-                print("=" * 80)
             else:
                 # اگر در دیتابیس نبود، از environment variables بخوان
                 self.host = host or os.getenv('ASTERISK_HOST') or ''
@@ -61,42 +588,35 @@ class AsteriskManager:
                 self.username = username_val or ''
                 self.secret = secret or os.getenv('ASTERISK_SECRET') or ''
 
-            self.socket: Optional[socket.socket] = None
-            self.connected = False
-            self.channel_events: Dict[str, str] = {}  # برای ذخیره Channel IDs از Events
-            self.event_listener_thread: Optional[threading.Thread] = None
-            self.event_listening = False
-
-    def _get_db_connection(self):
-        """ایجاد اتصال به دیتابیس"""
-        db_host = os.getenv('DB_HOST')
-        db_port = os.getenv('DB_PORT')
-        db_name = os.getenv('DB_NAME')
-        db_user = os.getenv('DB_USER')
-        db_password = os.getenv('DB_PASSWORD')
-
-        if not all([db_host, db_port, db_name, db_user, db_password]):
-            return None
-
-        try:
-            conn = psycopg2.connect(
-                host=db_host,
-                port=db_port,
-                database=db_name,
-                user=db_user,
-                password=db_password
-            )
-            return conn
-        except Exception as e:
-            print(f"خطا در اتصال به دیتابیس: {e}")
-            return None
+        self.config_name = config_name
+        self.socket: Optional[socket.socket] = None
+        self.connected = False
+        # زمان آخرین تبادل موفق با Asterisk (برای keepalive در pool)
+        self.last_activity = 0.0
+        self.events = events
+        # گذرگاه Event مشترک (AMIEventBus)؛ توسط pool تنظیم می‌شود
+        self.event_bus = None
+
+        # ActionID -> Future برای actionهای در انتظار پاسخ
+        self._pending: Dict[str, Future] = {}
+        # پاسخ actionهای لیستی تا رسیدن Event پایانی (EventList: Complete)
+        self._lists: Dict[str, AMIResponse] = {}
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._reader_thread: Optional[threading.Thread] = None
+        self._reader_alive = False
+        self._parser = AMIFrameParser()
+        self._subscribers: Dict[int, Callable[[Dict[str, str]], None]] = {}
+        self._subscribers_lock = threading.Lock()
+        self._subscriber_ids = itertools.count(1)
 
     def _load_from_db(
         self,
         config_name: str
     ) -> Optional[Dict[str, Any]]:
         """
-        بارگذاری تنظیمات از دیتابیس
+        بارگذاری تنظیمات از دیتابیس (از طریق cache تنظیمات)
 
         Args:
             config_name: نام پیکربندی
@@ -104,214 +624,90 @@ class AsteriskManager:
         Returns:
             دیکشنری تنظیمات یا None
         """
-        conn = self._get_db_connection()
-        if not conn:
-            return None
-
-        try:
-            # ایجاد جدول در صورت عدم وجود
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS asterisk_config (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) UNIQUE NOT NULL DEFAULT 'default',
-                    host VARCHAR(255),
-                    port INTEGER DEFAULT 5038,
-                    username VARCHAR(255),
-                    secret VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
-
-            # خواندن تنظیمات
-            cursor.execute("""
-                SELECT host, port, username, secret
-                FROM asterisk_config
-                WHERE name = %s
-            """, (config_name,))
-            row = cursor.fetchone()
-            cursor.close()
-            conn.close()
-
-            if row and row[0]:  # اگر host موجود باشد
-                # خواندن رمز عبور بدون تغییر
-                secret_from_db = row[3]
-                print("=" * 80)
-                print("LOADING SECRET FROM DATABASE:")
-                print(f"Secret type: {type(secret_from_db)}")
-                print(f"Secret value: {repr(secret_from_db)}")
-                print(f"Secret length: {len(secret_from_db) if secret_from_db else 0}")
-                secret_bytes = (
-                    secret_from_db.encode('utf-8')
-                    if secret_from_db else b''
-                )
-                print(f"Secret bytes: {repr(secret_bytes)}")
-                print("=" * 80)
-                
-                return {
-                    'host': str(row[0]) if row[0] else '',
-                    'port': int(row[1]) if row[1] else 5038,
-                    'username': str(row[2]) if row[2] else '',
-                    # بدون تبدیل، دقیقاً همان‌طور که از دیتابیس خوانده شد
-                    'secret': secret_from_db
-                }
-            return None
-        except Exception as e:
-            print(f"خطا در خواندن تنظیمات Asterisk از دیتابیس: {e}")
-            if conn:
-                conn.close()
-            return None
+        return get_config_cache().get(config_name)
 
     def connect(self) -> tuple[bool, str]:
         """
         اتصال به سرور Asterisk
 
+        Returns:
+            tuple (success, error_message)
+        """
+        started = time.perf_counter()
+        success, error = self._login()
+        AMI_LOGIN_SECONDS.labels('success' if success else 'failure').observe(
+            time.perf_counter() - started
+        )
+        return success, error
+
+    def _login(self) -> tuple[bool, str]:
+        """
+        باز کردن socket و login به AMI
+
         Returns:
             tuple (success, error_message)
         """
         if not all([self.host, self.port, self.username, self.secret]):
             error = "تنظیمات Asterisk کامل نیست"
-            print(f"خطا: {error}")
+            logger.warning(error, extra={'config_name': self.config_name})
             return False, error
 
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(10)
             self.socket.connect((self.host, self.port))
+            self._parser = AMIFrameParser()
 
-            # دریافت پیام خوش‌آمدگویی
-            welcome_response = self._receive_response()
-            print("=" * 80)
-            print("Asterisk Welcome Response (FULL):")
-            print(welcome_response)
-            print("=" * 80)
+            # دریافت پیام خوش‌آمدگویی (یک خط، بدون جداکننده frame)
+            welcome_response = self._receive_banner()
+            logger.debug(
+                "AMI banner from %s:%s: %s",
+                self.host, self.port, welcome_response
+            )
 
             # ارسال اطلاعات احراز هویت
             # فرمت AMI: Action: Login\r\nUsername: ...\r\nSecret: ...\r\n\r\n
-            
-            # بررسی encoding رمز عبور
-            print("=" * 80)
-            print("SECRET ANALYSIS:")
-            print(f"Secret length: {len(self.secret)}")
-            print(f"Secret repr: {repr(self.secret)}")
-            secret_utf8 = self.secret.encode('utf-8')
-            secret_latin1 = self.secret.encode('latin-1', errors='ignore')
-            print(f"Secret bytes (UTF-8): {repr(secret_utf8)}")
-            print(f"Secret bytes (Latin-1): {repr(secret_latin1)}")
-            for i, char in enumerate(self.secret):
-                print(f"  Char {i}: {repr(char)} (U+{ord(char):04X})")
-            print("=" * 80)
-            
+            # session‌های pool Event دریافت نمی‌کنند؛ Eventها روی event bus هستند
+            events_header = "" if self.events else "Events: off\r\n"
             login_command = (
                 f"Action: Login\r\n"
                 f"Username: {self.username}\r\n"
                 f"Secret: {self.secret}\r\n"
+                f"{events_header}"
                 f"\r\n"
             )
-            print("=" * 80)
-            print("Sending Login Command:")
-            print(f"Username: {self.username}")
-            secret_mask = '*' * len(self.secret) if self.secret else 'empty'
-            print(f"Secret: {secret_mask}")
-            print(f"Secret repr: {repr(self.secret)}")
-            print("Command (raw bytes - UTF-8):")
-            cmd_utf8 = login_command.encode('utf-8')
-            print(repr(cmd_utf8))
-            print("Command (raw bytes - Latin-1):")
-            cmd_latin1 = login_command.encode('latin-1', errors='ignore')
-            print(repr(cmd_latin1))
-            print("Command (text):")
-            print(login_command)
-            print("=" * 80)
-            
             # ارسال دستور login با UTF-8 (بدون تغییر رمز عبور)
-            print("=" * 80)
-            print("Sending Login Command (UTF-8, original secret):")
-            print("Secret will be sent exactly as stored (no modifications)")
-            print("=" * 80)
-            self.socket.send(cmd_utf8)
-            
+            logger.debug(
+                "Sending AMI Login",
+                extra={'ami_username': self.username, 'host': self.host}
+            )
+            self.socket.sendall(login_command.encode('utf-8'))
+
             # دریافت پاسخ
             response = self._receive_response(timeout=5)
-            print("=" * 80)
-            print("Login Response (FULL):")
-            print(response)
-            print("=" * 80)
-            
-            # تجزیه خط به خط
-            print("Response Analysis:")
-            lines = response.split('\n')
-            for i, line in enumerate(lines):
-                print(f"Line {i}: {repr(line)}")
-            print("=" * 80)
+            logger.debug("AMI Login response: %s", response)
 
             # بررسی پاسخ
-            response_lower = response.lower()
-            print("Checking response indicators...")
-            has_success = 'success' in response_lower
-            has_auth_accepted = 'authentication accepted' in response_lower
-            has_error = 'error' in response_lower
-            has_auth_failed = 'authentication failed' in response_lower
-            
-            print(f"Response contains 'success': {has_success}")
-            print(
-                f"Response contains 'authentication accepted': "
-                f"{has_auth_accepted}"
-            )
-            print(f"Response contains 'error': {has_error}")
-            print(
-                f"Response contains 'authentication failed': "
-                f"{has_auth_failed}"
-            )
-            
-            success_indicators = (
-                "success" in response_lower or
-                "authentication accepted" in response_lower or
-                "message: authentication accepted" in response_lower
-            )
-
-            error_indicators = (
-                "authentication failed" in response_lower or
-                ("error" in response_lower and
-                 "authentication" in response_lower)
-            )
-
-            print(f"Success indicators: {success_indicators}")
-            print(f"Error indicators: {error_indicators}")
-
-            if success_indicators:
+            if (
+                response.success or
+                response.message.lower() == "authentication accepted"
+            ):
                 self.connected = True
-                print("=" * 80)
-                print("✓ اتصال به Asterisk برقرار شد")
-                print("=" * 80)
+                self.last_activity = time.monotonic()
+                # از این پس تمام خواندن‌ها توسط thread خواننده انجام می‌شود
+                self._start_reader()
+                logger.info(
+                    "اتصال به Asterisk برقرار شد",
+                    extra={'host': self.host, 'port': self.port}
+                )
                 return True, ""
-            elif error_indicators:
-                # استخراج پیام خطای دقیق
-                error_msg = "Authentication failed"
-                error_details = {}
-                
-                lines = response.split('\r\n')
-                for line in lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    if ':' in line:
-                        key, value = line.split(':', 1)
-                        key = key.strip().lower()
-                        value = value.strip()
-                        error_details[key] = value
-                        if key == 'message':
-                            error_msg = value
-                
-                print("=" * 80)
-                print("✗ خطا در احراز هویت")
-                print("Error Details:")
-                for key, value in error_details.items():
-                    print(f"  {key}: {value}")
-                print("=" * 80)
-                
+            elif response.error:
+                error_msg = response.message or "Authentication failed"
+
+                logger.warning(
+                    "خطا در احراز هویت AMI: %s", error_msg,
+                    extra={'host': self.host, 'ami_username': self.username}
+                )
                 full_error = (
                     f"خطا در احراز هویت: {error_msg}. "
                     f"پاسخ کامل: {response}"
@@ -323,21 +719,18 @@ class AsteriskManager:
                     f"پاسخ نامعتبر از سرور. "
                     f"پاسخ کامل: {response}"
                 )
-                print("=" * 80)
-                print("✗ پاسخ نامعتبر")
-                print(f"Response: {response}")
-                print("=" * 80)
+                logger.warning("پاسخ نامعتبر AMI به Login: %s", response)
                 self.disconnect()
                 return False, error
 
         except socket.timeout:
             error = f"Timeout: نمی‌توان به {self.host}:{self.port} متصل شد"
-            print(error)
+            logger.warning(error)
             self.disconnect()
             return False, error
         except socket.gaierror as e:
             error = f"خطا در DNS: نمی‌توان host '{self.host}' را پیدا کرد"
-            print(f"{error}: {e}")
+            logger.warning("%s: %s", error, e)
             self.disconnect()
             return False, error
         except ConnectionRefusedError:
@@ -345,61 +738,90 @@ class AsteriskManager:
                 f"اتصال رد شد: "
                 f"سرور {self.host}:{self.port} در دسترس نیست"
             )
-            print(error)
+            logger.warning(error)
             self.disconnect()
             return False, error
         except Exception as e:
             error = f"خطا در اتصال: {str(e)}"
-            print(error)
+            logger.exception(error)
             self.disconnect()
             return False, error
 
-    def _receive_response(self, timeout: int = 5) -> str:
+    def _receive_banner(self, timeout: int = 5) -> str:
         """
-        دریافت پاسخ از Asterisk
+        دریافت پیام خوش‌آمدگویی Asterisk (مثال: Asterisk Call Manager/5.0.1)
 
         Args:
-            timeout: زمان انتظار برای دریافت پاسخ
+            timeout: زمان انتظار برای دریافت پیام
 
         Returns:
-            پاسخ دریافت شده
+            خط خوش‌آمدگویی یا رشته خالی
         """
         if not self.socket:
             return ""
 
-        response = ""
         self.socket.settimeout(timeout)
-        chunks = []
         try:
             while True:
+                line = self._parser.read_line()
+                if line is not None:
+                    return line
                 data = self.socket.recv(4096)
                 if not data:
-                    break
-                chunks.append(data)
-                decoded = data.decode('utf-8', errors='ignore')
-                response += decoded
-                print(f"Received chunk: {repr(data)}")
-                print(f"Decoded chunk: {repr(decoded)}")
-                if "\r\n\r\n" in response:
-                    print("Found end marker (\\r\\n\\r\\n)")
-                    break
+                    self.connected = False
+                    return ""
+                self._parser.feed(data)
         except socket.timeout:
-            print(f"Socket timeout after {timeout} seconds")
-            pass
+            logger.warning("Socket timeout after %s seconds", timeout)
         except Exception as e:
-            print(f"خطا در دریافت پاسخ: {e}")
-            print(f"Exception type: {type(e).__name__}")
+            logger.error("خطا در دریافت پاسخ: %r", e)
+        return ""
 
-        print(f"Total chunks received: {len(chunks)}")
-        print(f"Total response length: {len(response)} bytes")
-        return response
+    def _receive_response(self, timeout: int = 5) -> AMIResponse:
+        """
+        دریافت پاسخ از Asterisk (قبل از شروع thread خواننده)
+
+        بایت‌های دریافت شده بعد از پاسخ (مثل Event FullyBooted) در parser
+        باقی می‌مانند و توسط thread خواننده پردازش می‌شوند.
+
+        Args:
+            timeout: زمان انتظار برای دریافت پاسخ
+
+        Returns:
+            پاسخ دریافت شده (بدون هدر اگر پاسخی نرسد)
+        """
+        if not self.socket:
+            return AMIResponse.failed("")
+
+        self.socket.settimeout(timeout)
+        try:
+            while True:
+                for headers, frame in self._parser.frames():
+                    if 'Response' in headers and 'Event' not in headers:
+                        return AMIResponse(headers, frame)
+                data = self.socket.recv(65536)
+                if not data:
+                    # سرور اتصال را بسته است
+                    self.connected = False
+                    break
+                self._parser.feed(data)
+        except socket.timeout:
+            logger.warning("Socket timeout after %s seconds", timeout)
+        except Exception as e:
+            logger.error("خطا در دریافت پاسخ: %r", e)
+        return AMIResponse.failed("")
 
     def originate_call_direct(
         self,
         channel: str,
         number: str,
         caller_id: Optional[str] = None,
-        timeout: int = 30
+        timeout: int = 30,
+        answer_timeout: Optional[float] = None,
+        dial_string: Optional[str] = None,
+        trunk: Optional[Trunk] = None,
+        limit_wait: Optional[float] = None,
+        uniqueid: Optional[str] = None
     ) -> tuple[bool, str, Optional[str]]:
         """
         برقراری تماس مستقیم بدون dialplan (برای bridge کردن)
@@ -410,9 +832,20 @@ class AsteriskManager:
             number: شماره مقصد (مثال: 09221609805)
             caller_id: شماره نمایش داده شده (اختیاری)
             timeout: زمان انتظار برای برقراری تماس (ثانیه)
+            answer_timeout: اگر مشخص شود، تا پاسخ دادن کانال بر اساس
+                Eventها صبر می‌کند (ثانیه)
+            dial_string: رشته dial آماده از trunk (Trunk.dial_string)؛
+                در غیر این صورت از channel به صورت SIP ساخته می‌شود
+            trunk: trunk تماس برای اعمال محدودیت کانال و CPS
+            limit_wait: حداکثر انتظار برای ظرفیت trunk (ثانیه)
+            uniqueid: Uniqueid کانال (ChannelId)؛ در غیر این صورت ساخته
+                می‌شود
 
         Returns:
             tuple (success, message, channel_id)
+
+        Raises:
+            RateLimitExceeded: اگر ظرفیت trunk در زمان انتظار آزاد نشود
         """
         if not self.connected:
             success, error = self.connect()
@@ -425,12 +858,26 @@ class AsteriskManager:
             channel_parts[1]
             if len(channel_parts) > 1 else 'trunk_external'
         )
-        
+
+        # بدون اتصال Event پاسخ دادن کانال قابل تشخیص نیست
+        if self.event_bus is not None and not self.event_bus.wait_connected(
+            timeout=5
+        ):
+            return False, "اتصال Event به Asterisk برقرار نیست", None
+
+        # Uniqueid کانال را خودمان تعیین می‌کنیم تا Eventهای آن قابل تطبیق باشد
+        watcher = OriginateWatcher(
+            next_action_id(), uniqueid or new_channel_uniqueid()
+        )
+
         # استفاده از Application/Dial برای تماس مستقیم (بدون dialplan)
         params = {
+            'ActionID': watcher.action_id,
             'Channel': channel,
+            'ChannelId': watcher.uniqueid,
             'Application': 'Dial',
-            'Data': f"SIP/{trunk_name}/{number}",  # Dial مستقیم به شماره
+            # Dial مستقیم به شماره
+            'Data': dial_string or f"SIP/{trunk_name}/{number}",
             'Timeout': str(timeout * 1000),  # میلی‌ثانیه
             'Async': 'true'
         }
@@ -439,62 +886,60 @@ class AsteriskManager:
         if caller_id:
             params['CallerID'] = caller_id
 
-        print(f"Originate Direct params: {params}")
-        response = self._send_command('Originate', params)
-        print(f"Originate Direct response: {response}")
+        # اشتراک قبل از ارسال Originate تا هیچ Eventی از دست نرود
+        events = self.event_bus or self
+        token = events.subscribe(
+            watcher.handle_event,
+            keys=[
+                ('ActionID', watcher.action_id),
+                ('Uniqueid', watcher.uniqueid)
+            ]
+        )
+        try:
+            logger.debug("Originate Direct params: %s", params)
+            sent_at = time.monotonic()
+            response = self._originate(params, trunk, limit_wait)
+            logger.debug("Originate Direct response: %s", response)
 
-        # بررسی پاسخ
-        if 'Response: Success' in response:
-            # استخراج Channel ID از response
-            # در AMI، Originate response ممکن است شامل Events باشد
-            # باید Channel ID واقعی را از Events استخراج کنیم
-            import re
-            channel_id = None
-            
-            # جستجو برای Channel ID واقعی در response (از Events)
-            # Channel ID واقعی شامل unique ID است (مثال: SIP/0utgoing-2191012787-000002dc)
-            channel_match = re.search(
-                r'Channel:\s*(SIP/[^\r\n]+-\d+)',
-                response
-            )
-            if channel_match:
-                channel_id = channel_match.group(1)
-                print(f"Found real Channel ID from Events: {channel_id}")
+            # بررسی پاسخ
+            if response.success:
+                if answer_timeout is not None:
+                    if not watcher.wait(answer_timeout):
+                        return False, watcher.error_message(), None
+                    AMI_ANSWER_SECONDS.observe(watcher.answered_at - sent_at)
+                    logger.info(
+                        "Channel %s answered", watcher.channel,
+                        extra={'uniqueid': watcher.uniqueid}
+                    )
+                channel_id = watcher.channel or self._wait_for_channel(
+                    watcher.uniqueid, timeout=1
+                )
+                return True, str(response), channel_id or channel
+            elif response.error:
+                return False, response.message or "خطا در برقراری تماس", None
             else:
-                # اگر پیدا نشد، منتظر می‌مانیم
-                import time
-                time.sleep(1)  # منتظر می‌مانیم تا Channel ایجاد شود
-                # Channel ID معمولاً به صورت SIP/trunk-xxxxx است
-            
-            # اگر هنوز Channel ID نداریم، از channel name استفاده می‌کنیم
-            if not channel_id:
-                channel_id = channel
-            
-            return True, response, channel_id  # response را برمی‌گردانیم تا بتوانیم Channel ID را استخراج کنیم
-        elif 'Response: Error' in response:
-            error_msg = "خطا در برقراری تماس"
-            for line in response.split('\r\n'):
-                if line.startswith('Message:'):
-                    error_msg = line.split(':', 1)[1].strip()
-                    break
-            return False, error_msg, None
-        else:
-            return False, f"پاسخ نامعتبر: {response}", None
+                return False, f"پاسخ نامعتبر: {response}", None
+        finally:
+            events.unsubscribe(token)
 
-    def _wait_for_channel(self, timeout: int = 5) -> Optional[str]:
+    def _wait_for_channel(
+        self,
+        uniqueid: str,
+        timeout: float = 5
+    ) -> Optional[str]:
         """
         منتظر ماندن برای دریافت Channel ID از Events
+
+        Args:
+            uniqueid: Uniqueid کانال (ChannelId ارسال شده با Originate)
+            timeout: حداکثر زمان انتظار (ثانیه)
+
+        Returns:
+            نام کانال یا None
         """
-        import time
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            # بررسی Events برای Channel ID
-            if self.channel_events:
-                # گرفتن آخرین Channel ID
-                channel_id = list(self.channel_events.values())[-1]
-                return channel_id
-            time.sleep(0.1)
-        return None
+        if self.event_bus is None:
+            return None
+        return self.event_bus.channel_for(uniqueid, timeout)
 
     def originate_call(
         self,
@@ -502,7 +947,10 @@ class AsteriskManager:
         number: str,
         caller_id: Optional[str] = None,
         context: str = "from-trunk",
-        timeout: int = 30
+        timeout: int = 30,
+        dial_string: Optional[str] = None,
+        trunk: Optional[Trunk] = None,
+        limit_wait: Optional[float] = None
     ) -> tuple[bool, str, Optional[str]]:
         """
         برقراری تماس به یک شماره
@@ -513,9 +961,15 @@ class AsteriskManager:
             caller_id: شماره نمایش داده شده (اختیاری)
             context: کانتکست Asterisk (پیش‌فرض: from-trunk)
             timeout: زمان انتظار برای برقراری تماس (ثانیه)
+            dial_string: رشته dial آماده از trunk (Trunk.dial_string)
+            trunk: trunk تماس برای اعمال محدودیت کانال و CPS
+            limit_wait: حداکثر انتظار برای ظرفیت trunk (ثانیه)
 
         Returns:
             tuple (success, message, action_id)
+
+        Raises:
+            RateLimitExceeded: اگر ظرفیت trunk در زمان انتظار آزاد نشود
         """
         if not self.connected:
             success, error = self.connect()
@@ -539,7 +993,8 @@ class AsteriskManager:
         params = {
             'Channel': channel,
             'Application': 'Dial',
-            'Data': f"SIP/{trunk_name}/{number}",  # Dial to number
+            # Dial to number
+            'Data': dial_string or f"SIP/{trunk_name}/{number}",
             'Timeout': str(timeout * 1000),  # میلی‌ثانیه
             'Async': 'true'
         }
@@ -548,28 +1003,15 @@ class AsteriskManager:
         if caller_id:
             params['CallerID'] = caller_id
 
-        print(f"Originate params: {params}")
-        response = self._send_command('Originate', params)
-        print(f"Originate response: {response}")
+        logger.debug("Originate params: %s", params)
+        response = self._originate(params, trunk, limit_wait)
+        logger.debug("Originate response: %s", response)
 
         # بررسی پاسخ
-        if 'Response: Success' in response:
-            # استخراج ActionID
-            action_id = None
-            for line in response.split('\r\n'):
-                if line.startswith('ActionID:'):
-                    action_id = line.split(':', 1)[1].strip()
-                    break
-
-            return True, "تماس با موفقیت آغاز شد", action_id
-        elif 'Response: Error' in response:
-            # استخراج پیام خطا
-            error_msg = "خطا در برقراری تماس"
-            for line in response.split('\r\n'):
-                if line.startswith('Message:'):
-                    error_msg = line.split(':', 1)[1].strip()
-                    break
-            return False, error_msg, None
+        if response.success:
+            return True, "تماس با موفقیت آغاز شد", response.action_id
+        elif response.error:
+            return False, response.message or "خطا در برقراری تماس", None
         else:
             return False, f"پاسخ نامعتبر: {response}", None
 
@@ -580,7 +1022,8 @@ class AsteriskManager:
         extension: str,
         priority: int = 1,
         caller_id: Optional[str] = None,
-        timeout: int = 30
+        timeout: int = 30,
+        limit_wait: Optional[float] = None
     ) -> tuple[bool, str, Optional[str]]:
         """
         برقراری تماس با استفاده از Context/Exten (برای bridge کردن)
@@ -592,9 +1035,13 @@ class AsteriskManager:
             priority: اولویت در dialplan
             caller_id: شماره نمایش داده شده (اختیاری)
             timeout: زمان انتظار برای برقراری تماس (ثانیه)
+            limit_wait: حداکثر انتظار برای ظرفیت trunk (ثانیه)
 
         Returns:
             tuple (success, message, channel_uniqueid)
+
+        Raises:
+            RateLimitExceeded: اگر ظرفیت trunk در زمان انتظار آزاد نشود
         """
         if not self.connected:
             success, error = self.connect()
@@ -615,26 +1062,15 @@ class AsteriskManager:
         if caller_id:
             params['CallerID'] = caller_id
 
-        print(f"Originate with Context/Exten params: {params}")
-        response = self._send_command('Originate', params)
-        print(f"Originate response: {response}")
+        logger.debug("Originate with Context/Exten params: %s", params)
+        response = self._originate(params, limit_wait=limit_wait)
+        logger.debug("Originate response: %s", response)
 
         # بررسی پاسخ
-        if 'Response: Success' in response:
-            # استخراج Channel UniqueID از response
-            channel_uniqueid = None
-            for line in response.split('\r\n'):
-                if line.startswith('Channel:'):
-                    channel_uniqueid = line.split(':', 1)[1].strip()
-                    break
-            return True, "تماس با موفقیت آغاز شد", channel_uniqueid
-        elif 'Response: Error' in response:
-            error_msg = "خطا در برقراری تماس"
-            for line in response.split('\r\n'):
-                if line.startswith('Message:'):
-                    error_msg = line.split(':', 1)[1].strip()
-                    break
-            return False, error_msg, None
+        if response.success:
+            return True, "تماس با موفقیت آغاز شد", response.get('Channel')
+        elif response.error:
+            return False, response.message or "خطا در برقراری تماس", None
         else:
             return False, f"پاسخ نامعتبر: {response}", None
 
@@ -665,20 +1101,15 @@ class AsteriskManager:
             'Tone': 'no'
         }
 
-        print(f"Bridge params: {params}")
+        logger.debug("Bridge params: %s", params)
         response = self._send_command('Bridge', params)
-        print(f"Bridge response: {response}")
+        logger.debug("Bridge response: %s", response)
 
         # بررسی پاسخ
-        if 'Response: Success' in response:
+        if response.success:
             return True, "Bridge با موفقیت انجام شد"
-        elif 'Response: Error' in response:
-            error_msg = "خطا در bridge کردن"
-            for line in response.split('\r\n'):
-                if line.startswith('Message:'):
-                    error_msg = line.split(':', 1)[1].strip()
-                    break
-            return False, error_msg
+        elif response.error:
+            return False, response.message or "خطا در bridge کردن"
         else:
             return False, f"پاسخ نامعتبر: {response}"
 
@@ -687,7 +1118,10 @@ class AsteriskManager:
         channel: str,
         bridge_channel: str,
         caller_id: Optional[str] = None,
-        timeout: int = 30
+        timeout: int = 30,
+        trunk: Optional[Trunk] = None,
+        limit_wait: Optional[float] = None,
+        uniqueid: Optional[str] = None
     ) -> tuple[bool, str, Optional[str]]:
         """
         برقراری تماس و bridge کردن مستقیم با یک کانال دیگر
@@ -698,9 +1132,16 @@ class AsteriskManager:
             bridge_channel: کانال برای bridge کردن (مثال: SIP/trunk-00000001)
             caller_id: شماره نمایش داده شده (اختیاری)
             timeout: زمان انتظار برای برقراری تماس (ثانیه)
+            trunk: trunk تماس برای اعمال محدودیت کانال و CPS
+            limit_wait: حداکثر انتظار برای ظرفیت trunk (ثانیه)
+            uniqueid: Uniqueid کانال جدید (ChannelId)؛ در غیر این صورت
+                ساخته می‌شود
 
         Returns:
             tuple (success, message, action_id)
+
+        Raises:
+            RateLimitExceeded: اگر ظرفیت trunk در زمان انتظار آزاد نشود
         """
         if not self.connected:
             success, error = self.connect()
@@ -719,70 +1160,351 @@ class AsteriskManager:
         # اگر caller_id مشخص شده، اضافه می‌کنیم
         if caller_id:
             params['CallerID'] = caller_id
+        if uniqueid:
+            params['ChannelId'] = uniqueid
 
-        print(f"Originate Bridge params: {params}")
-        response = self._send_command('Originate', params)
-        print(f"Originate Bridge response: {response}")
+        logger.debug("Originate Bridge params: %s", params)
+        response = self._originate(params, trunk, limit_wait)
+        logger.debug("Originate Bridge response: %s", response)
 
         # بررسی پاسخ
-        if 'Response: Success' in response:
-            # استخراج ActionID
-            action_id = None
-            for line in response.split('\r\n'):
-                if line.startswith('ActionID:'):
-                    action_id = line.split(':', 1)[1].strip()
-                    break
-
-            return True, "تماس با موفقیت bridge شد", action_id
-        elif 'Response: Error' in response:
-            # استخراج پیام خطا
-            error_msg = "خطا در bridge کردن تماس"
-            for line in response.split('\r\n'):
-                if line.startswith('Message:'):
-                    error_msg = line.split(':', 1)[1].strip()
-                    break
-            return False, error_msg, None
+        if response.success:
+            return True, "تماس با موفقیت bridge شد", response.action_id
+        elif response.error:
+            return False, response.message or "خطا در bridge کردن تماس", None
         else:
             return False, f"پاسخ نامعتبر: {response}", None
 
+    def hangup(self, channel: str, cause: int = 16) -> tuple[bool, str]:
+        """
+        قطع یک کانال با Action: Hangup
+
+        Args:
+            channel: نام کانال (مثال: PJSIP/trunk-0000002a)
+            cause: کد Hangup cause (پیش‌فرض: 16 - Normal Clearing)
+
+        Returns:
+            tuple (success, message)؛ کانالی که دیگر وجود ندارد هم موفق
+            در نظر گرفته می‌شود
+        """
+        if not self.connected:
+            success, error = self.connect()
+            if not success:
+                return False, f"خطا در اتصال به Asterisk: {error}"
+
+        response = self._send_command(
+            'Hangup', {'Channel': channel, 'Cause': str(cause)}
+        )
+        if response.success:
+            return True, "کانال قطع شد"
+        message = response.message
+        if 'No such channel' in message:
+            return True, message
+        return False, message or f"پاسخ نامعتبر: {response}"
+
+    def _originate(
+        self,
+        params: Dict[str, str],
+        trunk: Optional[Trunk] = None,
+        limit_wait: Optional[float] = None
+    ) -> AMIResponse:
+        """
+        ارسال Originate با رعایت ظرفیت trunk
+
+        قبل از ارسال یک کانال و یک token CPS از limiter مشترک بین workerها
+        گرفته می‌شود؛ کانال با شکست Originate یا Hangup آزاد می‌شود.
+
+        Args:
+            params: پارامترهای Originate (ActionID و ChannelId در صورت
+                نبودن اضافه می‌شوند)
+            trunk: trunk کانال (در غیر این صورت از روی Channel یافته می‌شود)
+            limit_wait: حداکثر انتظار برای ظرفیت trunk (ثانیه)
+
+        Returns:
+            پاسخ Originate
+
+        Raises:
+            RateLimitExceeded: اگر ظرفیت trunk در زمان انتظار آزاد نشود
+        """
+        if trunk is None:
+            trunk = get_trunk_registry().resolve(
+                trunk_name_from_channel(params['Channel'])
+            )
+        limiter = get_trunk_limiter()
+        lease = limiter.acquire(trunk, limit_wait)
+
+        params.setdefault('ActionID', next_action_id())
+        params.setdefault('ChannelId', new_channel_uniqueid())
+        releaser = LeaseReleaser(
+            lease, params['ActionID'], params['ChannelId'], limiter,
+            server=self.config_name
+        )
+        releaser.attach(self.event_bus or self)
+        try:
+            response = self._send_command('Originate', params)
+        except BaseException:
+            releaser.release()
+            raise
+        if not response.success:
+            releaser.release()
+        return response
+
     def _send_command(
         self,
         action: str,
-        params: Optional[Dict[str, str]] = None
-    ) -> str:
+        params: Optional[Dict[str, str]] = None,
+        timeout: float = 5
+    ) -> AMIResponse:
         """
         ارسال دستور به Asterisk
 
+        هر action یک ActionID یکتا می‌گیرد و پاسخ آن توسط thread خواننده
+        به همین درخواست تحویل داده می‌شود؛ بنابراین چند thread می‌توانند
+        هم‌زمان روی یک socket دستور بفرستند. پاسخ actionهای لیستی بعد از
+        رسیدن Event پایانی لیست تحویل داده می‌شود.
+
         Args:
             action: نام action
             params: پارامترهای اضافی
+            timeout: حداکثر زمان انتظار برای پاسخ (ثانیه)
 
         Returns:
-            پاسخ دریافت شده
+            پاسخ دریافت شده؛ در صورت قطع اتصال یا خطا پاسخ بدون هدر و در
+            صورت timeout یک لیست ناقص (complete=False) یا پاسخ خالی
         """
         if not self.connected or not self.socket:
-            return "Not connected"
+            return AMIResponse.failed("Not connected")
+
+        params = dict(params or {})
+        action_id = params.pop('ActionID', None) or next_action_id()
+        command = build_action(action, action_id, params)
 
-        command = f"Action: {action}\r\n"
-        if params:
-            for key, value in params.items():
-                command += f"{key}: {value}\r\n"
-        command += "\r\n"
+        future: Future = Future()
+        with self._pending_lock:
+            if not self._reader_alive:
+                return AMIResponse.failed("Not connected")
+            self._pending[action_id] = future
 
         try:
-            self.socket.send(command.encode())
-            response = self._receive_response()
+            started = time.perf_counter()
+            with self._write_lock:
+                self.socket.sendall(command)
+            response = future.result(timeout=timeout)
+            self.last_activity = time.monotonic()
+            AMI_ACTION_SECONDS.labels(action).observe(
+                time.perf_counter() - started
+            )
             return response
+        except FutureTimeoutError:
+            AMI_ACTION_TIMEOUTS.labels(action).inc()
+            logger.warning(
+                "Timeout در انتظار پاسخ %s", action,
+                extra={'action_id': action_id}
+            )
+            with self._pending_lock:
+                partial = self._lists.pop(action_id, None)
+            return partial or AMIResponse.failed("")
+        except Exception as e:
+            logger.error("خطا در ارسال دستور %s: %s", action, e)
+            # socket خراب است؛ pool باید این session را دوباره login کند
+            self.connected = False
+            return AMIResponse.failed(f"Error: {e}")
+        finally:
+            with self._pending_lock:
+                self._pending.pop(action_id, None)
+                self._lists.pop(action_id, None)
+
+    def _start_reader(self):
+        """شروع thread خواننده که پاسخ‌ها و Eventها را توزیع می‌کند"""
+        self.socket.settimeout(None)
+        with self._pending_lock:
+            self._reader_alive = True
+        self._reader_thread = threading.Thread(
+            target=self._reader_loop,
+            args=(self.socket, self._parser),
+            name=f"ami-reader-{self.host}:{self.port}",
+            daemon=True
+        )
+        self._reader_thread.start()
+
+    def _reader_loop(self, sock: socket.socket, parser: AMIFrameParser):
+        """
+        خواندن پیوسته از socket و تفکیک frameهای AMI
+
+        پاسخ‌ها بر اساس ActionID به Future مربوطه و Eventها به
+        subscriberها تحویل داده می‌شوند.
+
+        Args:
+            sock: socket اتصال
+            parser: parser همین اتصال که ممکن است بایت‌های باقی‌مانده از
+                login را در خود داشته باشد
+        """
+        error: Optional[Exception] = None
+        try:
+            while True:
+                for headers, frame in parser.frames():
+                    self._dispatch_frame(headers, frame)
+                data = sock.recv(65536)
+                if not data:
+                    break
+                if logger.isEnabledFor(logging.DEBUG) and _chunk_sampler.hit():
+                    logger.debug(
+                        "AMI chunk received",
+                        extra={
+                            'bytes': len(data),
+                            'buffered': parser.pending_bytes()
+                        }
+                    )
+                parser.feed(data)
         except Exception as e:
-            print(f"خطا در ارسال دستور: {e}")
-            return f"Error: {e}"
+            error = e
+            if self.connected:
+                logger.error("خطا در خواندن از Asterisk: %s", e)
+        finally:
+            self.connected = False
+            with self._pending_lock:
+                self._reader_alive = False
+                pending = list(self._pending.values())
+                self._pending.clear()
+                self._lists.clear()
+            for future in pending:
+                if not future.done():
+                    future.set_exception(
+                        error or ConnectionError("اتصال AMI بسته شد")
+                    )
+
+    def _dispatch_frame(self, headers: Dict[str, str], frame: str):
+        """
+        تحویل یک frame کامل به مقصد آن
+
+        Args:
+            headers: هدرهای تجزیه شده frame
+            frame: متن frame بدون جداکننده انتهایی
+        """
+
+        # Eventهایی مثل OriginateResponse هدر Response هم دارند
+        if 'Event' in headers:
+            # Eventهای لیست یک action به پاسخ همان action اضافه می‌شوند
+            if self._lists and self._collect_list_event(headers, frame):
+                return
+            with self._subscribers_lock:
+                subscribers = list(self._subscribers.values())
+            for callback in subscribers:
+                try:
+                    callback(headers)
+                except Exception:
+                    logger.exception(
+                        "خطا در پردازش Event %s", headers.get('Event')
+                    )
+        elif 'Response' in headers:
+            action_id = headers.get('ActionID')
+            response = AMIResponse(headers, frame)
+            with self._pending_lock:
+                future = self._pending.get(action_id)
+                if future and response.is_list:
+                    self._lists[action_id] = response
+                    return
+            if future and not future.done():
+                future.set_result(response)
+            else:
+                logger.debug(
+                    "پاسخ بدون درخواست متناظر",
+                    extra={'action_id': action_id}
+                )
+
+    def _collect_list_event(self, headers: Dict[str, str], frame: str) -> bool:
+        """
+        افزودن Event به لیست actionی که منتظر آن است
+
+        Returns:
+            True اگر Event متعلق به یک لیست باشد (به subscriberها نمی‌رسد)
+        """
+        action_id = headers.get('ActionID')
+        with self._pending_lock:
+            response = self._lists.get(action_id)
+            if response is None:
+                return False
+            if not response.add_event(AMIMessage(headers, frame)):
+                return True
+            del self._lists[action_id]
+            future = self._pending.get(action_id)
+        if future and not future.done():
+            future.set_result(response)
+        return True
+
+    def subscribe(
+        self,
+        callback: Callable[[Dict[str, str]], None],
+        keys: Optional[List[tuple[str, str]]] = None
+    ) -> int:
+        """
+        ثبت callback برای دریافت Eventهای AMI
+
+        callback در thread خواننده اجرا می‌شود و نباید بلاک شود.
+
+        Args:
+            callback: تابعی که دیکشنری هدرهای Event را می‌گیرد
+            keys: برای سازگاری با AMIEventBus.subscribe؛ روی اتصال مستقیم
+                همه Eventها تحویل داده می‌شوند
+
+        Returns:
+            شناسه اشتراک برای unsubscribe
+        """
+        with self._subscribers_lock:
+            token = next(self._subscriber_ids)
+            self._subscribers[token] = callback
+            return token
+
+    def unsubscribe(self, token: int):
+        """
+        لغو اشتراک Event
+
+        Args:
+            token: شناسه برگشتی از subscribe
+        """
+        with self._subscribers_lock:
+            self._subscribers.pop(token, None)
+
+    def pending_actions(self) -> int:
+        """تعداد actionهایی که منتظر پاسخ هستند"""
+        with self._pending_lock:
+            return len(self._pending)
+
+    def ping(self) -> bool:
+        """
+        ارسال Action: Ping برای keepalive و بررسی سلامت session
+
+        Returns:
+            True اگر Asterisk پاسخ موفق بدهد
+        """
+        if not self.connected:
+            return False
+        return self._send_command('Ping').success
+
+    def ensure_connected(self) -> tuple[bool, str]:
+        """
+        login مجدد در صورت قطع بودن اتصال (thread-safe)
+
+        Returns:
+            tuple (success, error_message)
+        """
+        with self._connect_lock:
+            if self.connected:
+                return True, ""
+            self.disconnect()
+            return self.connect()
 
     def disconnect(self):
         """قطع اتصال از Asterisk"""
         if self.socket:
             try:
                 if self.connected:
-                    self._send_command("Logoff")
+                    self._send_command("Logoff", timeout=2)
+                # shutdown باعث بیدار شدن thread خواننده می‌شود
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            try:
                 self.socket.close()
             except Exception:
                 pass
@@ -790,6 +1512,11 @@ class AsteriskManager:
                 self.socket = None
                 self.connected = False
 
+        reader = self._reader_thread
+        if reader and reader is not threading.current_thread():
+            reader.join(timeout=2)
+        self._reader_thread = None
+
     def create_pjsip_trunk(
         self,
         trunk_name: str,
@@ -819,16 +1546,15 @@ class AsteriskManager:
                 return False
 
         # بررسی وجود endpoint
-        response = self._send_command("PJSIPShowEndpoints")
-        if trunk_name in response:
-            print(f"Trunk {trunk_name} از قبل وجود دارد")
+        if trunk_name in self._endpoint_names():
+            logger.info("Trunk %s از قبل وجود دارد", trunk_name)
             return True
 
         # ایجاد trunk با استفاده از CLI (اگر AMI مستقیماً پشتیبانی نکند)
         # این کار معمولاً از طریق CLI یا فایل‌های پیکربندی انجام می‌شود
-        print(
-            f"برای ایجاد trunk {trunk_name}، "
-            f"از CLI یا فایل‌های پیکربندی استفاده کنید"
+        logger.info(
+            "برای ایجاد trunk %s، از CLI یا فایل‌های پیکربندی استفاده کنید",
+            trunk_name
         )
         return True
 
@@ -843,11 +1569,11 @@ class AsteriskManager:
             اطلاعات وضعیت trunk
         """
         if not self.connected:
-            if not self.connect():
+            success, _ = self.connect()
+            if not success:
                 return {"status": "not_connected"}
 
-        response = self._send_command("PJSIPShowEndpoints")
-        if trunk_name in response:
+        if trunk_name in self._endpoint_names():
             return {
                 "status": "exists",
                 "name": trunk_name
@@ -862,22 +1588,77 @@ class AsteriskManager:
             لیست نام trunk‌ها
         """
         if not self.connected:
-            if not self.connect():
+            success, _ = self.connect()
+            if not success:
                 return []
 
-        response = self._send_command("PJSIPShowEndpoints")
-        # تجزیه پاسخ و استخراج نام trunk‌ها
-        trunks = []
-        lines = response.split('\n')
-        for line in lines:
-            if 'Endpoint:' in line:
-                parts = line.split(':')
-                if len(parts) > 1:
-                    trunk_name = parts[1].strip()
-                    if trunk_name:
-                        trunks.append(trunk_name)
-
-        return trunks
+        return self._endpoint_names()
+
+    def _endpoint_names(self) -> List[str]:
+        """نام endpointهای PJSIP (خالی در صورت خطا)"""
+        return [
+            endpoint['ObjectName']
+            for endpoint in self.list_endpoints() or []
+            if endpoint.get('ObjectName')
+        ]
+
+    def list_endpoints(self) -> Optional[List[Dict[str, str]]]:
+        """
+        فهرست endpointهای PJSIP (Eventهای EndpointList)
+
+        Returns:
+            هدرهای هر endpoint یا None اگر لیست کامل دریافت نشود
+        """
+        return self._list_action('PJSIPShowEndpoints', 'EndpointList')
+
+    def list_sip_peers(self) -> Optional[List[Dict[str, str]]]:
+        """
+        فهرست peerهای chan_sip (Eventهای PeerEntry)
+
+        Returns:
+            هدرهای هر peer یا None اگر لیست کامل دریافت نشود
+        """
+        return self._list_action('SIPpeers', 'PeerEntry')
+
+    def list_channels(self) -> Optional[List[Dict[str, str]]]:
+        """
+        فهرست کانال‌های فعال (Eventهای CoreShowChannel)
+
+        Returns:
+            هدرهای هر کانال یا None اگر لیست کامل دریافت نشود
+        """
+        return self._list_action('CoreShowChannels', 'CoreShowChannel')
+
+    def _list_action(
+        self,
+        action: str,
+        event_name: str,
+        timeout: float = 10
+    ) -> Optional[List[Dict[str, str]]]:
+        """
+        اجرای یک action لیستی و جمع‌آوری Eventهای آن تا EventList: Complete
+
+        Args:
+            action: نام action (مثال: PJSIPShowEndpoints)
+            event_name: نام Event هر آیتم (مثال: EndpointList)
+            timeout: حداکثر زمان انتظار برای کامل شدن لیست (ثانیه)
+
+        Returns:
+            هدرهای Eventهای لیست؛ لیست خالی اگر Asterisk action را رد کند
+            (مثلاً ماژول بارگذاری نشده یا آیتمی وجود ندارد) و None اگر
+            پاسخ یا Event پایانی نرسد
+        """
+        response = self._send_command(action, timeout=timeout)
+        if response.error:
+            logger.debug("%s رد شد: %s", action, response.message)
+            return []
+        if not response.success or not response.complete:
+            logger.warning(
+                "لیست %s کامل دریافت نشد (%d آیتم)",
+                action, len(response.events)
+            )
+            return None
+        return [event.headers for event in response.events_named(event_name)]
 
     def is_connected(self) -> bool:
         """بررسی اتصال به Asterisk"""
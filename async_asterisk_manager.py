@@ -0,0 +1,638 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import Optional, Dict, List, Callable, Iterable
+
+from asterisk_manager import (
+    AMIMessage,
+    AMIResponse,
+    AsteriskManager,
+    LeaseReleaser,
+    OriginateWatcher,
+    build_action,
+    new_channel_uniqueid,
+    next_action_id,
+    parse_frame,
+    trunk_name_from_channel,
+)
+from ami_events import EventKey, event_keys
+from rate_limit import get_trunk_limiter
+from trunk_registry import Trunk, get_trunk_registry
+from metrics import (
+    AMI_LOGIN_SECONDS,
+    AMI_ACTION_SECONDS,
+    AMI_ACTION_TIMEOUTS,
+    AMI_ANSWER_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAsteriskManager:
+    """
+    نسخه asyncio از AsteriskManager برای endpointهای ASGI
+
+    یک اتصال روی event loop باز می‌شود و تمام actionها با ActionID روی
+    همان اتصال تفکیک می‌شوند؛ هیچ thread جداگانه‌ای برای هر تماس لازم نیست.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        secret: str,
+        config_name: str = 'default'
+    ):
+        """
+        مقداردهی اولیه Async Asterisk Manager
+
+        Args:
+            host: آدرس سرور Asterisk
+            port: پورت AMI
+            username: نام کاربری AMI
+            secret: رمز عبور AMI
+            config_name: نام پیکربندی در دیتابیس
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.secret = secret
+        self.config_name = config_name
+        self.connected = False
+        self.last_activity = 0.0
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._lists: Dict[str, AMIResponse] = {}
+        self._subscribers: Dict[int, Callable[[Dict[str, str]], None]] = {}
+        # subscriberهای یک تماس فقط Eventهای کلیدهای خود را می‌گیرند
+        self._keyed_subscribers: Dict[
+            EventKey, Dict[int, Callable[[Dict[str, str]], None]]
+        ] = {}
+        self._subscription_keys: Dict[int, List[EventKey]] = {}
+        self._subscriber_ids = itertools.count(1)
+
+    @classmethod
+    def from_manager(
+        cls,
+        manager: AsteriskManager
+    ) -> 'AsyncAsteriskManager':
+        """
+        ساخت نمونه async با تنظیمات یک AsteriskManager
+
+        Args:
+            manager: AsteriskManager حامل تنظیمات (مثلاً pool.settings())
+        """
+        return cls(
+            host=manager.host,
+            port=manager.port,
+            username=manager.username,
+            secret=manager.secret,
+            config_name=manager.config_name
+        )
+
+    async def connect(self, timeout: float = 10) -> tuple[bool, str]:
+        """
+        اتصال و login به سرور Asterisk
+
+        Args:
+            timeout: حداکثر زمان انتظار برای هر مرحله (ثانیه)
+
+        Returns:
+            tuple (success, error_message)
+        """
+        started = time.perf_counter()
+        success, error = await self._login(timeout)
+        AMI_LOGIN_SECONDS.labels('success' if success else 'failure').observe(
+            time.perf_counter() - started
+        )
+        return success, error
+
+    async def _login(self, timeout: float) -> tuple[bool, str]:
+        """
+        باز کردن اتصال و login به AMI
+
+        Returns:
+            tuple (success, error_message)
+        """
+        if not all([self.host, self.port, self.username, self.secret]):
+            return False, "تنظیمات Asterisk کامل نیست"
+
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port),
+                timeout
+            )
+            # پیام خوش‌آمدگویی فقط یک خط است
+            await asyncio.wait_for(self._reader.readline(), timeout)
+
+            self._writer.write(build_action('Login', next_action_id(), {
+                'Username': self.username,
+                'Secret': self.secret
+            }))
+            await self._writer.drain()
+
+            # Eventهایی که قبل از پاسخ login برسند نادیده گرفته می‌شوند
+            while True:
+                frame = await asyncio.wait_for(
+                    self._reader.readuntil(b"\r\n\r\n"),
+                    timeout
+                )
+                headers = parse_frame(frame.decode('utf-8', errors='ignore'))
+                if 'Event' not in headers:
+                    break
+
+            if headers.get('Response') == 'Success':
+                self.connected = True
+                self.last_activity = time.monotonic()
+                self._reader_task = asyncio.create_task(self._reader_loop())
+                return True, ""
+
+            error_msg = headers.get('Message', 'Authentication failed')
+            await self.disconnect()
+            return False, f"خطا در احراز هویت: {error_msg}"
+
+        except asyncio.TimeoutError:
+            await self.disconnect()
+            return False, (
+                f"Timeout: نمی‌توان به {self.host}:{self.port} متصل شد"
+            )
+        except ConnectionRefusedError:
+            await self.disconnect()
+            return False, (
+                f"اتصال رد شد: "
+                f"سرور {self.host}:{self.port} در دسترس نیست"
+            )
+        except Exception as e:
+            await self.disconnect()
+            return False, f"خطا در اتصال: {str(e)}"
+
+    async def _reader_loop(self):
+        """خواندن پیوسته frameها و تحویل پاسخ‌ها و Eventها"""
+        error: Optional[Exception] = None
+        try:
+            while True:
+                frame = await self._reader.readuntil(b"\r\n\r\n")
+                self._dispatch_frame(
+                    frame[:-4].decode('utf-8', errors='ignore')
+                )
+        except asyncio.IncompleteReadError:
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+            logger.warning("خطا در خواندن از Asterisk: %s", e)
+        finally:
+            self.connected = False
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._lists.clear()
+            for future in pending:
+                if not future.done():
+                    future.set_exception(
+                        error or ConnectionError("اتصال AMI بسته شد")
+                    )
+
+    def _dispatch_frame(self, frame: str):
+        """
+        تحویل یک frame کامل به مقصد آن
+
+        Args:
+            frame: متن frame بدون جداکننده انتهایی
+        """
+        headers = parse_frame(frame)
+        if 'Event' in headers:
+            response = self._lists.get(headers.get('ActionID'))
+            if response is not None:
+                # Event لیست یک action؛ به subscriberها تحویل داده نمی‌شود
+                if response.add_event(AMIMessage(headers, frame)):
+                    self._resolve(self._lists.pop(response.action_id))
+                return
+            callbacks = dict(self._subscribers)
+            for key in event_keys(headers):
+                subscribers = self._keyed_subscribers.get(key)
+                if subscribers:
+                    # callback ثبت شده روی چند کلید فقط یک بار صدا زده می‌شود
+                    callbacks.update(subscribers)
+            for callback in callbacks.values():
+                try:
+                    callback(headers)
+                except Exception:
+                    logger.exception(
+                        "خطا در پردازش Event %s", headers.get('Event')
+                    )
+        elif 'Response' in headers:
+            response = AMIResponse(headers, frame)
+            if response.is_list and response.action_id in self._pending:
+                self._lists[response.action_id] = response
+            else:
+                self._resolve(response)
+
+    def _resolve(self, response: AMIResponse):
+        """تحویل پاسخ به Future منتظر همان ActionID"""
+        future = self._pending.get(response.action_id)
+        if future and not future.done():
+            future.set_result(response)
+
+    def subscribe(
+        self,
+        callback: Callable[[Dict[str, str]], None],
+        keys: Optional[Iterable[EventKey]] = None
+    ) -> int:
+        """
+        ثبت callback برای دریافت Eventهای AMI (روی event loop اجرا می‌شود)
+
+        Args:
+            callback: تابعی که دیکشنری هدرهای Event را می‌گیرد
+            keys: اگر مشخص شود فقط Eventهای این کلیدها تحویل داده می‌شوند،
+                مثلاً [('ActionID', ...), ('Uniqueid', ...)]
+
+        Returns:
+            شناسه اشتراک برای unsubscribe
+        """
+        token = next(self._subscriber_ids)
+        if keys is None:
+            self._subscribers[token] = callback
+            return token
+        keys = list(keys)
+        self._subscription_keys[token] = keys
+        for key in keys:
+            self._keyed_subscribers.setdefault(key, {})[token] = callback
+        return token
+
+    def unsubscribe(self, token: int):
+        """لغو اشتراک Event"""
+        self._subscribers.pop(token, None)
+        for key in self._subscription_keys.pop(token, ()):
+            subscribers = self._keyed_subscribers.get(key)
+            if subscribers is not None:
+                subscribers.pop(token, None)
+                if not subscribers:
+                    del self._keyed_subscribers[key]
+
+    async def _originate(
+        self,
+        params: Dict[str, str],
+        trunk: Optional[Trunk] = None,
+        limit_wait: Optional[float] = None
+    ) -> AMIResponse:
+        """
+        ارسال Originate با رعایت ظرفیت trunk (معادل async متد همنام)
+
+        Raises:
+            RateLimitExceeded: اگر ظرفیت trunk در زمان انتظار آزاد نشود
+        """
+        if trunk is None:
+            trunk = get_trunk_registry().resolve(
+                trunk_name_from_channel(params['Channel'])
+            )
+        limiter = get_trunk_limiter()
+        lease = await limiter.acquire_async(trunk, limit_wait)
+
+        params.setdefault('ActionID', next_action_id())
+        params.setdefault('ChannelId', new_channel_uniqueid())
+        releaser = LeaseReleaser(
+            lease, params['ActionID'], params['ChannelId'], limiter,
+            server=self.config_name,
+            loop=asyncio.get_running_loop()
+        )
+        releaser.attach(self)
+        try:
+            response = await self._send_command('Originate', params)
+        except BaseException:
+            releaser.release()
+            raise
+        if not response.success:
+            releaser.release()
+        return response
+
+    async def _send_command(
+        self,
+        action: str,
+        params: Optional[Dict[str, str]] = None,
+        timeout: float = 5
+    ) -> AMIResponse:
+        """
+        ارسال دستور به Asterisk و انتظار برای پاسخ همان ActionID
+
+        پاسخ actionهای لیستی بعد از رسیدن Event پایانی لیست برگردانده
+        می‌شود.
+
+        Args:
+            action: نام action
+            params: پارامترهای اضافی
+            timeout: حداکثر زمان انتظار برای پاسخ (ثانیه)
+
+        Returns:
+            پاسخ دریافت شده (AMIResponse.failed در صورت قطع اتصال، خطا یا
+            timeout؛ لیست ناقص با complete=False اگر لیست کامل نشود)
+        """
+        if not self.connected or not self._writer:
+            return AMIResponse.failed("Not connected")
+
+        params = dict(params or {})
+        action_id = params.pop('ActionID', None) or next_action_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[action_id] = future
+        try:
+            started = time.perf_counter()
+            self._writer.write(build_action(action, action_id, params))
+            await self._writer.drain()
+            response = await asyncio.wait_for(future, timeout)
+            self.last_activity = time.monotonic()
+            AMI_ACTION_SECONDS.labels(action).observe(
+                time.perf_counter() - started
+            )
+            return response
+        except asyncio.TimeoutError:
+            AMI_ACTION_TIMEOUTS.labels(action).inc()
+            logger.warning(
+                "Timeout در انتظار پاسخ %s (ActionID: %s)", action, action_id
+            )
+            return self._lists.pop(action_id, None) or AMIResponse.failed("")
+        except Exception as e:
+            logger.warning("خطا در ارسال دستور %s: %s", action, e)
+            self.connected = False
+            return AMIResponse.failed(f"Error: {e}")
+        finally:
+            self._pending.pop(action_id, None)
+            self._lists.pop(action_id, None)
+
+    async def ping(self) -> bool:
+        """ارسال Action: Ping و بررسی سلامت اتصال"""
+        if not self.connected:
+            return False
+        response = await self._send_command('Ping')
+        return response.success
+
+    async def hangup(self, channel: str, cause: int = 16) -> tuple[bool, str]:
+        """
+        قطع یک کانال با Action: Hangup (معادل async متد همنام)
+
+        Returns:
+            tuple (success, message)
+        """
+        response = await self._send_command(
+            'Hangup', {'Channel': channel, 'Cause': str(cause)}
+        )
+        if response.success:
+            return True, "کانال قطع شد"
+        message = response.message
+        if 'No such channel' in message:
+            return True, message
+        return False, message or f"پاسخ نامعتبر: {response}"
+
+    async def originate_call_direct(
+        self,
+        channel: str,
+        number: str,
+        caller_id: Optional[str] = None,
+        timeout: int = 30,
+        answer_timeout: Optional[float] = None,
+        dial_string: Optional[str] = None,
+        trunk: Optional[Trunk] = None,
+        limit_wait: Optional[float] = None,
+        uniqueid: Optional[str] = None
+    ) -> tuple[bool, str, Optional[str]]:
+        """
+        برقراری تماس مستقیم بدون dialplan (معادل async متد همنام)
+
+        Args:
+            answer_timeout: اگر مشخص شود، تا پاسخ دادن کانال بر اساس
+                Eventها صبر می‌کند (ثانیه)
+            dial_string: رشته dial آماده از trunk (Trunk.dial_string)
+            trunk: trunk تماس برای اعمال محدودیت کانال و CPS
+            limit_wait: حداکثر انتظار برای ظرفیت trunk (ثانیه)
+            uniqueid: Uniqueid کانال (ChannelId)؛ در غیر این صورت ساخته
+                می‌شود
+
+        Returns:
+            tuple (success, message, channel_id)
+
+        Raises:
+            RateLimitExceeded: اگر ظرفیت trunk در زمان انتظار آزاد نشود
+        """
+        channel_parts = channel.split('/')
+        trunk_name = (
+            channel_parts[1]
+            if len(channel_parts) > 1 else 'trunk_external'
+        )
+        watcher = OriginateWatcher(
+            next_action_id(), uniqueid or new_channel_uniqueid()
+        )
+        params = {
+            'ActionID': watcher.action_id,
+            'Channel': channel,
+            'ChannelId': watcher.uniqueid,
+            'Application': 'Dial',
+            'Data': dial_string or f"SIP/{trunk_name}/{number}",
+            'Timeout': str(timeout * 1000),
+            'Async': 'true'
+        }
+        if caller_id:
+            params['CallerID'] = caller_id
+
+        finished = asyncio.get_running_loop().create_future()
+
+        def on_event(event: Dict[str, str]):
+            watcher.handle_event(event)
+            if watcher.done.is_set() and not finished.done():
+                finished.set_result(None)
+
+        token = self.subscribe(
+            on_event,
+            keys=[
+                ('ActionID', watcher.action_id),
+                ('Uniqueid', watcher.uniqueid)
+            ]
+        )
+        try:
+            sent_at = time.monotonic()
+            response = await self._originate(params, trunk, limit_wait)
+            if response.success:
+                if answer_timeout is not None:
+                    try:
+                        await asyncio.wait_for(
+                            asyncio.shield(finished), answer_timeout
+                        )
+                    except asyncio.TimeoutError:
+                        watcher.wait(0)
+                    if not watcher.answered:
+                        return False, watcher.error_message(), None
+                    AMI_ANSWER_SECONDS.observe(watcher.answered_at - sent_at)
+                return True, str(response), watcher.channel or channel
+            elif response.error:
+                return False, response.message or "خطا در برقراری تماس", None
+            return False, f"پاسخ نامعتبر: {response}", None
+        finally:
+            self.unsubscribe(token)
+
+    async def originate_call(
+        self,
+        channel: str,
+        number: str,
+        caller_id: Optional[str] = None,
+        timeout: int = 30,
+        dial_string: Optional[str] = None,
+        trunk: Optional[Trunk] = None,
+        limit_wait: Optional[float] = None
+    ) -> tuple[bool, str, Optional[str]]:
+        """
+        برقراری تماس به یک شماره (معادل async متد همنام)
+
+        Returns:
+            tuple (success, message, action_id)
+
+        Raises:
+            RateLimitExceeded: اگر ظرفیت trunk در زمان انتظار آزاد نشود
+        """
+        channel_parts = channel.split('/')
+        trunk_name = (
+            channel_parts[1]
+            if len(channel_parts) > 1 else 'trunk_external'
+        )
+        params = {
+            'Channel': channel,
+            'Application': 'Dial',
+            'Data': dial_string or f"SIP/{trunk_name}/{number}",
+            'Timeout': str(timeout * 1000),
+            'Async': 'true'
+        }
+        if caller_id:
+            params['CallerID'] = caller_id
+
+        response = await self._originate(params, trunk, limit_wait)
+        if response.success:
+            return True, "تماس با موفقیت آغاز شد", response.action_id
+        elif response.error:
+            return False, response.message or "خطا در برقراری تماس", None
+        return False, f"پاسخ نامعتبر: {response}", None
+
+    async def originate_bridge_call(
+        self,
+        channel: str,
+        bridge_channel: str,
+        caller_id: Optional[str] = None,
+        timeout: int = 30,
+        trunk: Optional[Trunk] = None,
+        limit_wait: Optional[float] = None,
+        uniqueid: Optional[str] = None
+    ) -> tuple[bool, str, Optional[str]]:
+        """
+        برقراری تماس و dial مستقیم به یک کانال دیگر (معادل async متد همنام)
+
+        Args:
+            uniqueid: Uniqueid کانال جدید (ChannelId)؛ در غیر این صورت
+                ساخته می‌شود
+
+        Returns:
+            tuple (success, message, action_id)
+
+        Raises:
+            RateLimitExceeded: اگر ظرفیت trunk در زمان انتظار آزاد نشود
+        """
+        params = {
+            'Channel': channel,
+            'Application': 'Dial',
+            'Data': bridge_channel,
+            'Timeout': str(timeout * 1000),
+            'Async': 'true'
+        }
+        if caller_id:
+            params['CallerID'] = caller_id
+        if uniqueid:
+            params['ChannelId'] = uniqueid
+
+        response = await self._originate(params, trunk, limit_wait)
+        if response.success:
+            return True, "تماس با موفقیت bridge شد", response.action_id
+        elif response.error:
+            return False, response.message or "خطا در bridge کردن تماس", None
+        return False, f"پاسخ نامعتبر: {response}", None
+
+    async def disconnect(self):
+        """قطع اتصال از Asterisk"""
+        if self.connected:
+            await self._send_command('Logoff', timeout=2)
+        self.connected = False
+        if self._reader_task and not self._reader_task.done():
+            self._reader_task.cancel()
+        if self._writer:
+            try:
+                self._writer.close()
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+
+    def is_connected(self) -> bool:
+        """بررسی اتصال به Asterisk"""
+        return self.connected
+
+
+_async_managers: Dict[str, AsyncAsteriskManager] = {}
+_async_lock: Optional[asyncio.Lock] = None
+
+
+def _same_settings(
+    manager: AsyncAsteriskManager,
+    settings: AsteriskManager
+) -> bool:
+    """بررسی اینکه اتصال با تنظیمات فعلی login کرده باشد"""
+    return (
+        manager.host == settings.host and
+        manager.port == settings.port and
+        manager.username == settings.username and
+        manager.secret == settings.secret
+    )
+
+
+async def get_async_ami(
+    settings: AsteriskManager
+) -> tuple[Optional[AsyncAsteriskManager], str]:
+    """
+    دریافت اتصال مشترک async برای یک پیکربندی
+
+    یک اتصال multiplex شده برای تمام درخواست‌های هم‌زمان کافی است؛ در
+    صورت قطع شدن، درخواست بعدی دوباره login می‌کند.
+
+    Args:
+        settings: AsteriskManager حامل تنظیمات (pool.settings())
+
+    Returns:
+        tuple (manager, error_message)
+    """
+    global _async_lock
+    if _async_lock is None:
+        _async_lock = asyncio.Lock()
+
+    async with _async_lock:
+        manager = _async_managers.get(settings.config_name)
+        if manager is not None and manager.is_connected() and (
+            _same_settings(manager, settings)
+        ):
+            return manager, ""
+        if manager is not None:
+            await manager.disconnect()
+        manager = AsyncAsteriskManager.from_manager(settings)
+        success, error = await manager.connect()
+        if not success:
+            _async_managers.pop(settings.config_name, None)
+            return None, error
+        _async_managers[settings.config_name] = manager
+        return manager, ""
+
+
+async def close_async_ami():
+    """بستن تمام اتصال‌های async (هنگام shutdown)"""
+    managers = list(_async_managers.values())
+    _async_managers.clear()
+    for manager in managers:
+        await manager.disconnect()
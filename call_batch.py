@@ -0,0 +1,641 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import (
+    Optional, Dict, Any, Callable, List, Iterator, AsyncIterator, Tuple
+)
+
+from psycopg2.extras import Json, execute_values
+
+from call_orchestrator import get_orchestrator
+from call_state_machine import CallSessionStateMachine
+from db import get_db_connection
+from rate_limit import TokenBucket
+from trunk_registry import get_trunk_registry
+
+logger = logging.getLogger(__name__)
+
+# حداکثر answer_timeout قابل درخواست (ثانیه)
+CALL_ANSWER_TIMEOUT_MAX = float(os.getenv('CALL_ANSWER_TIMEOUT_MAX', '300'))
+
+
+def parse_answer_timeout(value: Any) -> tuple[Optional[float], str]:
+    """
+    اعتبارسنجی answer_timeout درخواست
+
+    مقدار باید عددی متناهی، بزرگ‌تر از صفر و حداکثر
+    CALL_ANSWER_TIMEOUT_MAX باشد؛ inf باعث OverflowError در انتظار و
+    nan/صفر/منفی باعث FAILED_A با leg A زنده می‌شوند.
+
+    Returns:
+        tuple (answer_timeout یا None، پیام خطا)
+    """
+    error = (
+        f"answer_timeout باید عددی بین 0 و "
+        f"{CALL_ANSWER_TIMEOUT_MAX:g} ثانیه باشد"
+    )
+    if isinstance(value, bool):
+        return None, error
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return None, error
+    if not math.isfinite(timeout) or not (
+        0 < timeout <= CALL_ANSWER_TIMEOUT_MAX
+    ):
+        return None, error
+    return timeout, ""
+
+
+def parse_batch_body(
+    body: bytes,
+    ndjson: bool = False
+) -> tuple[bool, Any]:
+    """
+    خواندن ورودی‌های batch از body درخواست
+
+    قالب‌های پذیرفته شده: لیست JSON، شیء JSON با کلید calls یا NDJSON
+    (هر خط یک شیء).
+
+    Args:
+        body: body خام درخواست
+        ndjson: آیا Content-Type برابر application/x-ndjson است
+
+    Returns:
+        tuple (success, لیست ورودی‌ها یا پیام خطا)
+    """
+    text = body.decode('utf-8', errors='replace').strip()
+    if not text:
+        return False, "لیست تماس‌ها خالی است"
+
+    if not ndjson:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            # body چندخطی بدون Content-Type مشخص به صورت NDJSON خوانده می‌شود
+            ndjson = '\n' in text
+            if not ndjson:
+                return False, "JSON نامعتبر است"
+        else:
+            if isinstance(data, dict):
+                data = data.get('calls')
+            if not isinstance(data, list):
+                return False, "لیست calls در درخواست یافت نشد"
+            return True, data
+
+    entries = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            return False, f"خط {line_number} JSON معتبر نیست"
+    return True, entries
+
+
+def normalize_entry(
+    entry: Any,
+    answer_timeout: float
+) -> tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    اعتبارسنجی یک ورودی batch
+
+    Args:
+        entry: شیء {number_a, number_b, caller_id, trunk}
+        answer_timeout: مقدار پیش‌فرض answer_timeout
+
+    Returns:
+        tuple (پارامترهای run_masked_call یا None، پیام خطا)
+    """
+    if not isinstance(entry, dict):
+        return None, "ورودی باید شیء JSON باشد"
+    number_a = entry.get('number_a')
+    number_b = entry.get('number_b')
+    if not number_a or not number_b:
+        return None, "شماره تماس گیرنده و مقصد الزامی است"
+    timeout, error = parse_answer_timeout(
+        entry.get('answer_timeout', answer_timeout)
+    )
+    if timeout is None:
+        return None, error
+    return {
+        'number_a': str(number_a),
+        'number_b': str(number_b),
+        'caller_id': entry.get('caller_id'),
+        'trunk_name': entry.get('trunk', 'trunk_external'),
+        'answer_timeout': timeout,
+        # تماس‌های batch به جای رد فوری تا آزاد شدن ظرفیت trunk صبر می‌کنند
+        'limit_wait': float(os.getenv('CALL_BATCH_LIMIT_WAIT', '60')),
+    }, None
+
+
+class CallBatch:
+    """
+    یک batch از تماس‌های مسدود و نتایج آن به ترتیب پایان
+
+    نتایج با Condition به streamها و با call_soon_threadsafe به streamهای
+    asyncio اطلاع داده می‌شوند.
+    """
+
+    def __init__(self, batch_id: str, items: List[Dict[str, Any]]):
+        """
+        Args:
+            batch_id: شناسه batch
+            items: ورودی‌ها شامل session_id، position و params
+        """
+        self.batch_id = batch_id
+        self.items = items
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._positions = {
+            item['session_id']: item['position'] for item in items
+        }
+        self._results: List[Dict[str, Any]] = []
+        self._condition = threading.Condition()
+        self._async_waiters: List[
+            Tuple[asyncio.AbstractEventLoop, asyncio.Event]
+        ] = []
+
+    @property
+    def total(self) -> int:
+        return len(self.items)
+
+    def is_done(self) -> bool:
+        """آیا تمام جلسه‌ها تمام شده‌اند"""
+        return len(self._results) >= self.total
+
+    def record_result(self, info: Dict[str, Any]) -> bool:
+        """
+        ثبت نتیجه یک جلسه
+
+        Args:
+            info: وضعیت نهایی جلسه (خروجی CallOrchestrator.get)
+
+        Returns:
+            True اگر با این نتیجه batch تمام شده باشد
+        """
+        result = {
+            'session_id': info['session_id'],
+            'position': self._positions.get(info['session_id']),
+            'state': info['state'],
+            'result': info['result'],
+        }
+        with self._condition:
+            self._results.append(result)
+            done = self.is_done()
+            if done:
+                self.finished_at = time.time()
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # event loop بسته شده است
+                pass
+        return done
+
+    def summary(self) -> Dict[str, Any]:
+        """خلاصه وضعیت batch"""
+        with self._condition:
+            states: Dict[str, int] = {}
+            for result in self._results:
+                states[result['state']] = states.get(result['state'], 0) + 1
+            finished = len(self._results)
+        return {
+            'batch_id': self.batch_id,
+            'status': 'completed' if finished >= self.total else 'running',
+            'total': self.total,
+            'finished': finished,
+            'states': states,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+    def stream(self, poll_interval: float = 15.0) -> Iterator[Dict[str, Any]]:
+        """
+        نتایج جلسه‌ها به ترتیب پایان تا تمام شدن batch
+
+        Args:
+            poll_interval: حداکثر فاصله بین دو خروجی؛ در صورت نبود نتیجه
+                جدید یک خط heartbeat ارسال می‌شود
+
+        Yields:
+            نتیجه هر جلسه و در انتها خلاصه batch
+        """
+        index = 0
+        while True:
+            with self._condition:
+                if index >= len(self._results) and not self.is_done():
+                    self._condition.wait(poll_interval)
+                pending = self._results[index:]
+                done = self.is_done()
+            if not pending and not done:
+                yield {'batch_id': self.batch_id, 'heartbeat': True}
+            for result in pending:
+                yield result
+            index += len(pending)
+            if done and index >= len(self._results):
+                yield self.summary()
+                return
+
+    async def stream_async(
+        self,
+        poll_interval: float = 15.0
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        نسخه asyncio از stream؛ انتظار روی event loop است و threadی
+        اشغال نمی‌شود
+
+        Args:
+            poll_interval: حداکثر فاصله بین دو خروجی (heartbeat)
+
+        Yields:
+            نتیجه هر جلسه و در انتها خلاصه batch
+        """
+        loop = asyncio.get_running_loop()
+        index = 0
+        while True:
+            event = None
+            with self._condition:
+                pending = self._results[index:]
+                done = self.is_done()
+                if not pending and not done:
+                    event = asyncio.Event()
+                    self._async_waiters.append((loop, event))
+            if event is not None:
+                try:
+                    await asyncio.wait_for(event.wait(), poll_interval)
+                except asyncio.TimeoutError:
+                    yield {'batch_id': self.batch_id, 'heartbeat': True}
+                continue
+            for result in pending:
+                yield result
+            index += len(pending)
+            if done and index >= len(self._results):
+                yield self.summary()
+                return
+
+
+# هر تماس مسدود دو leg (A و B) روی همان trunk باز می‌کند و هر leg یک
+# lease جداگانه از SharedTrunkLimiter می‌گیرد
+LEGS_PER_SESSION = 2
+
+
+class _TrunkLane:
+    """
+    صف تماس‌های batch یک trunk
+
+    thread هر lane تماس‌ها را با رعایت حداکثر کانال هم‌زمان و CPS trunk
+    به orchestrator می‌سپارد؛ بنابراین یک trunk کند بقیه را متوقف نمی‌کند.
+    ظرفیت و CPS برای هر دو leg جلسه رزرو می‌شود تا legهای A تمام
+    leaseها را نگیرند و leg B بعد از پاسخ A به سقف trunk نخورد.
+    """
+
+    def __init__(self, trunk_name: str):
+        self.trunk_name = trunk_name
+        self.queue: 'queue.Queue' = queue.Queue()
+        self.active = 0
+        self.bucket: Optional[TokenBucket] = None
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+
+    def acquire_channel(self, max_channels: int):
+        """انتظار تا آزاد شدن کانال‌های هر دو leg یک جلسه"""
+        # trunk با کمتر از دو کانال هم یک جلسه در هر لحظه اجرا می‌کند
+        limit = max(max_channels, LEGS_PER_SESSION)
+        with self.condition:
+            while self.active + LEGS_PER_SESSION > limit:
+                self.condition.wait()
+            self.active += LEGS_PER_SESSION
+
+    def release_channel(self):
+        """آزاد کردن کانال‌های جلسه پس از رسیدن آن به حالت نهایی"""
+        with self.condition:
+            self.active -= LEGS_PER_SESSION
+            self.condition.notify()
+
+    def pace(self, cps: float):
+        """انتظار برای نوبت CPS trunk (هر جلسه دو Originate می‌فرستد)"""
+        rate = cps / LEGS_PER_SESSION
+        if self.bucket is None or self.bucket.rate != rate:
+            self.bucket = TokenBucket(rate)
+        self.bucket.acquire()
+
+
+class CallBatchDispatcher:
+    """
+    زمان‌بندی batchهای تماس با محدودیت هم‌زمانی
+
+    جلسه‌های هر batch در یک تراکنش در جداول call_batches و
+    call_batch_items ثبت می‌شوند و سپس هر trunk با ظرفیت کانال و CPS
+    خودش (Trunk.max_channels و Trunk.cps) آن‌ها را اجرا می‌کند.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        max_batches: Optional[int] = None
+    ):
+        """
+        Args:
+            max_concurrency: حداکثر تماس batch هم‌زمان در این worker
+                (پیش‌فرض: CALL_BATCH_CONCURRENCY یا تعداد worker orchestrator)
+            max_batches: حداکثر batch نگهداری شده در حافظه
+                (پیش‌فرض: CALL_BATCH_KEEP یا 100)
+        """
+        self.max_concurrency = max_concurrency or int(
+            os.getenv('CALL_BATCH_CONCURRENCY', '0')
+        ) or get_orchestrator().max_workers
+        self.max_batches = max_batches or int(
+            os.getenv('CALL_BATCH_KEEP', '100')
+        )
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lanes: Dict[str, _TrunkLane] = {}
+        # کانال lane هر جلسه تا حالت نهایی (نه تا BRIDGED) نگه داشته می‌شود
+        self._held: Dict[str, _TrunkLane] = {}
+        self._batches: 'OrderedDict[str, CallBatch]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        entries: List[Dict[str, Any]],
+        call_fn: Callable[..., tuple[Dict[str, Any], int]]
+    ) -> tuple[Optional[CallBatch], str]:
+        """
+        ثبت و زمان‌بندی یک batch
+
+        Args:
+            entries: ورودی‌های معتبر (خروجی normalize_entry)
+            call_fn: تابع اجرای هر تماس (run_masked_call)
+
+        Returns:
+            tuple (CallBatch یا None، پیام خطا)
+        """
+        registry = get_trunk_registry()
+        items = []
+        for position, params in enumerate(entries):
+            state_machine = CallSessionStateMachine()
+            trunk = registry.resolve(params['trunk_name'])
+            items.append({
+                'session_id': state_machine.get_session_id(),
+                'position': position,
+                'trunk': trunk.name,
+                'params': params,
+                'state_machine': state_machine,
+            })
+
+        batch = CallBatch(str(uuid.uuid4()), items)
+        success, error = self._insert(batch)
+        if not success:
+            return None, error
+
+        with self._lock:
+            self._batches[batch.batch_id] = batch
+            while len(self._batches) > self.max_batches:
+                oldest_id, oldest = next(iter(self._batches.items()))
+                if not oldest.is_done():
+                    break
+                del self._batches[oldest_id]
+
+        for item in items:
+            self._lane(item['trunk']).queue.put((batch, item, call_fn))
+        logger.info(
+            "batch تماس ثبت شد",
+            extra={'batch_id': batch.batch_id, 'total': batch.total}
+        )
+        return batch, ""
+
+    def get(self, batch_id: str) -> Optional[CallBatch]:
+        """batch در حال اجرا یا اخیر این worker"""
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def _lane(self, trunk_name: str) -> _TrunkLane:
+        """lane یک trunk (thread آن در اولین استفاده شروع می‌شود)"""
+        with self._lock:
+            lane = self._lanes.get(trunk_name)
+            if lane is None:
+                lane = _TrunkLane(trunk_name)
+                lane.thread = threading.Thread(
+                    target=self._run_lane,
+                    args=(lane,),
+                    name=f'call-batch-{trunk_name}',
+                    daemon=True
+                )
+                self._lanes[trunk_name] = lane
+                lane.thread.start()
+            return lane
+
+    def _run_lane(self, lane: _TrunkLane):
+        """ارسال تماس‌های یک trunk با رعایت ظرفیت و CPS"""
+        registry = get_trunk_registry()
+        while True:
+            batch, item, call_fn = lane.queue.get()
+            trunk = registry.resolve(lane.trunk_name)
+            lane.acquire_channel(trunk.max_channels)
+            self._slots.acquire()
+            lane.pace(trunk.cps)
+            state_machine = item['state_machine']
+            with self._lock:
+                self._held[item['session_id']] = lane
+
+            def on_done(info, state_machine=state_machine, batch=batch):
+                self._slots.release()
+                # تماس BRIDGED تا Hangup کانال trunk را اشغال می‌کند
+                if state_machine.is_final_state():
+                    self._release_channel(state_machine.get_session_id())
+                self._finished(batch, info)
+
+            try:
+                get_orchestrator().submit(
+                    state_machine,
+                    call_fn,
+                    on_done=on_done,
+                    **item['params']
+                )
+            except Exception:
+                logger.exception(
+                    "خطا در زمان‌بندی جلسه %s", item['session_id']
+                )
+                self._slots.release()
+                self._release_channel(item['session_id'])
+
+    def _release_channel(self, session_id: str):
+        """آزاد کردن کانال lane جلسه (چند بار صدا زدن بی‌خطر است)"""
+        with self._lock:
+            lane = self._held.pop(session_id, None)
+        if lane is not None:
+            lane.release_channel()
+
+    def on_transition(self, state_machine: CallSessionStateMachine):
+        """آزاد کردن کانال lane پس از رسیدن جلسه به حالت نهایی"""
+        if state_machine.is_final_state():
+            self._release_channel(state_machine.get_session_id())
+
+    def _finished(self, batch: CallBatch, info: Dict[str, Any]):
+        """ثبت نتیجه جلسه در حافظه و دیتابیس"""
+        done = batch.record_result(info)
+        conn = get_db_connection()
+        if not conn:
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE call_batch_items
+                SET state = %s, result = %s, finished_at = NOW()
+                WHERE session_id = %s
+            """, (info['state'], Json(info['result']), info['session_id']))
+            if done:
+                cursor.execute("""
+                    UPDATE call_batches
+                    SET status = 'completed', finished_at = NOW()
+                    WHERE id = %s
+                """, (batch.batch_id,))
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            logger.error(
+                "خطا در ثبت نتیجه جلسه %s: %s", info['session_id'], e
+            )
+            conn.rollback()
+            conn.close()
+
+    def _insert(self, batch: CallBatch) -> tuple[bool, str]:
+        """ثبت batch و تمام جلسه‌های آن در یک تراکنش"""
+        conn = get_db_connection()
+        if not conn:
+            return False, "خطا در اتصال به دیتابیس"
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO call_batches (id, total) VALUES (%s, %s)",
+                (batch.batch_id, batch.total)
+            )
+            execute_values(cursor, """
+                INSERT INTO call_batch_items (
+                    session_id, batch_id, position,
+                    number_a, number_b, caller_id, trunk
+                ) VALUES %s
+            """, [
+                (
+                    item['session_id'], batch.batch_id, item['position'],
+                    item['params']['number_a'], item['params']['number_b'],
+                    item['params']['caller_id'], item['trunk'],
+                )
+                for item in batch.items
+            ], page_size=1000)
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return True, ""
+        except Exception as e:
+            logger.error("خطا در ثبت batch تماس: %s", e)
+            conn.rollback()
+            conn.close()
+            return False, f"خطا در ثبت batch: {str(e)}"
+
+
+def load_batch(batch_id: str) -> Optional[Dict[str, Any]]:
+    """
+    خواندن وضعیت batch از دیتابیس (batch ثبت شده در worker دیگر)
+
+    Args:
+        batch_id: شناسه batch
+
+    Returns:
+        دیکشنری شامل summary و results یا None اگر batch یافت نشود
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT total, status, created_at, finished_at
+            FROM call_batches WHERE id = %s
+        """, (batch_id,))
+        row = cursor.fetchone()
+        if not row:
+            cursor.close()
+            conn.close()
+            return None
+        cursor.execute("""
+            SELECT session_id, position, state, result
+            FROM call_batch_items
+            WHERE batch_id = %s
+            ORDER BY position
+        """, (batch_id,))
+        items = cursor.fetchall()
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        logger.error("خطا در خواندن batch %s: %s", batch_id, e)
+        conn.close()
+        return None
+
+    states: Dict[str, int] = {}
+    results = []
+    for session_id, position, state, result in items:
+        if result is not None:
+            states[state] = states.get(state, 0) + 1
+            results.append({
+                'session_id': session_id,
+                'position': position,
+                'state': state,
+                'result': result,
+            })
+    return {
+        'summary': {
+            'batch_id': batch_id,
+            'status': row[1],
+            'total': row[0],
+            'finished': len(results),
+            'states': states,
+            'created_at': row[2].timestamp() if row[2] else None,
+            'finished_at': row[3].timestamp() if row[3] else None,
+        },
+        'results': results,
+    }
+
+
+_dispatcher: Optional[CallBatchDispatcher] = None
+_dispatcher_lock = threading.Lock()
+_dispatcher_pid = os.getpid()
+
+
+def get_batch_dispatcher() -> CallBatchDispatcher:
+    """دریافت dispatcher batch این process"""
+    global _dispatcher, _dispatcher_pid
+    with _dispatcher_lock:
+        if _dispatcher is None or _dispatcher_pid != os.getpid():
+            _dispatcher = CallBatchDispatcher()
+            _dispatcher_pid = os.getpid()
+        return _dispatcher
+
+
+def _on_transition(
+    state_machine,
+    old_state,
+    new_state,
+    elapsed: float,
+    seq: int,
+    entered_at: float
+):
+    """listener انتقال حالت؛ تا ساخت dispatcher کاری انجام نمی‌دهد"""
+    dispatcher = _dispatcher
+    if dispatcher is not None and _dispatcher_pid == os.getpid():
+        dispatcher.on_transition(state_machine)
+
+
+CallSessionStateMachine.add_transition_listener(_on_transition)
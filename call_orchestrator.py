@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable
+
+from call_state_machine import CallSessionStateMachine, CallState
+from session_registry import SessionRegistry, get_session_registry
+
+logger = logging.getLogger(__name__)
+
+
+class CallOrchestrator:
+    """
+    اجرای جلسه‌های تماس در پس‌زمینه
+
+    endpoint فقط جلسه را ثبت می‌کند و session_id را برمی‌گرداند؛ مراحل
+    تماس (A → انتظار پاسخ → B) در thread pool این کلاس اجرا می‌شوند و
+    وضعیت آن از طریق get قابل پیگیری است. جلسه‌ها در SessionRegistry
+    این process نگهداری و پس از retention حذف می‌شوند.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        registry: Optional[SessionRegistry] = None
+    ):
+        """
+        مقداردهی اولیه orchestrator
+
+        Args:
+            max_workers: حداکثر تعداد تماس هم‌زمان در حال برقراری
+                (پیش‌فرض: CALL_ORCHESTRATOR_WORKERS یا 32)
+            registry: registry جلسه‌ها (پیش‌فرض: registry این process)
+        """
+        self.max_workers = max_workers or int(
+            os.getenv('CALL_ORCHESTRATOR_WORKERS', '32')
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='call-orchestrator'
+        )
+        self._registry = registry or get_session_registry()
+
+    def submit(
+        self,
+        state_machine: CallSessionStateMachine,
+        call_fn: Callable[..., tuple[Dict[str, Any], int]],
+        on_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+        **params
+    ) -> str:
+        """
+        ثبت یک جلسه تماس برای اجرا در پس‌زمینه
+
+        Args:
+            state_machine: ماشین حالت جلسه (در حالت PENDING)
+            call_fn: تابعی که تماس را برقرار می‌کند و
+                (payload, http_status) برمی‌گرداند
+            on_done: callback پس از پایان جلسه با وضعیت نهایی (خروجی get)
+            **params: پارامترهای call_fn (به جز state_machine)
+
+        Returns:
+            session_id
+        """
+        record = {
+            'state_machine': state_machine,
+            'params': params,
+            'result': None,
+            'submitted_at': time.time(),
+            'finished_at': None,
+            'on_done': on_done,
+        }
+        self._registry.register(state_machine, record)
+        self._executor.submit(self._run, record, call_fn)
+        return state_machine.get_session_id()
+
+    def _run(
+        self,
+        record: Dict[str, Any],
+        call_fn: Callable[..., tuple[Dict[str, Any], int]]
+    ):
+        """اجرای تماس و ثبت نتیجه"""
+        state_machine: CallSessionStateMachine = record['state_machine']
+        try:
+            if state_machine.is_final_state():
+                # جلسه در صف بسته شده است (مثلاً توسط sweeper)؛ تماسی
+                # برقرار نمی‌شود
+                payload = {
+                    'status': 'error',
+                    'message': 'جلسه تماس قبل از شروع بسته شده است',
+                    'session_id': state_machine.get_session_id(),
+                    'state': state_machine.get_current_state().value
+                }
+            else:
+                payload, _ = call_fn(state_machine, **record['params'])
+        except Exception as e:
+            logger.exception(
+                "خطا در اجرای جلسه تماس %s", state_machine.get_session_id()
+            )
+            payload = {'status': 'error', 'message': f'خطا: {str(e)}'}
+        if not state_machine.is_final_state() and (
+            payload.get('status') == 'error'
+        ):
+            state_machine.transition_to(CallState.FAILED_SYSTEM)
+        record['result'] = payload
+        record['finished_at'] = time.time()
+        if record['on_done'] is not None:
+            session_id = state_machine.get_session_id()
+            try:
+                record['on_done'](self._info(session_id, record))
+            except Exception:
+                logger.exception("خطا در callback پایان جلسه %s", session_id)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        دریافت وضعیت یک جلسه
+
+        Args:
+            session_id: شناسه جلسه
+
+        Returns:
+            دیکشنری وضعیت یا None اگر جلسه پیدا نشود
+        """
+        entry = self._registry.get(session_id)
+        if entry is None:
+            return None
+        # جلسه‌های هم‌زمان (بدون orchestrator) رکورد خالی دارند
+        record = dict(entry.data, state_machine=entry.state_machine)
+        info = self._info(session_id, record)
+        info['channels'] = dict(entry.channels)
+        info['uniqueids'] = dict(entry.uniqueids)
+        return info
+
+    @staticmethod
+    def _info(session_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        """نمایش وضعیت یک جلسه"""
+        state_machine: CallSessionStateMachine = record['state_machine']
+        return {
+            'session_id': session_id,
+            'state': state_machine.get_current_state().value,
+            'is_final': state_machine.is_final_state(),
+            'state_history': [
+                state.value for state in state_machine.get_state_history()
+            ],
+            'timings': state_machine.timings(),
+            'setup_time': state_machine.setup_time(),
+            'params': record.get('params'),
+            'result': record.get('result'),
+            'submitted_at': record.get('submitted_at'),
+            'finished_at': record.get('finished_at'),
+        }
+
+
+_orchestrator: Optional[CallOrchestrator] = None
+_orchestrator_lock = threading.Lock()
+_orchestrator_pid = os.getpid()
+
+
+def get_orchestrator() -> CallOrchestrator:
+    """
+    دریافت orchestrator سراسری این process
+
+    thread pool والد بعد از fork (preload در gunicorn) هیچ thread زنده‌ای
+    در فرزند ندارد؛ بنابراین orchestrator به ازای هر process ساخته می‌شود.
+    """
+    global _orchestrator, _orchestrator_pid
+    with _orchestrator_lock:
+        if _orchestrator is None or _orchestrator_pid != os.getpid():
+            _orchestrator = CallOrchestrator()
+            _orchestrator_pid = os.getpid()
+        return _orchestrator
@@ -1,5 +1,15 @@
+from array import array
 from enum import Enum
+import itertools
+import logging
+import os
+import random
+import threading
+import time
 import uuid
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
 
 
 class CallState(Enum):
@@ -14,9 +24,93 @@ class CallState(Enum):
     FAILED_B = "failed_b"
     FAILED_SYSTEM = "failed_system"
 
+    def __init__(self, value: str):
+        # کد عددی حالت؛ اندیس جدول انتقال و مقدار ذخیره شده در تاریخچه
+        self.code = len(type(self).__members__)
+
+
+# کد عددی هر حالت؛ تاریخچه به صورت array('B') از این کدها نگهداری می‌شود
+STATES = tuple(CallState)
+STATE_CODES = {state: state.code for state in STATES}
+
+
+def _uuid4_session_id() -> str:
+    """UUID تصادفی (رفتار پیش‌فرض)"""
+    return str(uuid.uuid4())
+
+
+def _uuid7_session_id() -> str:
+    """
+    UUID مرتب بر اساس زمان (طرح UUIDv7)
+
+    48 بیت میلی‌ثانیه و 74 بیت تصادفی از random (بدون os.urandom)؛
+    شناسه‌ها به ترتیب ایجاد مرتب می‌شوند و index دیتابیس را پراکنده نمی‌کنند.
+    """
+    value = (
+        (time.time_ns() // 1_000_000) << 80
+        | 0x7 << 76
+        | random.getrandbits(12) << 64
+        | 0x2 << 62
+        | random.getrandbits(62)
+    )
+    text = f'{value:032x}'
+    return (
+        f'{text[:8]}-{text[8:12]}-{text[12:16]}-{text[16:20]}-{text[20:]}'
+    )
+
+
+class _CounterSessionIds:
+    """
+    شناسه بر اساس شمارنده: زمان شروع process، pid و یک شمارنده
+
+    یکتایی بین workerها با pid و بین restartها با زمان شروع تضمین می‌شود؛
+    بعد از fork پیشوند دوباره ساخته می‌شود.
+    """
+
+    def __init__(self):
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._prefix = f'{time.time_ns() // 1000:x}-{os.getpid():x}-'
+        self._counter = itertools.count()
+
+    def __call__(self) -> str:
+        return f'{self._prefix}{next(self._counter):x}'
+
+
+# استراتژی تولید session_id: uuid4 (پیش‌فرض)، uuid7 یا counter
+SESSION_ID_GENERATORS: Dict[str, Callable[[], str]] = {
+    'uuid4': _uuid4_session_id,
+    'uuid7': _uuid7_session_id,
+    'counter': _CounterSessionIds(),
+}
+SESSION_ID_STRATEGY = os.getenv('SESSION_ID_STRATEGY', 'uuid4')
+if SESSION_ID_STRATEGY not in SESSION_ID_GENERATORS:
+    logger.warning(
+        "SESSION_ID_STRATEGY نامعتبر است (%s)؛ از uuid4 استفاده می‌شود",
+        SESSION_ID_STRATEGY
+    )
+    SESSION_ID_STRATEGY = 'uuid4'
+new_session_id = SESSION_ID_GENERATORS[SESSION_ID_STRATEGY]
+
 
 class CallSessionStateMachine:
-    """ماشین حالت برای مدیریت جلسه تماس مسدود"""
+    """
+    ماشین حالت برای مدیریت جلسه تماس مسدود
+
+    تاریخچه به صورت دو array موازی نگهداری می‌شود: کد حالت (array('B'))
+    و زمان monotonic ورود به آن حالت (array('d'))؛ با __slots__ هر جلسه
+    فقط چند صد بایت حافظه می‌گیرد و زمان هر مرحله مستقیماً از خود شیء
+    قابل محاسبه است.
+
+    انتقال‌ها از thread تماس، thread خواننده event bus و sweeper هم‌زمان
+    انجام می‌شوند؛ بررسی mask و ثبت حالت جدید زیر قفل همین جلسه انجام
+    می‌شود تا فقط یکی از دو انتقال رقیب موفق شود.
+    """
+
+    __slots__ = ('current_state', 'session_id', '_codes', '_times', '_lock')
 
     # تعریف انتقال‌های مجاز
     VALID_TRANSITIONS = {
@@ -57,6 +151,25 @@ class CallSessionStateMachine:
         CallState.FAILED_SYSTEM,
     }
 
+    # callbackهای (state_machine, old_state, new_state, elapsed, seq,
+    # entered_at) برای هر انتقال
+    _transition_listeners: List[Callable] = []
+
+    @classmethod
+    def add_transition_listener(cls, callback: Callable):
+        """
+        ثبت callback برای تمام انتقال‌های موفق (مثلاً ثبت متریک)
+
+        Args:
+            callback: تابع (state_machine, old_state, new_state, elapsed,
+                seq, entered_at)؛ elapsed مدت ماندن در حالت قبلی به ثانیه،
+                seq اندیس حالت جدید در تاریخچه و entered_at زمان monotonic
+                ورود به آن است. هر سه زیر قفل ماشین حالت ثبت شده‌اند و
+                listener نباید آن‌ها را دوباره از ماشین حالت بخواند.
+        """
+        if callback not in cls._transition_listeners:
+            cls._transition_listeners.append(callback)
+
     def __init__(self, initial_state: CallState = CallState.PENDING):
         """
         مقداردهی اولیه ماشین حالت
@@ -65,8 +178,10 @@ class CallSessionStateMachine:
             initial_state: حالت اولیه (پیش‌فرض: PENDING)
         """
         self.current_state = initial_state
-        self.state_history = [initial_state]
-        self.session_id = str(uuid.uuid4())
+        self.session_id = new_session_id()
+        self._codes = array('B', (initial_state.code,))
+        self._times = array('d', (time.monotonic(),))
+        self._lock = threading.Lock()
 
     def transition_to(self, new_state: CallState) -> bool:
         """
@@ -78,14 +193,24 @@ class CallSessionStateMachine:
         Returns:
             True اگر انتقال موفق باشد، False در غیر این صورت
         """
-        if self.is_final_state():
-            return False
-
-        if new_state not in self.VALID_TRANSITIONS[self.current_state]:
-            return False
-
-        self.current_state = new_state
-        self.state_history.append(new_state)
+        # حالت‌های نهایی mask صفر دارند؛ بررسی نهایی بودن جداگانه لازم نیست
+        code = new_state.code
+        with self._lock:
+            if not _TRANSITION_MASKS[self._codes[-1]] >> code & 1:
+                return False
+            old_state = self.current_state
+            now = time.monotonic()
+            elapsed = now - self._times[-1]
+            seq = len(self._codes)
+            self.current_state = new_state
+            self._codes.append(code)
+            self._times.append(now)
+        # listenerها خارج از قفل اجرا می‌شوند و می‌توانند خودشان انتقال بدهند
+        for callback in self._transition_listeners:
+            try:
+                callback(self, old_state, new_state, elapsed, seq, now)
+            except Exception:
+                logger.exception("خطا در listener انتقال حالت تماس")
         return True
 
     def can_transition_to(self, new_state: CallState) -> bool:
@@ -98,9 +223,7 @@ class CallSessionStateMachine:
         Returns:
             True اگر انتقال امکان‌پذیر باشد
         """
-        if self.is_final_state():
-            return False
-        return new_state in self.VALID_TRANSITIONS[self.current_state]
+        return bool(_TRANSITION_MASKS[self._codes[-1]] >> new_state.code & 1)
 
     def is_final_state(self) -> bool:
         """
@@ -109,7 +232,7 @@ class CallSessionStateMachine:
         Returns:
             True اگر در حالت نهایی باشیم
         """
-        return self.current_state in self.FINAL_STATES
+        return bool(_FINAL_MASK >> self._codes[-1] & 1)
 
     def get_current_state(self) -> CallState:
         """
@@ -127,7 +250,108 @@ class CallSessionStateMachine:
         Returns:
             لیست تمام حالت‌هایی که از ابتدا تا کنون داشتیم
         """
-        return self.state_history.copy()
+        return [STATES[code] for code in self._codes]
+
+    @property
+    def state_history(self) -> list[CallState]:
+        """تاریخچه حالت‌ها (برای سازگاری با کدهای قبلی)"""
+        return self.get_state_history()
+
+    @property
+    def state_entered_at(self) -> float:
+        """زمان monotonic ورود به حالت فعلی"""
+        return self._times[-1]
+
+    def history_length(self) -> int:
+        """تعداد حالت‌های ثبت شده در تاریخچه (بدون ساخت لیست)"""
+        return len(self._codes)
+
+    def get_state_timeline(self) -> list[tuple[CallState, float]]:
+        """
+        دریافت تاریخچه همراه با زمان ورود به هر حالت
+
+        Returns:
+            لیست (حالت، زمان monotonic ورود)
+        """
+        return [
+            (STATES[code], entered)
+            for code, entered in zip(self._codes, self._times)
+        ]
+
+    def time_in_state(
+        self,
+        state: Optional[CallState] = None
+    ) -> Optional[float]:
+        """
+        مدت ماندن در یک حالت
+
+        هر حالت حداکثر یک بار در تاریخچه دیده می‌شود و طول تاریخچه
+        محدود است؛ بنابراین هزینه این محاسبه ثابت است.
+
+        Args:
+            state: حالت مورد نظر (پیش‌فرض: حالت فعلی)
+
+        Returns:
+            مدت به ثانیه (برای حالت فعلی تا همین لحظه) یا None اگر جلسه
+            هرگز وارد این حالت نشده باشد
+        """
+        if state is None:
+            return time.monotonic() - self._times[-1]
+        try:
+            index = self._codes.index(state.code)
+        except ValueError:
+            return None
+        if index + 1 < len(self._times):
+            return self._times[index + 1] - self._times[index]
+        return time.monotonic() - self._times[index]
+
+    def entered_at(self, state: CallState) -> Optional[float]:
+        """
+        زمان monotonic ورود به یک حالت
+
+        Returns:
+            زمان ورود یا None اگر جلسه هرگز وارد این حالت نشده باشد
+        """
+        try:
+            return self._times[self._codes.index(state.code)]
+        except ValueError:
+            return None
+
+    def setup_time(self) -> Optional[float]:
+        """
+        مدت برقراری تماس: از ایجاد جلسه تا رسیدن به BRIDGED
+
+        Returns:
+            مدت به ثانیه یا None اگر تماس bridge نشده باشد
+        """
+        try:
+            index = self._codes.index(CallState.BRIDGED.code)
+        except ValueError:
+            return None
+        return self._times[index] - self._times[0]
+
+    def duration(self) -> float:
+        """مدت کل جلسه تا حالت نهایی یا در صورت ادامه تا همین لحظه"""
+        end = self._times[-1] if self.is_final_state() else time.monotonic()
+        return end - self._times[0]
+
+    def timings(self) -> Dict[str, float]:
+        """
+        تفکیک زمان جلسه به ازای هر حالت
+
+        Returns:
+            دیکشنری {نام حالت: ثانیه}؛ حالت فعلی غیرنهایی تا همین لحظه
+            حساب می‌شود و حالت نهایی زمانی ندارد
+        """
+        times = self._times
+        last = len(times) - 1
+        result = {}
+        for index, code in enumerate(self._codes):
+            if index < last:
+                result[STATES[code].value] = times[index + 1] - times[index]
+            elif not self.is_final_state():
+                result[STATES[code].value] = time.monotonic() - times[index]
+        return result
 
     def get_session_id(self) -> str:
         """
@@ -145,8 +369,10 @@ class CallSessionStateMachine:
         Args:
             initial_state: حالت اولیه جدید (پیش‌فرض: PENDING)
         """
-        self.current_state = initial_state
-        self.state_history = [initial_state]
+        with self._lock:
+            self.current_state = initial_state
+            self._codes = array('B', (initial_state.code,))
+            self._times = array('d', (time.monotonic(),))
 
     def __str__(self) -> str:
         """نمایش رشته‌ای ماشین حالت"""
@@ -161,5 +387,33 @@ class CallSessionStateMachine:
         return (
             f"CallSessionStateMachine("
             f"current_state={self.current_state}, "
-            f"state_history={self.state_history})"
+            f"state_history={self.get_state_history()})"
         )
+
+
+def compile_transitions(
+    valid_transitions: Dict[CallState, List[CallState]]
+) -> tuple:
+    """
+    تبدیل VALID_TRANSITIONS به جدول bitmask
+
+    Args:
+        valid_transitions: نگاشت حالت به لیست حالت‌های مجاز بعدی
+
+    Returns:
+        tuple که اندیس i آن bitmask حالت‌های مجاز بعد از حالت با کد i است
+    """
+    masks = [0] * len(STATES)
+    for state, targets in valid_transitions.items():
+        for target in targets:
+            masks[state.code] |= 1 << target.code
+    return tuple(masks)
+
+
+# جدول انتقال یک بار در زمان import ساخته می‌شود
+_TRANSITION_MASKS = compile_transitions(
+    CallSessionStateMachine.VALID_TRANSITIONS
+)
+_FINAL_MASK = sum(
+    1 << state.code for state in CallSessionStateMachine.FINAL_STATES
+)
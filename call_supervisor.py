@@ -0,0 +1,379 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Optional, Dict, Any, Iterable
+
+from ami_router import AsteriskRouter, get_asterisk_router
+from call_state_machine import CallSessionStateMachine, CallState
+from metrics import REGISTRY
+from session_registry import (
+    LiveSession,
+    SessionRegistry,
+    get_session_registry,
+)
+
+logger = logging.getLogger(__name__)
+
+
+CALL_LEGS_HUNGUP = REGISTRY.counter(
+    'call_legs_hungup_total',
+    'Call legs hung up by the supervisor',
+    ('reason',)
+)
+CALL_SESSIONS_REAPED = REGISTRY.counter(
+    'call_sessions_reaped_total',
+    'Stale call sessions closed by the sweeper',
+    ('state',)
+)
+
+# legهای اصلی جلسه؛ کانال‌های فرزند با Dial خودشان همراه این legها قطع می‌شوند
+LEGS = ('a', 'b')
+
+# حالت جلسه پس از Hangup یکی از legها؛ قبل از bridge یعنی شکست تماس
+HANGUP_TRANSITIONS = {
+    CallState.CONNECTED_A: CallState.FAILED_SYSTEM,
+    CallState.CALLING_B: CallState.FAILED_B,
+    CallState.BRIDGED: CallState.COMPLETED,
+}
+
+# حالت‌هایی که legهای باقی‌مانده در آن‌ها باید قطع شوند
+TEARDOWN_STATES = {
+    CallState.COMPLETED,
+    CallState.FAILED_A,
+    CallState.FAILED_B,
+    CallState.FAILED_SYSTEM,
+}
+
+
+class CallSupervisor:
+    """
+    پایان جلسه‌های تماس بر اساس Hangup و قطع legهای یتیم
+
+    - Hangup یکی از legهای جلسه BRIDGED آن را COMPLETED می‌کند؛ Hangup در
+      CONNECTED_A یا CALLING_B (قبل از bridge) جلسه را FAILED می‌کند تا B
+      به کانال قطع شده وصل نشود.
+    - با رسیدن جلسه به حالت نهایی (شکست A/B، timeout یا پایان تماس)
+      legهای باقی‌مانده با Action: Hangup قطع می‌شوند تا کانال trunk
+      بلافاصله آزاد شود.
+    - sweeper دوره‌ای جلسه‌هایی را که بیش از حد در راه‌اندازی یا مکالمه
+      مانده‌اند می‌بندد و قطع‌های ناموفق را دوباره امتحان می‌کند.
+
+    handle_event و listener انتقال حالت فقط کار را در صف قرار می‌دهند؛
+    Actionهای Hangup در thread این کلاس ارسال می‌شوند.
+    """
+
+    # حداکثر تلاش برای قطع legهای یک جلسه
+    MAX_TEARDOWNS = 3
+
+    def __init__(
+        self,
+        router: Optional[AsteriskRouter] = None,
+        registry: Optional[SessionRegistry] = None,
+        sweep_interval: Optional[float] = None,
+        setup_timeout: Optional[float] = None,
+        max_duration: Optional[float] = None
+    ):
+        """
+        Args:
+            router: router سرورهای Asterisk برای Eventها و pool ارسال Hangup
+            registry: registry جلسه‌ها
+            sweep_interval: فاصله اجرای sweeper (پیش‌فرض: CALL_SWEEP_INTERVAL
+                یا 15 ثانیه)
+            setup_timeout: حداکثر مدت راه‌اندازی جلسه از CALLING_A تا BRIDGED
+                (پیش‌فرض: CALL_SETUP_TIMEOUT یا 180 ثانیه)
+            max_duration: حداکثر مدت مکالمه (پیش‌فرض: CALL_MAX_DURATION یا
+                14400 ثانیه)
+        """
+        self.router = router or get_asterisk_router()
+        self.registry = registry or get_session_registry()
+        self.sweep_interval = sweep_interval or float(
+            os.getenv('CALL_SWEEP_INTERVAL', '15')
+        )
+        self.setup_timeout = setup_timeout or float(
+            os.getenv('CALL_SETUP_TIMEOUT', '180')
+        )
+        self.max_duration = max_duration or float(
+            os.getenv('CALL_MAX_DURATION', '14400')
+        )
+        self._queue: 'queue.SimpleQueue[tuple[LiveSession, str]]' = (
+            queue.SimpleQueue()
+        )
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._token: Optional[int] = None
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.hungup = 0
+
+    def start(self):
+        """اشتراک روی event bus تمام سرورها و شروع thread قطع و sweeper"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            if self._token is None:
+                # فقط Hangup لازم است ولی event bus فیلتر نام Event ندارد؛
+                # handle_event بقیه را با یک مقایسه رد می‌کند
+                self._token = self.router.subscribe(self.handle_event)
+            self._thread = threading.Thread(
+                target=self._run,
+                name='call-supervisor',
+                daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """توقف supervisor"""
+        self._stopped.set()
+        self._queue.put((None, 'stop'))
+        with self._lock:
+            if self._token is not None:
+                self.router.unsubscribe(self._token)
+                self._token = None
+
+    def handle_event(self, event: Dict[str, str]):
+        """
+        پردازش Hangup (در thread خواننده event bus؛ بلاک نمی‌شود)
+
+        Args:
+            event: دیکشنری هدرهای Event
+        """
+        if event.get('Event') != 'Hangup':
+            return
+        entry = self.registry.match_event(event)
+        if entry is None:
+            return
+        leg = entry.leg_of(event)
+        if leg not in LEGS:
+            return
+        entry.hungup.add(leg)
+
+        state_machine = entry.state_machine
+        # اگر حالت هم‌زمان در thread تماس عوض شود، با حالت جدید تکرار می‌شود
+        for _ in range(len(HANGUP_TRANSITIONS)):
+            state = state_machine.get_current_state()
+            next_state = HANGUP_TRANSITIONS.get(state)
+            if next_state is None:
+                return
+            # listener انتقال حالت، قطع leg دیگر را در صف قرار می‌دهد
+            if state_machine.transition_to(next_state):
+                break
+        else:
+            return
+        if next_state == CallState.COMPLETED:
+            self.completed += 1
+            logger.info(
+                "تماس با Hangup leg %s پایان یافت", leg,
+                extra={'session_id': entry.session_id}
+            )
+        else:
+            logger.warning(
+                "leg %s در حالت %s قطع شد؛ تماس bridge نمی‌شود",
+                leg, state.value, extra={'session_id': entry.session_id}
+            )
+
+    def on_transition(
+        self,
+        state_machine: CallSessionStateMachine,
+        old_state: CallState,
+        new_state: CallState
+    ):
+        """قرار دادن قطع legهای باقی‌مانده در صف پس از پایان جلسه"""
+        if new_state not in TEARDOWN_STATES:
+            return
+        entry = self.registry.get(state_machine.get_session_id())
+        if entry is not None and entry.uniqueids:
+            self._queue.put((entry, new_state.value))
+
+    def teardown(
+        self,
+        session_id: str,
+        reason: str = 'manual',
+        recheck: Iterable[str] = ()
+    ) -> bool:
+        """
+        قطع تمام legهای زنده یک جلسه (در thread supervisor)
+
+        Args:
+            session_id: شناسه جلسه
+            reason: دلیل قطع برای متریک و لاگ
+            recheck: legهایی که دوباره بررسی می‌شوند، حتی اگر قبلاً (مثلاً
+                چون Originate آن‌ها هنوز کانالی نساخته بود) قطع فرض شده باشند
+
+        Returns:
+            False اگر جلسه در registry نباشد
+        """
+        entry = self.registry.get(session_id)
+        if entry is None:
+            return False
+        for leg in recheck:
+            entry.hungup.discard(leg)
+        self._queue.put((entry, reason))
+        return True
+
+    def _run(self):
+        """پردازش صف قطع و اجرای دوره‌ای sweeper"""
+        next_sweep = time.monotonic() + self.sweep_interval
+        while not self._stopped.is_set():
+            timeout = max(0.0, next_sweep - time.monotonic())
+            try:
+                entry, reason = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                entry = None
+            if entry is not None:
+                try:
+                    self._hangup_legs(entry, reason)
+                except Exception:
+                    logger.exception(
+                        "خطا در قطع legهای جلسه %s", entry.session_id
+                    )
+            if time.monotonic() >= next_sweep:
+                try:
+                    self.sweep()
+                except Exception:
+                    logger.exception("خطا در اجرای sweeper تماس‌ها")
+                next_sweep = time.monotonic() + self.sweep_interval
+
+    def _channel_of(self, entry: LiveSession, leg: str) -> Optional[str]:
+        """نام کانال یک leg از registry یا Eventهای دریافت شده"""
+        channel = entry.channels.get(leg)
+        if channel:
+            return channel
+        uniqueid = entry.uniqueids.get(leg)
+        if uniqueid:
+            pool = self.router.pool(entry.server)
+            return pool.event_bus.channel_events.get(uniqueid)
+        return None
+
+    def _hangup_legs(self, entry: LiveSession, reason: str):
+        """ارسال Hangup برای legهایی که هنوز قطع نشده‌اند"""
+        pending = [
+            leg for leg in LEGS
+            if leg in entry.uniqueids and leg not in entry.hungup
+        ]
+        if not pending:
+            return
+        entry.teardowns += 1
+
+        # legها روی همان سروری قطع می‌شوند که تماس از آن originate شد
+        pool = self.router.pool(entry.server)
+        manager = None
+        try:
+            for leg in pending:
+                channel = self._channel_of(entry, leg)
+                if channel is None:
+                    # هیچ Eventی از این کانال نرسیده؛ اگر Eventها دریافت
+                    # می‌شوند یعنی کانال ساخته نشده است
+                    if pool.event_bus.is_connected():
+                        entry.hungup.add(leg)
+                    continue
+                if manager is None:
+                    manager, error = pool.acquire()
+                    if manager is None:
+                        logger.warning(
+                            "قطع legهای جلسه %s ممکن نشد: %s",
+                            entry.session_id, error
+                        )
+                        return
+                success, message = manager.hangup(channel)
+                if not success:
+                    logger.warning(
+                        "Hangup کانال %s ناموفق بود: %s", channel, message,
+                        extra={'session_id': entry.session_id}
+                    )
+                    continue
+                entry.hungup.add(leg)
+                self.hungup += 1
+                CALL_LEGS_HUNGUP.labels(reason).inc()
+                logger.info(
+                    "leg %s (%s) قطع شد: %s", leg, channel, reason,
+                    extra={'session_id': entry.session_id}
+                )
+        finally:
+            pool.release(manager)
+
+    def sweep(self):
+        """بستن جلسه‌های مانده و تلاش مجدد برای legهای قطع نشده"""
+        for entry in self.registry.sessions():
+            state_machine = entry.state_machine
+            state = state_machine.get_current_state()
+
+            if state_machine.is_final_state():
+                if entry.teardowns < self.MAX_TEARDOWNS and any(
+                    leg in entry.uniqueids and leg not in entry.hungup
+                    for leg in LEGS
+                ):
+                    self._hangup_legs(entry, 'retry')
+                continue
+
+            if state == CallState.BRIDGED:
+                if state_machine.time_in_state() < self.max_duration:
+                    continue
+                next_state = CallState.COMPLETED
+            elif state == CallState.PENDING:
+                # جلسه‌های batch و async تا نوبت اجرا در صف می‌مانند
+                continue
+            elif time.monotonic() - state_machine.entered_at(
+                CallState.CALLING_A
+            ) >= self.setup_timeout:
+                next_state = CallState.FAILED_SYSTEM
+            else:
+                continue
+
+            logger.warning(
+                "جلسه در حالت %s مانده است؛ بسته می‌شود", state.value,
+                extra={'session_id': entry.session_id}
+            )
+            if state_machine.transition_to(next_state):
+                CALL_SESSIONS_REAPED.labels(state.value).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        """وضعیت supervisor"""
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'queued': self._queue.qsize(),
+            'completed': self.completed,
+            'hungup': self.hungup,
+            'sweep_interval': self.sweep_interval,
+            'setup_timeout': self.setup_timeout,
+            'max_duration': self.max_duration,
+        }
+
+
+_supervisor: Optional[CallSupervisor] = None
+_supervisor_lock = threading.Lock()
+_supervisor_pid = os.getpid()
+
+
+def get_call_supervisor() -> CallSupervisor:
+    """
+    دریافت supervisor این process (در اولین فراخوانی شروع می‌شود)
+
+    مانند AMI pool به ازای هر process ساخته می‌شود.
+    """
+    global _supervisor, _supervisor_pid
+    with _supervisor_lock:
+        if _supervisor is None or _supervisor_pid != os.getpid():
+            _supervisor = CallSupervisor()
+            _supervisor_pid = os.getpid()
+            _supervisor.start()
+        return _supervisor
+
+
+def _on_transition(
+    state_machine,
+    old_state,
+    new_state,
+    elapsed: float,
+    seq: int,
+    entered_at: float
+):
+    """listener انتقال حالت؛ تا شروع supervisor کاری انجام نمی‌دهد"""
+    supervisor = _supervisor
+    if supervisor is not None and _supervisor_pid == os.getpid():
+        supervisor.on_transition(state_machine, old_state, new_state)
+
+
+CallSessionStateMachine.add_transition_listener(_on_transition)
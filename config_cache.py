@@ -0,0 +1,236 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, Callable, List
+
+from db import get_db_connection, get_notification_listener
+
+logger = logging.getLogger(__name__)
+
+
+# کانال NOTIFY که save_asterisk_config پس از تغییر تنظیمات ارسال می‌کند
+CONFIG_CHANNEL = 'asterisk_config_changed'
+
+
+# ستون‌های asterisk_config به ترتیب _row_to_config
+CONFIG_COLUMNS = "host, port, username, secret, weight, enabled, trunks"
+
+
+def _row_to_config(row) -> Optional[Dict[str, Any]]:
+    """تبدیل سطر جدول asterisk_config به دیکشنری تنظیمات"""
+    if not row or not row[0]:  # اگر host موجود نباشد
+        return None
+    return {
+        'host': str(row[0]),
+        'port': int(row[1]) if row[1] else 5038,
+        'username': str(row[2]) if row[2] else '',
+        # بدون تبدیل، دقیقاً همان‌طور که از دیتابیس خوانده شد
+        'secret': row[3] or '',
+        # تنظیمات مسیریابی تماس بین چند سرور (ami_router)
+        'weight': int(row[4]) if row[4] is not None else 1,
+        'enabled': bool(row[5]) if row[5] is not None else True,
+        # None یعنی تمام trunkها روی این سرور تعریف شده‌اند
+        'trunks': list(row[6]) if row[6] is not None else None
+    }
+
+
+class AsteriskConfigCache:
+    """
+    cache تنظیمات Asterisk به تفکیک config_name
+
+    تنظیمات یک بار از دیتابیس خوانده می‌شوند و تا زمان دریافت
+    NOTIFY روی کانال asterisk_config_changed (یا پایان TTL در صورت از
+    دست رفتن notification) از حافظه برگردانده می‌شوند. listenerها فقط
+    وقتی صدا زده می‌شوند که مقدار یک پیکربندی واقعاً تغییر کرده باشد.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        """
+        مقداردهی اولیه cache
+
+        Args:
+            ttl: حداکثر عمر هر ورودی به ثانیه
+                (پیش‌فرض: ASTERISK_CONFIG_TTL یا 300)
+        """
+        self.ttl = ttl or float(os.getenv('ASTERISK_CONFIG_TTL', '300'))
+        # config_name -> (config یا None, زمان بارگذاری)
+        self._entries: Dict[str, tuple[Optional[Dict[str, Any]], float]] = {}
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str], None]] = []
+
+    def get(self, config_name: str = 'default') -> Optional[Dict[str, Any]]:
+        """
+        دریافت تنظیمات یک پیکربندی
+
+        Args:
+            config_name: نام پیکربندی
+
+        Returns:
+            دیکشنری host/port/username/secret (و weight/enabled/trunks) یا
+            None اگر در دیتابیس نباشد
+        """
+        with self._lock:
+            entry = self._entries.get(config_name)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return self.refresh(config_name)
+
+    def refresh(self, config_name: str) -> Optional[Dict[str, Any]]:
+        """
+        خواندن دوباره یک پیکربندی از دیتابیس
+
+        در صورت خطای دیتابیس مقدار قبلی حفظ می‌شود.
+
+        Args:
+            config_name: نام پیکربندی
+
+        Returns:
+            تنظیمات فعلی
+        """
+        success, config = self._load(config_name)
+        with self._lock:
+            previous = self._entries.get(config_name)
+            if not success:
+                return previous[0] if previous else None
+            self._entries[config_name] = (config, time.monotonic())
+        if previous is not None and previous[0] != config:
+            self._notify_listeners(config_name)
+        return config
+
+    def refresh_all(self):
+        """خواندن دوباره تمام پیکربندی‌های cache شده"""
+        with self._lock:
+            names = list(self._entries)
+        for config_name in names:
+            self.refresh(config_name)
+
+    def preload(self) -> int:
+        """
+        بارگذاری تمام پیکربندی‌ها با یک query (در شروع process)
+
+        Returns:
+            تعداد پیکربندی‌های بارگذاری شده
+        """
+        conn = get_db_connection()
+        if not conn:
+            return 0
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT name, {CONFIG_COLUMNS}
+                FROM asterisk_config
+            """)
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            logger.error("خطا در خواندن تنظیمات Asterisk از دیتابیس: %s", e)
+            conn.close()
+            return 0
+
+        now = time.monotonic()
+        with self._lock:
+            for row in rows:
+                self._entries[row[0]] = (_row_to_config(row[1:]), now)
+        return len(rows)
+
+    def configs(self) -> Dict[str, Dict[str, Any]]:
+        """
+        تمام پیکربندی‌های موجود در cache (بدون query دیتابیس)
+
+        Returns:
+            {config_name: تنظیمات} برای پیکربندی‌هایی که در دیتابیس هستند
+        """
+        with self._lock:
+            return {
+                name: config
+                for name, (config, _) in self._entries.items()
+                if config is not None
+            }
+
+    def _load(self, config_name: str) -> tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        خواندن یک پیکربندی از دیتابیس
+
+        Returns:
+            tuple (success, config)
+        """
+        conn = get_db_connection()
+        if not conn:
+            return False, None
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT {CONFIG_COLUMNS}
+                FROM asterisk_config
+                WHERE name = %s
+            """, (config_name,))
+            row = cursor.fetchone()
+            cursor.close()
+            conn.close()
+            return True, _row_to_config(row)
+        except Exception as e:
+            logger.error(
+                "خطا در خواندن تنظیمات Asterisk (%s) از دیتابیس: %s",
+                config_name, e
+            )
+            conn.close()
+            return False, None
+
+    def add_listener(self, callback: Callable[[str], None]):
+        """
+        ثبت callback برای تغییر یک پیکربندی
+
+        Args:
+            callback: تابعی که نام پیکربندی تغییر کرده را می‌گیرد
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+    def _notify_listeners(self, config_name: str):
+        """اطلاع دادن تغییر به listenerها"""
+        logger.info("تنظیمات Asterisk (%s) تغییر کرد", config_name)
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(config_name)
+            except Exception:
+                logger.exception(
+                    "خطا در اعمال تغییر تنظیمات %s", config_name
+                )
+
+    def on_notify(self, payload: Optional[str]):
+        """
+        پردازش NOTIFY کانال asterisk_config_changed
+
+        Args:
+            payload: نام پیکربندی تغییر کرده یا None بعد از اتصال مجدد
+        """
+        if payload is None:
+            self.refresh_all()
+        else:
+            self.refresh(payload or 'default')
+
+
+_cache: Optional[AsteriskConfigCache] = None
+_cache_lock = threading.Lock()
+_cache_pid = os.getpid()
+
+
+def get_config_cache() -> AsteriskConfigCache:
+    """
+    دریافت cache تنظیمات این process
+
+    cache در اولین فراخوانی هر process روی کانال NOTIFY ثبت می‌شود.
+    """
+    global _cache, _cache_pid
+    with _cache_lock:
+        if _cache is None or _cache_pid != os.getpid():
+            _cache = AsteriskConfigCache()
+            _cache_pid = os.getpid()
+            get_notification_listener().listen(CONFIG_CHANNEL, _cache.on_notify)
+        return _cache
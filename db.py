@@ -0,0 +1,543 @@
+import logging
+import os
+import select
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any, Callable, List
+
+import psycopg2
+import psycopg2.extensions
+
+from metrics import DB_ACQUIRE_SECONDS, DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def get_db_settings() -> Optional[Dict[str, str]]:
+    """
+    خواندن تنظیمات دیتابیس از environment variables
+
+    Returns:
+        دیکشنری تنظیمات یا None اگر متغیری تنظیم نشده باشد
+    """
+    settings = {
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT'),
+        'database': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+    }
+    names = {
+        'host': 'DB_HOST',
+        'port': 'DB_PORT',
+        'database': 'DB_NAME',
+        'user': 'DB_USER',
+        'password': 'DB_PASSWORD',
+    }
+    missing_vars = [names[key] for key, value in settings.items() if not value]
+    if missing_vars:
+        logger.error(
+            "environment variables زیر تنظیم نشده‌اند: %s",
+            ', '.join(missing_vars)
+        )
+        return None
+    return settings
+
+
+class TimedCursor:
+    """
+    cursor psycopg2 با ثبت زمان اجرای هر query در متریک db_query_seconds
+
+    بقیه متدها و ویژگی‌ها مستقیماً به cursor اصلی می‌رسند.
+    """
+
+    __slots__ = ('_cursor',)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(query, vars)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, vars_list)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self._cursor.__exit__(exc_type, exc_val, exc_tb)
+
+
+class PooledConnection:
+    """
+    اتصال گرفته شده از DatabasePool
+
+    تمام متدهای اتصال psycopg2 در دسترس هستند؛ close به جای بستن
+    اتصال، آن را به pool برمی‌گرداند. به این ترتیب کدهای موجود که بعد
+    از هر query اتصال را می‌بندند بدون تغییر از pool استفاده می‌کنند.
+    """
+
+    __slots__ = ('_pool', '_conn', '_created_at')
+
+    def __init__(self, pool: 'DatabasePool', conn, created_at: float):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+
+    def __getattr__(self, name: str):
+        conn = self._conn
+        if conn is None:
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(conn, name)
+
+    def cursor(self, *args, **kwargs) -> TimedCursor:
+        """cursor اتصال با ثبت latency هر query"""
+        return TimedCursor(self.__getattr__('cursor')(*args, **kwargs))
+
+    @property
+    def closed(self) -> int:
+        """مانند psycopg2: غیر صفر اگر اتصال به pool برگشته باشد"""
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        """بازگرداندن اتصال به pool (چند بار صدا زدن بی‌خطر است)"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn, self._created_at)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self._conn.__exit__(exc_type, exc_val, exc_tb)
+
+    def __del__(self):
+        # اتصالی که بدون close رها شده به pool برگردد
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class DatabasePool:
+    """
+    pool محدود و thread-safe از اتصال‌های PostgreSQL
+
+    اتصال‌ها یک بار ساخته می‌شوند و بین درخواست‌ها دوباره استفاده
+    می‌شوند. اتصالی که مدتی بیکار بوده قبل از تحویل با SELECT 1 بررسی
+    می‌شود و اتصال‌های قدیمی‌تر از max_lifetime بسته و جایگزین می‌شوند.
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        max_lifetime: Optional[float] = None,
+        acquire_timeout: Optional[float] = None,
+        validate_after: Optional[float] = None
+    ):
+        """
+        مقداردهی اولیه pool
+
+        Args:
+            max_size: حداکثر تعداد اتصال (پیش‌فرض: DB_POOL_SIZE یا 10)
+            max_lifetime: حداکثر عمر هر اتصال به ثانیه
+                (پیش‌فرض: DB_POOL_MAX_LIFETIME یا 1800)
+            acquire_timeout: حداکثر زمان انتظار برای اتصال آزاد به ثانیه
+                (پیش‌فرض: DB_POOL_ACQUIRE_TIMEOUT یا 5)
+            validate_after: اتصال بیکار بیش از این مدت (ثانیه) قبل از تحویل
+                بررسی می‌شود (پیش‌فرض: DB_POOL_VALIDATE_AFTER یا 30)
+        """
+        self.max_size = max_size or int(os.getenv('DB_POOL_SIZE', '10'))
+        self.max_lifetime = max_lifetime or float(
+            os.getenv('DB_POOL_MAX_LIFETIME', '1800')
+        )
+        self.acquire_timeout = acquire_timeout or float(
+            os.getenv('DB_POOL_ACQUIRE_TIMEOUT', '5')
+        )
+        self.validate_after = validate_after or float(
+            os.getenv('DB_POOL_VALIDATE_AFTER', '30')
+        )
+
+        # (connection, created_at, last_used) برای اتصال‌های بیکار
+        self._idle: deque = deque()
+        self._open = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._created = 0
+        self._recycled = 0
+        self._acquired = 0
+        self._timeouts = 0
+        self._acquire_time_total = 0.0
+        self._acquire_time_max = 0.0
+
+    def _connect(self):
+        """ساخت یک اتصال جدید psycopg2"""
+        settings = get_db_settings()
+        if settings is None:
+            return None
+        try:
+            return psycopg2.connect(**settings)
+        except Exception as e:
+            logger.error("خطا در اتصال به دیتابیس: %s", e)
+            return None
+
+    def _is_usable(self, conn, created_at: float, last_used: float) -> bool:
+        """بررسی سالم بودن اتصال بیکار قبل از تحویل"""
+        now = time.monotonic()
+        if conn.closed or now - created_at >= self.max_lifetime:
+            return False
+        if now - last_used < self.validate_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self) -> Optional[PooledConnection]:
+        """
+        دریافت یک اتصال از pool
+
+        Returns:
+            PooledConnection یا None در صورت خطا یا timeout
+        """
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        with self._condition:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        return None
+                    if self._idle:
+                        entry = self._idle.pop()
+                        self._in_use += 1
+                        break
+                    if self._open < self.max_size:
+                        # جای اتصال جدید رزرو می‌شود و اتصال خارج از قفل ساخته می‌شود
+                        entry = None
+                        self._open += 1
+                        self._in_use += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        logger.warning(
+                            "Timeout: هیچ اتصال آزادی در pool دیتابیس "
+                            "(%s اتصال) وجود ندارد", self.max_size
+                        )
+                        return None
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+        if entry is not None:
+            conn, created_at, last_used = entry
+            if not self._is_usable(conn, created_at, last_used):
+                self._close_quietly(conn)
+                with self._condition:
+                    self._recycled += 1
+                entry = None
+
+        if entry is None:
+            conn = self._connect()
+            if conn is None:
+                with self._condition:
+                    self._open -= 1
+                    self._in_use -= 1
+                    self._condition.notify()
+                return None
+            created_at = time.monotonic()
+            with self._condition:
+                self._created += 1
+
+        elapsed = time.monotonic() - started
+        DB_ACQUIRE_SECONDS.observe(elapsed)
+        with self._condition:
+            self._acquired += 1
+            self._acquire_time_total += elapsed
+            self._acquire_time_max = max(self._acquire_time_max, elapsed)
+        return PooledConnection(self, conn, created_at)
+
+    def warm(self, count: Optional[int] = None) -> int:
+        """
+        باز کردن اتصال‌ها قبل از اولین درخواست
+
+        اتصال‌ها هم‌زمان گرفته و سپس به pool برگردانده می‌شوند تا به
+        صورت بیکار آماده استفاده باشند.
+
+        Args:
+            count: تعداد اتصال (پیش‌فرض: DB_POOL_WARM یا 2، حداکثر max_size)
+
+        Returns:
+            تعداد اتصال‌های آماده
+        """
+        count = min(
+            count or int(os.getenv('DB_POOL_WARM', '2')), self.max_size
+        )
+        connections = []
+        try:
+            for _ in range(count):
+                conn = self.acquire()
+                if conn is None:
+                    break
+                connections.append(conn)
+        finally:
+            for conn in connections:
+                conn.close()
+        return len(connections)
+
+    def release(self, conn, created_at: float):
+        """
+        بازگرداندن اتصال به pool
+
+        تراکنش باز rollback می‌شود؛ اتصال خراب یا قدیمی بسته می‌شود.
+
+        Args:
+            conn: اتصال psycopg2
+            created_at: زمان ساخت اتصال (time.monotonic)
+        """
+        reusable = not conn.closed
+        if reusable and (
+            conn.get_transaction_status() !=
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        ):
+            try:
+                conn.rollback()
+            except Exception:
+                reusable = False
+        if time.monotonic() - created_at >= self.max_lifetime:
+            reusable = False
+
+        with self._condition:
+            self._in_use -= 1
+            if reusable and not self._closed:
+                self._idle.append((conn, created_at, time.monotonic()))
+                self._condition.notify()
+                return
+            self._open -= 1
+            if not self._closed:
+                self._recycled += 1
+            self._condition.notify()
+        self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        """بستن اتصال بدون انتشار خطا"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """وضعیت و آمار pool"""
+        with self._condition:
+            acquired = self._acquired
+            return {
+                'max_size': self.max_size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'created': self._created,
+                'recycled': self._recycled,
+                'acquired': acquired,
+                'timeouts': self._timeouts,
+                'acquire_ms_avg': round(
+                    self._acquire_time_total / acquired * 1000, 3
+                ) if acquired else 0.0,
+                'acquire_ms_max': round(self._acquire_time_max * 1000, 3),
+            }
+
+    def close(self):
+        """بستن تمام اتصال‌های بیکار؛ اتصال‌های در حال استفاده هنگام release بسته می‌شوند"""
+        with self._condition:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+
+class NotificationListener:
+    """
+    دریافت NOTIFYهای PostgreSQL روی یک اتصال اختصاصی
+
+    اتصال LISTEN باید در تمام عمر process باز بماند، بنابراین از pool
+    گرفته نمی‌شود. تمام کانال‌های این process روی یک اتصال مشترک LISTEN
+    می‌شوند. پس از هر اتصال مجدد، callbackها با payload برابر None صدا
+    زده می‌شوند چون notificationهای زمان قطعی از دست رفته‌اند.
+    """
+
+    def __init__(self):
+        self._callbacks: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        # کانال‌هایی که هنوز روی اتصال فعلی LISTEN نشده‌اند
+        self._pending_channels: List[str] = []
+
+    def listen(
+        self,
+        channel: str,
+        callback: Callable[[Optional[str]], None]
+    ):
+        """
+        ثبت callback برای یک کانال NOTIFY
+
+        Args:
+            channel: نام کانال (شناسه ساده PostgreSQL)
+            callback: تابعی که payload را می‌گیرد؛ None یعنی همه چیز
+                دوباره خوانده شود
+        """
+        with self._lock:
+            if channel not in self._callbacks:
+                self._callbacks[channel] = []
+                self._pending_channels.append(channel)
+            self._callbacks[channel].append(callback)
+        self.start()
+
+    def start(self):
+        """شروع thread دریافت NOTIFY"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='pg-notification-listener',
+                daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """توقف thread دریافت NOTIFY"""
+        self._stopped.set()
+
+    def _dispatch(self, channel: str, payload: Optional[str]):
+        """اجرای callbackهای یک کانال"""
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("خطا در پردازش NOTIFY %s", channel)
+
+    def _run(self):
+        """LISTEN، انتظار با select و اتصال مجدد با backoff"""
+        backoff = 1.0
+        while not self._stopped.is_set():
+            settings = get_db_settings()
+            if settings is None:
+                return
+            conn = None
+            try:
+                conn = psycopg2.connect(**settings)
+                conn.autocommit = True
+                cursor = conn.cursor()
+                with self._lock:
+                    channels = list(self._callbacks)
+                    self._pending_channels.clear()
+                for channel in channels:
+                    cursor.execute(f"LISTEN {channel}")
+                backoff = 1.0
+                for channel in channels:
+                    self._dispatch(channel, None)
+
+                while not self._stopped.is_set():
+                    with self._lock:
+                        added = list(self._pending_channels)
+                        self._pending_channels.clear()
+                    for channel in added:
+                        cursor.execute(f"LISTEN {channel}")
+
+                    readable, _, _ = select.select([conn], [], [], 1)
+                    if not readable:
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._dispatch(notify.channel, notify.payload)
+            except Exception as e:
+                logger.warning("خطا در LISTEN دیتابیس: %s", e)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+
+_listener: Optional[NotificationListener] = None
+_listener_lock = threading.Lock()
+_listener_pid = os.getpid()
+
+
+def get_notification_listener() -> NotificationListener:
+    """دریافت listener NOTIFY این process"""
+    global _listener, _listener_pid
+    with _listener_lock:
+        if _listener is None or _listener_pid != os.getpid():
+            _listener = NotificationListener()
+            _listener_pid = os.getpid()
+        return _listener
+
+
+_pool: Optional[DatabasePool] = None
+_pool_lock = threading.Lock()
+_pool_pid = os.getpid()
+
+
+def get_db_pool() -> DatabasePool:
+    """
+    دریافت pool دیتابیس این process
+
+    pool به ازای هر process ساخته می‌شود تا اتصال‌ها بعد از fork در
+    workerهای gunicorn به اشتراک گذاشته نشوند.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = DatabasePool()
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def get_db_connection() -> Optional[PooledConnection]:
+    """
+    دریافت اتصال دیتابیس از pool
+
+    close روی اتصال برگشتی آن را به pool برمی‌گرداند.
+
+    Returns:
+        PooledConnection یا None در صورت خطا
+    """
+    return get_db_pool().acquire()
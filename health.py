@@ -0,0 +1,233 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Callable
+
+from ami_router import get_asterisk_router
+from db import get_db_connection
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+HEALTH_PROBE_SECONDS = REGISTRY.histogram(
+    'health_probe_seconds',
+    'Latency of background dependency health probes',
+    ('dependency', 'result')
+)
+
+# هر probe (ok, message) برمی‌گرداند
+HealthProbe = Callable[[], tuple[bool, str]]
+
+
+def probe_db() -> tuple[bool, str]:
+    """SELECT 1 روی یک اتصال pool دیتابیس"""
+    conn = get_db_connection()
+    if not conn:
+        return False, "خطا در اتصال به دیتابیس"
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+        cursor.close()
+        return True, ""
+    except Exception as e:
+        return False, str(e)
+    finally:
+        conn.close()
+
+
+def probe_ami() -> tuple[bool, str]:
+    """
+    Action: Ping و وضعیت event bus هر سرور Asterisk (از طریق router)
+
+    تا وقتی حداقل یک سرور سالم باشد تماس‌ها برقرار می‌شوند؛ سرورهای
+    ناسالم در message گزارش می‌شوند.
+    """
+    results = get_asterisk_router().check_servers()
+    failed = [
+        f"{server}: {message}"
+        for server, (ok, message) in results.items() if not ok
+    ]
+    return len(failed) < len(results), '; '.join(failed)
+
+
+DEFAULT_PROBES: Dict[str, HealthProbe] = {
+    'db': probe_db,
+    'ami': probe_ami,
+}
+
+
+class HealthMonitor:
+    """
+    بررسی دوره‌ای سلامت وابستگی‌ها در پس‌زمینه
+
+    probeها هر interval ثانیه در thread این کلاس اجرا می‌شوند و نتیجه
+    همراه با زمان و latency در حافظه نگه داشته می‌شود؛ بنابراین /health
+    با هر تعداد probe از Kubernetes فقط یک dict را می‌خواند و باری روی
+    دیتابیس یا Asterisk ایجاد نمی‌کند. بررسی فوری (refresh) حداکثر یک
+    بار در هر min_interval ثانیه اجرا می‌شود.
+    """
+
+    def __init__(
+        self,
+        probes: Optional[Dict[str, HealthProbe]] = None,
+        interval: Optional[float] = None,
+        min_interval: Optional[float] = None
+    ):
+        """
+        Args:
+            probes: {نام وابستگی: probe} (پیش‌فرض: DEFAULT_PROBES)
+            interval: فاصله اجرای probeها (پیش‌فرض: HEALTH_PROBE_INTERVAL
+                یا 10 ثانیه)
+            min_interval: حداقل فاصله دو اجرا با refresh (پیش‌فرض:
+                HEALTH_PROBE_MIN_INTERVAL یا 2 ثانیه)
+        """
+        self.probes = dict(DEFAULT_PROBES if probes is None else probes)
+        self.interval = interval or float(
+            os.getenv('HEALTH_PROBE_INTERVAL', '10')
+        )
+        self.min_interval = min_interval or float(
+            os.getenv('HEALTH_PROBE_MIN_INTERVAL', '2')
+        )
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._last_run: Optional[float] = None
+        self._run_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """شروع thread بررسی (اولین بررسی بلافاصله انجام می‌شود)"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='health-prober',
+                daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """توقف thread بررسی"""
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.probe_all()
+            except Exception:
+                logger.exception("خطا در بررسی سلامت وابستگی‌ها")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def probe_all(self):
+        """اجرای تمام probeها (هم‌زمان فقط یک اجرا)"""
+        with self._run_lock:
+            for name, probe in self.probes.items():
+                self._results[name] = self._probe(name, probe)
+            self._last_run = time.monotonic()
+
+    def _probe(self, name: str, probe: HealthProbe) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            ok, message = probe()
+        except Exception as e:
+            ok, message = False, str(e)
+        latency = time.perf_counter() - started
+        HEALTH_PROBE_SECONDS.labels(name, 'ok' if ok else 'error').observe(
+            latency
+        )
+
+        previous = self._results.get(name, {})
+        now = datetime.now(timezone.utc).isoformat()
+        failures = 0 if ok else previous.get('consecutive_failures', 0) + 1
+        if not ok and failures == 1:
+            logger.warning("وابستگی %s در دسترس نیست: %s", name, message)
+        elif ok and previous.get('consecutive_failures'):
+            logger.info("وابستگی %s دوباره در دسترس است", name)
+        return {
+            'ok': ok,
+            'latency_ms': round(latency * 1000, 2),
+            'checked_at': now,
+            'last_ok_at': now if ok else previous.get('last_ok_at'),
+            'consecutive_failures': failures,
+            'message': message,
+        }
+
+    def refresh(self) -> bool:
+        """
+        اجرای فوری probeها با رعایت min_interval
+
+        Returns:
+            True اگر probeها اجرا شده باشند
+        """
+        last_run = self._last_run
+        if last_run is not None and (
+            time.monotonic() - last_run < self.min_interval
+        ):
+            return False
+        if not self._run_lock.acquire(blocking=False):
+            # اجرای دیگری در جریان است؛ نتیجه آن کافی است
+            return False
+        self._run_lock.release()
+        self.probe_all()
+        return True
+
+    def is_stale(self) -> bool:
+        """آیا نتایج قدیمی‌تر از سه برابر interval هستند (thread متوقف شده)"""
+        last_run = self._last_run
+        return (
+            last_run is None or
+            time.monotonic() - last_run > 3 * self.interval
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        آخرین نتایج بدون اجرای probe
+
+        Returns:
+            دیکشنری شامل healthy، stale، age و نتیجه هر وابستگی
+        """
+        results = dict(self._results)
+        last_run = self._last_run
+        stale = self.is_stale()
+        return {
+            'healthy': (
+                not stale and bool(results) and
+                all(result['ok'] for result in results.values())
+            ),
+            'stale': stale,
+            'age': (
+                round(time.monotonic() - last_run, 3)
+                if last_run is not None else None
+            ),
+            'interval': self.interval,
+            'checks': results,
+        }
+
+
+_monitor: Optional[HealthMonitor] = None
+_monitor_lock = threading.Lock()
+_monitor_pid = os.getpid()
+
+
+def get_health_monitor() -> HealthMonitor:
+    """
+    دریافت health monitor این process (در اولین فراخوانی شروع می‌شود)
+
+    مانند poolها به ازای هر process ساخته می‌شود.
+    """
+    global _monitor, _monitor_pid
+    with _monitor_lock:
+        if _monitor is None or _monitor_pid != os.getpid():
+            _monitor = HealthMonitor()
+            _monitor_pid = os.getpid()
+            _monitor.start()
+        return _monitor
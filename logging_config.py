@@ -0,0 +1,169 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+from typing import Optional, Dict
+
+
+# فیلدهای استاندارد LogRecord که در خروجی JSON جداگانه نوشته نمی‌شوند
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+# کلیدهایی که مقدارشان در پیام یا فیلدهای اضافه پنهان می‌شود
+_SECRET_KEYS = ('secret', 'password', 'passwd', 'token', 'authorization')
+
+_SECRET_PATTERN = re.compile(
+    r"(?i)((?:%s)['\"]?\s*[:=]\s*['\"]?)([^\s'\",}\r\n]+)"
+    % '|'.join(_SECRET_KEYS)
+)
+
+REDACTED = '***'
+
+
+def redact(text: str) -> str:
+    """
+    پنهان کردن مقدار secret/password در یک متن
+
+    Args:
+        text: متن پیام (مثلاً frame خام AMI)
+
+    Returns:
+        متن با مقدارهای حساس جایگزین شده
+    """
+    return _SECRET_PATTERN.sub(r"\1" + REDACTED, text)
+
+
+class RedactingFilter(logging.Filter):
+    """پنهان کردن secretها قبل از ورود record به صف"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        record.msg = redact(message)
+        record.args = None
+        for key in list(vars(record)):
+            if key not in _RECORD_FIELDS and any(
+                secret in key.lower() for secret in _SECRET_KEYS
+            ):
+                setattr(record, key, REDACTED)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """خروجی JSON یک‌خطی با فیلدهای اضافه (extra)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class LogSampler:
+    """
+    نمونه‌برداری از لاگ‌های پرتکرار (مثل هر chunk دریافتی از socket)
+
+    فقط یکی از هر rate فراخوانی True برمی‌گرداند.
+    """
+
+    def __init__(self, rate: Optional[int] = None):
+        """
+        Args:
+            rate: نرخ نمونه‌برداری (پیش‌فرض: LOG_SAMPLE_RATE یا 100)
+        """
+        self.rate = max(1, rate or int(os.getenv('LOG_SAMPLE_RATE', '100')))
+        self._counter = itertools.count()
+
+    def hit(self) -> bool:
+        """آیا این فراخوانی باید لاگ شود"""
+        return next(self._counter) % self.rate == 0
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """
+    تبدیل LOG_LEVELS به دیکشنری سطح هر module
+
+    Args:
+        spec: مثال: "asterisk_manager=DEBUG,db=WARNING"
+
+    Returns:
+        دیکشنری نام logger -> سطح
+    """
+    levels = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {
+        name: level for name, level in levels.items()
+        if isinstance(level, int)
+    }
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging(force: bool = False):
+    """
+    راه‌اندازی logging سراسری (یک بار در هر process)
+
+    recordها در thread درخواست فقط در صف قرار می‌گیرند و یک
+    QueueListener آن‌ها را روی stdout می‌نویسد، بنابراین I/O خروجی در
+    مسیر socket و درخواست انجام نمی‌شود.
+
+    Environment:
+        LOG_LEVEL: سطح پیش‌فرض (پیش‌فرض: INFO)
+        LOG_LEVELS: سطح هر module، مثال: asterisk_manager=DEBUG,db=WARNING
+        LOG_FORMAT: json یا text (پیش‌فرض: json)
+
+    Args:
+        force: پیکربندی دوباره حتی اگر قبلاً انجام شده باشد
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None and not force:
+            return
+        if _listener is not None:
+            _listener.stop()
+
+        if os.getenv('LOG_FORMAT', 'json').lower() == 'text':
+            formatter = logging.Formatter(
+                '%(asctime)s %(levelname)s %(name)s: %(message)s'
+            )
+        else:
+            formatter = JsonFormatter()
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(formatter)
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(RedactingFilter())
+
+        root = logging.getLogger()
+        root.handlers[:] = [queue_handler]
+        root.setLevel(
+            logging.getLevelName(os.getenv('LOG_LEVEL', 'INFO').upper())
+        )
+        for name, level in parse_levels(os.getenv('LOG_LEVELS', '')).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, output, respect_handler_level=True
+        )
+        _listener.start()
+        atexit.register(_listener.stop)
@@ -0,0 +1,344 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Tuple, Iterable
+
+
+# bucketهای پیش‌فرض برای latency عملیات AMI و دیتابیس (ثانیه)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0,
+)
+
+# bucketهای مدت زمان ماندن در هر حالت تماس (ثانیه)
+CALL_STATE_BUCKETS = (
+    0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0,
+    1800.0, 3600.0,
+)
+
+
+def _escape(value: str) -> str:
+    """escape مقدار label در فرمت متنی Prometheus"""
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _format_labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    """ساخت {name="value",...} برای یک سری"""
+    body = ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return '{' + body + '}' if body else ''
+
+
+def _format_value(value: float) -> str:
+    """نمایش عدد بدون اعشار اضافه برای شمارنده‌ها"""
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Sharded:
+    """
+    پایه شمارنده‌های sharded به تفکیک thread
+
+    هر thread فقط در shard خودش می‌نویسد، بنابراین مسیر ثبت هیچ قفلی
+    نمی‌گیرد؛ قفل فقط هنگام ساخت shard جدید برای یک thread و هنگام
+    جمع زدن shardها در scrape گرفته می‌شود.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._shards: List[List[float]] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> List[float]:
+        """shard thread فعلی (در اولین استفاده ساخته می‌شود)"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = [0.0] * self._size
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _collect(self) -> List[float]:
+        """جمع مقدار تمام shardها"""
+        totals = [0.0] * self._size
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for index, value in enumerate(shard):
+                totals[index] += value
+        return totals
+
+
+class _CounterChild(_Sharded):
+    """یک سری از Counter با مقدارهای label مشخص"""
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: float = 1):
+        """افزایش شمارنده"""
+        self._shard()[0] += amount
+
+    def value(self) -> float:
+        """مقدار فعلی شمارنده"""
+        return self._collect()[0]
+
+
+class _HistogramChild(_Sharded):
+    """یک سری از Histogram با مقدارهای label مشخص"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        # len(buckets) خانه برای bucketها، یکی برای +Inf و یکی برای sum
+        super().__init__(len(buckets) + 2)
+        self._buckets = buckets
+
+    def observe(self, value: float):
+        """ثبت یک مقدار"""
+        shard = self._shard()
+        shard[bisect_left(self._buckets, value)] += 1
+        shard[-1] += value
+
+    def snapshot(self) -> Tuple[List[float], float, float]:
+        """
+        Returns:
+            tuple (شمارش تجمعی هر bucket شامل +Inf، sum، count)
+        """
+        totals = self._collect()
+        cumulative = []
+        running = 0.0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1], running
+
+
+class _Metric:
+    """پایه متریک‌های دارای label"""
+
+    TYPE = ''
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        دریافت سری مربوط به مقدارهای label
+
+        Args:
+            values: مقدار labelها به ترتیب labelnames
+        """
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} به {len(self.labelnames)} label نیاز دارد"
+                )
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _series(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self._lock:
+            return sorted(self._children.items())
+
+    def render(self) -> List[str]:
+        """خطوط فرمت متنی Prometheus برای این متریک"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ]
+        for values, child in self._series():
+            lines.extend(
+                self._render_child(list(zip(self.labelnames, values)), child)
+            )
+        return lines
+
+    def _render_child(self, labels, child) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """شمارنده افزایشی"""
+
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        """افزایش شمارنده بدون label"""
+        self.labels().inc(amount)
+
+    def _render_child(self, labels, child) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(labels)} "
+            f"{_format_value(child.value())}"
+        ]
+
+
+class Histogram(_Metric):
+    """توزیع مقدارها در bucketهای ثابت"""
+
+    TYPE = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        """ثبت مقدار برای histogram بدون label"""
+        self.labels().observe(value)
+
+    def _render_child(self, labels, child) -> List[str]:
+        cumulative, total, count = child.snapshot()
+        lines = []
+        bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+        for bound, value in zip(bounds, cumulative):
+            lines.append(
+                f"{self.name}_bucket{_format_labels([*labels, ('le', bound)])} "
+                f"{_format_value(value)}"
+            )
+        lines.append(
+            f"{self.name}_sum{_format_labels(labels)} {repr(float(total))}"
+        )
+        lines.append(
+            f"{self.name}_count{_format_labels(labels)} "
+            f"{_format_value(count)}"
+        )
+        return lines
+
+
+class MetricsRegistry:
+    """فهرست متریک‌های process و خروجی /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """ثبت یک متریک (نام تکراری همان متریک قبلی را برمی‌گرداند)"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        """ساخت و ثبت Counter"""
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ) -> Histogram:
+        """ساخت و ثبت Histogram"""
+        return self.register(
+            Histogram(name, documentation, labelnames, buckets)
+        )
+
+    def render(self) -> str:
+        """
+        خروجی تمام متریک‌ها در فرمت متنی Prometheus (version 0.0.4)
+
+        Returns:
+            متن پاسخ /metrics
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# نوع محتوای پاسخ /metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+AMI_LOGIN_SECONDS = REGISTRY.histogram(
+    'ami_login_seconds',
+    'AMI connect and login latency',
+    ('result',)
+)
+AMI_ACTION_SECONDS = REGISTRY.histogram(
+    'ami_action_seconds',
+    'AMI action response latency',
+    ('action',)
+)
+AMI_ACTION_TIMEOUTS = REGISTRY.counter(
+    'ami_action_timeouts_total',
+    'AMI actions that received no response in time',
+    ('action',)
+)
+AMI_ANSWER_SECONDS = REGISTRY.histogram(
+    'ami_originate_answer_seconds',
+    'Time from Originate until the channel answered',
+    buckets=CALL_STATE_BUCKETS
+)
+DB_ACQUIRE_SECONDS = REGISTRY.histogram(
+    'db_pool_acquire_seconds',
+    'Time waiting for a pooled database connection'
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'db_query_seconds',
+    'Database query execution latency'
+)
+CALL_STATE_SECONDS = REGISTRY.histogram(
+    'call_state_seconds',
+    'Time a call session spent in each state',
+    ('state',),
+    buckets=CALL_STATE_BUCKETS
+)
+CALL_SESSIONS_TOTAL = REGISTRY.counter(
+    'call_sessions_total',
+    'Call sessions that reached a terminal state',
+    ('state',)
+)
+
+
+def record_call_transition(
+    state_machine,
+    old_state,
+    new_state,
+    elapsed: float,
+    seq: int,
+    entered_at: float
+):
+    """
+    listener انتقال حالت تماس (CallSessionStateMachine.add_transition_listener)
+
+    Args:
+        state_machine: ماشین حالت جلسه
+        old_state: حالت قبلی
+        new_state: حالت جدید
+        elapsed: مدت ماندن در حالت قبلی (ثانیه)
+        seq: اندیس حالت جدید در تاریخچه جلسه
+        entered_at: زمان monotonic ورود به حالت جدید
+    """
+    CALL_STATE_SECONDS.labels(old_state.value).observe(elapsed)
+    if new_state in state_machine.FINAL_STATES:
+        CALL_SESSIONS_TOTAL.labels(new_state.value).inc()
@@ -0,0 +1,228 @@
+import logging
+import os
+import sys
+import threading
+from typing import List, Tuple
+
+from db import get_db_connection
+from logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+# کلید advisory lock برای جلوگیری از اجرای هم‌زمان migration در چند worker
+MIGRATION_LOCK_KEY = 0x6D61736B
+
+# (version, description, sql) — migration جدید همیشه به انتهای لیست اضافه شود
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (1, 'create asterisk_config table', """
+        CREATE TABLE IF NOT EXISTS asterisk_config (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) UNIQUE NOT NULL DEFAULT 'default',
+            host VARCHAR(255),
+            port INTEGER DEFAULT 5038,
+            username VARCHAR(255),
+            secret VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """),
+    (2, 'create trunks table', """
+        CREATE TABLE IF NOT EXISTS trunks (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) UNIQUE NOT NULL,
+            config JSONB NOT NULL,
+            asterisk_config TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """),
+    (3, 'create call_batches and call_batch_items tables', """
+        CREATE TABLE IF NOT EXISTS call_batches (
+            id VARCHAR(36) PRIMARY KEY,
+            total INTEGER NOT NULL,
+            status VARCHAR(32) NOT NULL DEFAULT 'running',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS call_batch_items (
+            session_id VARCHAR(36) PRIMARY KEY,
+            batch_id VARCHAR(36) NOT NULL
+                REFERENCES call_batches (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            number_a VARCHAR(64) NOT NULL,
+            number_b VARCHAR(64) NOT NULL,
+            caller_id VARCHAR(64),
+            trunk VARCHAR(255),
+            state VARCHAR(32) NOT NULL DEFAULT 'pending',
+            result JSONB,
+            finished_at TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS call_batch_items_batch_idx
+            ON call_batch_items (batch_id, position);
+    """),
+    (4, 'create call_sessions and call_session_transitions tables', """
+        CREATE TABLE IF NOT EXISTS call_sessions (
+            session_id VARCHAR(36) PRIMARY KEY,
+            state VARCHAR(32) NOT NULL,
+            seq INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL,
+            finished_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS call_sessions_state_idx
+            ON call_sessions (state, updated_at);
+        CREATE TABLE IF NOT EXISTS call_session_transitions (
+            session_id VARCHAR(36) NOT NULL
+                REFERENCES call_sessions (session_id) ON DELETE CASCADE,
+            seq INTEGER NOT NULL,
+            from_state VARCHAR(32) NOT NULL,
+            to_state VARCHAR(32) NOT NULL,
+            at TIMESTAMPTZ NOT NULL,
+            elapsed DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (session_id, seq)
+        );
+    """),
+    (5, 'add routing columns to asterisk_config', """
+        ALTER TABLE asterisk_config
+            ADD COLUMN IF NOT EXISTS weight INTEGER NOT NULL DEFAULT 1,
+            ADD COLUMN IF NOT EXISTS enabled BOOLEAN NOT NULL DEFAULT TRUE,
+            ADD COLUMN IF NOT EXISTS trunks TEXT[];
+    """),
+]
+
+
+def get_schema_version() -> int:
+    """
+    دریافت آخرین نسخه اعمال شده schema
+
+    Returns:
+        شماره نسخه یا 0 اگر هیچ migrationی اعمال نشده باشد (-1 در صورت خطا)
+    """
+    conn = get_db_connection()
+    if not conn:
+        return -1
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_regclass('schema_version')")
+        if cursor.fetchone()[0] is None:
+            cursor.close()
+            conn.close()
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        version = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+        return version
+    except Exception as e:
+        logger.error("خطا در خواندن نسخه schema: %s", e)
+        if conn:
+            conn.close()
+        return -1
+
+
+def run_migrations() -> tuple[bool, str]:
+    """
+    اعمال migrationهای اعمال نشده
+
+    هر migration در تراکنش جداگانه اجرا و نسخه آن در جدول
+    schema_version ثبت می‌شود. اجرای هم‌زمان در چند process با
+    pg_advisory_lock سریال می‌شود.
+
+    Returns:
+        tuple (success, message)
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False, "خطا در اتصال به دیتابیس"
+
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+
+        cursor.execute("SELECT version FROM schema_version")
+        applied = {row[0] for row in cursor.fetchall()}
+
+        applied_now = []
+        for version, description, sql in MIGRATIONS:
+            if version in applied:
+                continue
+            cursor.execute(sql)
+            cursor.execute("""
+                INSERT INTO schema_version (version, description)
+                VALUES (%s, %s)
+            """, (version, description))
+            conn.commit()
+            applied_now.append(version)
+            logger.info("migration %s اعمال شد: %s", version, description)
+
+        current = max([*applied, *applied_now], default=0)
+        if applied_now:
+            return True, (
+                f"{len(applied_now)} migration اعمال شد؛ "
+                f"نسخه فعلی schema: {current}"
+            )
+        return True, f"schema به‌روز است (نسخه {current})"
+    except Exception as e:
+        conn.rollback()
+        logger.exception("خطا در اجرای migration")
+        return False, f"خطا در اجرای migration: {str(e)}"
+    finally:
+        try:
+            cursor.execute(
+                "SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,)
+            )
+            conn.commit()
+        except Exception:
+            pass
+        conn.close()
+
+
+_migrated = False
+_migrate_lock = threading.Lock()
+
+
+def ensure_migrated() -> bool:
+    """
+    اجرای migrationها یک بار در طول عمر process
+
+    با MIGRATE_ON_STARTUP=false اجرای خودکار غیرفعال می‌شود و migration
+    باید با `python migrations.py` اجرا شود.
+
+    Returns:
+        True اگر schema آماده باشد یا اجرای خودکار غیرفعال باشد
+    """
+    global _migrated
+    if os.getenv('MIGRATE_ON_STARTUP', 'true').lower() in ('0', 'false', 'no'):
+        return True
+    with _migrate_lock:
+        if not _migrated:
+            success, message = run_migrations()
+            logger.log(
+                logging.INFO if success else logging.ERROR, message
+            )
+            _migrated = success
+        return _migrated
+
+
+if __name__ == '__main__':
+    configure_logging()
+    if '--status' in sys.argv[1:]:
+        version = get_schema_version()
+        latest = MIGRATIONS[-1][0]
+        print(f"نسخه schema: {version} (آخرین نسخه: {latest})")
+        sys.exit(0 if version == latest else 1)
+
+    success, message = run_migrations()
+    print(message)
+    sys.exit(0 if success else 1)
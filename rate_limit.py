@@ -0,0 +1,519 @@
+import asyncio
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any
+
+from metrics import REGISTRY
+
+
+class TokenBucket:
+    """
+    محدودکننده نرخ token bucket (مثلاً تعداد تماس در ثانیه یک trunk)
+
+    هر ثانیه rate token اضافه می‌شود و حداکثر burst token ذخیره می‌ماند.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """
+        Args:
+            rate: تعداد token در ثانیه
+            burst: حداکثر token ذخیره شده (پیش‌فرض: max(1, rate))
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        """اضافه کردن tokenهای زمان سپری شده (داخل قفل)"""
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """
+        برداشتن یک token بدون انتظار
+
+        Returns:
+            0 اگر token برداشته شد، در غیر این صورت زمان لازم تا token
+            بعدی (ثانیه)
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            if self.rate <= 0:
+                return float('inf')
+            return (1 - self._tokens) / self.rate
+
+    def acquire(
+        self,
+        timeout: Optional[float] = None,
+        stop: Optional[threading.Event] = None
+    ) -> bool:
+        """
+        انتظار تا برداشتن یک token
+
+        Args:
+            timeout: حداکثر زمان انتظار (None: بدون محدودیت)
+            stop: با set شدن این Event انتظار متوقف می‌شود
+
+        Returns:
+            True اگر token برداشته شد
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            wait = min(wait, 1.0)
+            if stop is not None:
+                if stop.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+class RateLimitExceeded(Exception):
+    """ظرفیت trunk (کانال هم‌زمان یا CPS) در زمان انتظار مجاز آزاد نشد"""
+
+    def __init__(self, trunk_name: str, reason: str, retry_after: float):
+        """
+        Args:
+            trunk_name: نام trunk
+            reason: channels یا cps
+            retry_after: زمان پیشنهادی برای تلاش دوباره (ثانیه)
+        """
+        self.trunk_name = trunk_name
+        self.reason = reason
+        self.retry_after = retry_after
+        limit = 'کانال هم‌زمان' if reason == 'channels' else 'تماس در ثانیه'
+        super().__init__(
+            f"ظرفیت trunk {trunk_name} ({limit}) پر است؛ "
+            f"{retry_after:.1f} ثانیه دیگر تلاش کنید"
+        )
+
+
+class TrunkLease:
+    """یک کانال رزرو شده روی trunk که باید با release آزاد شود"""
+
+    __slots__ = ('trunk_name', 'slot', 'lease_id', 'released')
+
+    def __init__(self, trunk_name: str, slot: int, lease_id: int):
+        self.trunk_name = trunk_name
+        self.slot = slot
+        self.lease_id = lease_id
+        self.released = False
+
+
+TRUNK_LIMIT_REJECTIONS = REGISTRY.counter(
+    'trunk_limit_rejections_total',
+    'Originates rejected because a trunk was at capacity',
+    ('trunk', 'reason')
+)
+TRUNK_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    'trunk_limit_wait_seconds',
+    'Time an Originate waited for trunk capacity'
+)
+
+
+def _default_limits_path() -> str:
+    """مسیر فایل حافظه مشترک (ترجیحاً /dev/shm)"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else (
+        tempfile.gettempdir()
+    )
+    return os.path.join(directory, 'masked-call-trunk-limits')
+
+
+class SharedTrunkLimiter:
+    """
+    محدودیت کانال هم‌زمان و CPS هر trunk، مشترک بین workerهای یک host
+
+    وضعیت در یک فایل mmap شده (پیش‌فرض در /dev/shm) نگه داشته می‌شود و
+    هر تغییر زیر flock انجام می‌شود؛ بنابراین تمام workerهای uvicorn یک
+    سقف مشترک می‌بینند. هر کانال یک lease با pid و زمان انقضا دارد تا
+    کانال‌های worker از کار افتاده یا Hangup از دست رفته دوباره آزاد
+    شوند.
+
+    تعداد lease فعال هر trunk کنار token bucket آن نگه داشته می‌شود؛ جدول
+    leaseها فقط وقتی trunk پر به نظر برسد (حداکثر هر REAP_INTERVAL ثانیه
+    یک بار) برای یافتن leaseهای رها شده پیمایش می‌شود.
+    """
+
+    MAGIC = b'MCTRUNK2'
+    _HEADER = struct.Struct('<8sII')
+    # زمان آخرین پیمایش کامل leaseها
+    _REAPED = struct.Struct('<d')
+    # key، tokens، زمان آخرین پر شدن، تعداد lease فعال
+    _BUCKET = struct.Struct('<Qddq')
+    # key، lease_id، pid، زمان انقضا
+    _LEASE = struct.Struct('<QQqd')
+
+    # فاصله بررسی دوباره وقتی همه کانال‌ها مشغول هستند (ثانیه)
+    CHANNEL_RETRY = 0.05
+    # حداقل فاصله بین دو پیمایش کامل leaseها (ثانیه)
+    REAP_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        bucket_slots: int = 256,
+        lease_slots: Optional[int] = None,
+        lease_ttl: Optional[float] = None,
+        default_wait: Optional[float] = None
+    ):
+        """
+        Args:
+            path: مسیر فایل مشترک (پیش‌فرض: TRUNK_LIMITS_PATH یا /dev/shm)
+            bucket_slots: حداکثر تعداد trunk
+            lease_slots: حداکثر کانال رزرو شده هم‌زمان در کل host
+                (پیش‌فرض: TRUNK_LEASE_SLOTS یا 4096)
+            lease_ttl: حداکثر عمر lease بدون Hangup (ثانیه)
+                (پیش‌فرض: TRUNK_LEASE_TTL یا 14400)
+            default_wait: حداکثر انتظار برای ظرفیت (ثانیه؛ 0 یعنی رد
+                فوری) (پیش‌فرض: TRUNK_LIMIT_WAIT یا 2)
+        """
+        self.path = path or os.getenv('TRUNK_LIMITS_PATH') or (
+            _default_limits_path()
+        )
+        self.bucket_slots = bucket_slots
+        self.lease_slots = lease_slots or int(
+            os.getenv('TRUNK_LEASE_SLOTS', '4096')
+        )
+        self.lease_ttl = lease_ttl or float(
+            os.getenv('TRUNK_LEASE_TTL', '14400')
+        )
+        self.default_wait = (
+            default_wait if default_wait is not None
+            else float(os.getenv('TRUNK_LIMIT_WAIT', '2'))
+        )
+        self._reaped_offset = self._HEADER.size
+        self._bucket_offset = self._reaped_offset + self._REAPED.size
+        self._lease_offset = (
+            self._bucket_offset + self.bucket_slots * self._BUCKET.size
+        )
+        self._size = self._lease_offset + self.lease_slots * self._LEASE.size
+        # flock بین threadهای یک process (روی یک fd) قفل نمی‌کند
+        self._thread_lock = threading.Lock()
+        self._names: Dict[int, str] = {}
+        # نقطه شروع جستجوی خانه خالی lease
+        self._free_hint = 0
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._open()
+
+    def _open(self):
+        """باز کردن یا ساخت فایل مشترک"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._file = os.fdopen(fd, 'r+b')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            header = self._file.read(self._HEADER.size)
+            expected = self._HEADER.pack(
+                self.MAGIC, self.bucket_slots, self.lease_slots
+            )
+            if header != expected or os.fstat(fd).st_size != self._size:
+                # فایل جدید یا چیدمان متفاوت: مقداردهی اولیه با صفر
+                self._file.truncate(0)
+                self._file.truncate(self._size)
+                self._file.seek(0)
+                self._file.write(expected)
+                self._file.flush()
+            self._map = mmap.mmap(fd, self._size)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _locked(self):
+        """قفل انحصاری روی وضعیت مشترک (بین thread و process)"""
+        with self._thread_lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                yield self._map
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(trunk_name: str) -> int:
+        """کلید 64 بیتی غیر صفر برای نام trunk"""
+        digest = hashlib.blake2b(trunk_name.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        """آیا process صاحب lease هنوز زنده است"""
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _bucket_slot(self, buffer, key: int) -> Optional[int]:
+        """offset خانه token bucket یک trunk (با linear probing)"""
+        start = key % self.bucket_slots
+        for step in range(self.bucket_slots):
+            offset = (
+                self._bucket_offset +
+                ((start + step) % self.bucket_slots) * self._BUCKET.size
+            )
+            slot_key = self._BUCKET.unpack_from(buffer, offset)[0]
+            if slot_key in (0, key):
+                return offset
+        return None
+
+    def _active_count(self, buffer, key: int, bucket: Optional[int]) -> int:
+        """تعداد lease فعال یک trunk (داخل قفل)"""
+        if bucket is None:
+            # جدول trunkها پر است؛ شمارش با پیمایش leaseها
+            return sum(
+                1 for slot_key, _, _, _ in self._LEASE.iter_unpack(
+                    buffer[self._lease_offset:self._size]
+                ) if slot_key == key
+            )
+        slot_key, _, _, active = self._BUCKET.unpack_from(buffer, bucket)
+        return active if slot_key == key else 0
+
+    def _free_slot(self, buffer) -> Optional[int]:
+        """یافتن خانه خالی lease از آخرین خانه آزاد شده (داخل قفل)"""
+        for step in range(self.lease_slots):
+            slot = (self._free_hint + step) % self.lease_slots
+            offset = self._lease_offset + slot * self._LEASE.size
+            if self._LEASE.unpack_from(buffer, offset)[0] == 0:
+                self._free_hint = slot + 1
+                return slot
+        return None
+
+    def _reap(self, buffer, now: float) -> bool:
+        """
+        آزاد کردن leaseهای منقضی یا متعلق به processهای مرده و محاسبه
+        دوباره تعداد lease هر trunk (داخل قفل)
+
+        Returns:
+            False اگر پیمایش قبلی کمتر از REAP_INTERVAL پیش انجام شده باشد
+        """
+        if now - self._REAPED.unpack_from(buffer, self._reaped_offset)[0] < (
+            self.REAP_INTERVAL
+        ):
+            return False
+        alive: Dict[int, bool] = {os.getpid(): True}
+        counts: Dict[int, int] = {}
+        leases = buffer[self._lease_offset:self._size]
+        for slot, (slot_key, _, owner, expires) in enumerate(
+            self._LEASE.iter_unpack(leases)
+        ):
+            if slot_key == 0:
+                continue
+            if owner not in alive:
+                alive[owner] = self._alive(owner)
+            if expires <= now or not alive[owner]:
+                # lease رها شده (worker از کار افتاده یا Hangup گم شده)
+                self._LEASE.pack_into(
+                    buffer, self._lease_offset + slot * self._LEASE.size,
+                    0, 0, 0, 0.0
+                )
+                continue
+            counts[slot_key] = counts.get(slot_key, 0) + 1
+
+        for index in range(self.bucket_slots):
+            offset = self._bucket_offset + index * self._BUCKET.size
+            slot_key, tokens, updated, _ = self._BUCKET.unpack_from(
+                buffer, offset
+            )
+            if slot_key:
+                self._BUCKET.pack_into(
+                    buffer, offset, slot_key, tokens, updated,
+                    counts.get(slot_key, 0)
+                )
+        self._REAPED.pack_into(buffer, self._reaped_offset, now)
+        return True
+
+    def try_acquire(self, trunk) -> tuple[Optional[TrunkLease], float, str]:
+        """
+        رزرو یک کانال و یک token بدون انتظار
+
+        Args:
+            trunk: Trunk با name، max_channels و cps
+
+        Returns:
+            tuple (lease یا None، زمان پیشنهادی انتظار، دلیل رد)
+        """
+        key = self._key(trunk.name)
+        self._names[key] = trunk.name
+
+        with self._locked() as buffer:
+            now = time.monotonic()
+            bucket = self._bucket_slot(buffer, key)
+            active = self._active_count(buffer, key, bucket)
+            free_slot = None
+            if active < trunk.max_channels:
+                free_slot = self._free_slot(buffer)
+            if free_slot is None and self._reap(buffer, now):
+                active = self._active_count(buffer, key, bucket)
+                if active < trunk.max_channels:
+                    free_slot = self._free_slot(buffer)
+            if free_slot is None:
+                return None, self.CHANNEL_RETRY, 'channels'
+
+            if bucket is not None:
+                slot_key, tokens, updated, _ = self._BUCKET.unpack_from(
+                    buffer, bucket
+                )
+                burst = max(1.0, trunk.cps)
+                if slot_key == 0:
+                    tokens, updated = burst, now
+                tokens = min(burst, tokens + (now - updated) * trunk.cps)
+                if tokens < 1:
+                    self._BUCKET.pack_into(
+                        buffer, bucket, key, tokens, now, active
+                    )
+                    return None, (1 - tokens) / trunk.cps, 'cps'
+                self._BUCKET.pack_into(
+                    buffer, bucket, key, tokens - 1, now, active + 1
+                )
+
+            lease_id = int.from_bytes(os.urandom(8), 'little') | 1
+            self._LEASE.pack_into(
+                buffer, self._lease_offset + free_slot * self._LEASE.size,
+                key, lease_id, os.getpid(), now + self.lease_ttl
+            )
+        return TrunkLease(trunk.name, free_slot, lease_id), 0.0, ''
+
+    def _reject(self, trunk, reason: str, retry_after: float):
+        TRUNK_LIMIT_REJECTIONS.labels(trunk.name, reason).inc()
+        raise RateLimitExceeded(trunk.name, reason, retry_after)
+
+    def acquire(self, trunk, wait: Optional[float] = None) -> TrunkLease:
+        """
+        رزرو یک کانال با انتظار محدود
+
+        Args:
+            trunk: Trunk با name، max_channels و cps
+            wait: حداکثر انتظار (ثانیه؛ پیش‌فرض: default_wait)
+
+        Returns:
+            TrunkLease
+
+        Raises:
+            RateLimitExceeded: اگر ظرفیت در زمان انتظار آزاد نشود
+        """
+        started = time.monotonic()
+        deadline = started + (self.default_wait if wait is None else wait)
+        while True:
+            lease, retry_after, reason = self.try_acquire(trunk)
+            if lease is not None:
+                TRUNK_LIMIT_WAIT_SECONDS.observe(time.monotonic() - started)
+                return lease
+            remaining = deadline - time.monotonic()
+            if retry_after > remaining:
+                self._reject(trunk, reason, retry_after)
+            time.sleep(min(retry_after, 0.25))
+
+    async def acquire_async(
+        self,
+        trunk,
+        wait: Optional[float] = None
+    ) -> TrunkLease:
+        """نسخه asyncio از acquire (انتظار روی event loop)"""
+        started = time.monotonic()
+        deadline = started + (self.default_wait if wait is None else wait)
+        while True:
+            # flock ممکن است بلاک کند؛ event loop معطل نمی‌ماند
+            lease, retry_after, reason = await asyncio.to_thread(
+                self.try_acquire, trunk
+            )
+            if lease is not None:
+                TRUNK_LIMIT_WAIT_SECONDS.observe(time.monotonic() - started)
+                return lease
+            remaining = deadline - time.monotonic()
+            if retry_after > remaining:
+                self._reject(trunk, reason, retry_after)
+            await asyncio.sleep(min(retry_after, 0.25))
+
+    def release(self, lease: Optional[TrunkLease]):
+        """
+        آزاد کردن کانال (چند بار صدا زدن بی‌خطر است)
+
+        Args:
+            lease: lease گرفته شده از acquire
+        """
+        if lease is None or lease.released:
+            return
+        lease.released = True
+        offset = self._lease_offset + lease.slot * self._LEASE.size
+        with self._locked() as buffer:
+            key, lease_id, _, _ = self._LEASE.unpack_from(buffer, offset)
+            if lease_id != lease.lease_id:
+                # lease قبلاً با پیمایش کامل آزاد و شمارش اصلاح شده است
+                return
+            self._LEASE.pack_into(buffer, offset, 0, 0, 0, 0.0)
+            bucket = self._bucket_slot(buffer, key)
+            if bucket is not None:
+                slot_key, tokens, updated, active = (
+                    self._BUCKET.unpack_from(buffer, bucket)
+                )
+                if slot_key == key and active > 0:
+                    self._BUCKET.pack_into(
+                        buffer, bucket, key, tokens, updated, active - 1
+                    )
+
+    def stats(self) -> Dict[str, Any]:
+        """تعداد کانال رزرو شده هر trunk (در کل host)"""
+        active: Dict[int, int] = {}
+        with self._locked() as buffer:
+            leases = buffer[self._lease_offset:self._size]
+        for slot_key, _, _, _ in self._LEASE.iter_unpack(leases):
+            if slot_key:
+                active[slot_key] = active.get(slot_key, 0) + 1
+        return {
+            'path': self.path,
+            'lease_slots': self.lease_slots,
+            'active': {
+                self._names.get(key, str(key)): count
+                for key, count in active.items()
+            },
+        }
+
+    def close(self):
+        """بستن فایل مشترک"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_limiter: Optional[SharedTrunkLimiter] = None
+_limiter_lock = threading.Lock()
+_limiter_pid = os.getpid()
+
+
+def get_trunk_limiter() -> SharedTrunkLimiter:
+    """
+    دریافت limiter trunk این process
+
+    بعد از fork فایل دوباره باز می‌شود تا flock بین processها کار کند.
+    """
+    global _limiter, _limiter_pid
+    with _limiter_lock:
+        if _limiter is None or _limiter_pid != os.getpid():
+            _limiter = SharedTrunkLimiter()
+            _limiter_pid = os.getpid()
+        return _limiter
@@ -0,0 +1,372 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any, List, Set
+
+from call_state_machine import CallSessionStateMachine
+
+logger = logging.getLogger(__name__)
+
+
+# هدرهای Event که Uniqueid/Linkedid یا نام کانال یک جلسه را دارند
+UNIQUEID_HEADERS = ('Uniqueid', 'Linkedid', 'DestUniqueid', 'DestLinkedid')
+CHANNEL_HEADERS = ('Channel', 'DestChannel')
+
+
+class LiveSession:
+    """یک جلسه زنده در registry همراه با کلیدهای Asterisk آن"""
+
+    __slots__ = (
+        'state_machine', 'session_id', 'channels', 'uniqueids',
+        'data', 'created_at', 'finished_at', 'hungup', 'teardowns',
+        'server',
+    )
+
+    def __init__(
+        self,
+        state_machine: CallSessionStateMachine,
+        data: Optional[Dict[str, Any]] = None
+    ):
+        self.state_machine = state_machine
+        self.session_id = state_machine.get_session_id()
+        # {leg: نام کانال} و {leg: Uniqueid}؛ leg مثلاً 'a' یا 'b'
+        self.channels: Dict[str, str] = {}
+        self.uniqueids: Dict[str, str] = {}
+        # داده‌های دلخواه صاحب جلسه (مثلاً رکورد orchestrator)
+        self.data: Dict[str, Any] = data if data is not None else {}
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        # legهایی که Hangup آن‌ها دیده یا ارسال شده است
+        self.hungup: Set[str] = set()
+        # تعداد تلاش‌های قطع legهای باقی‌مانده
+        self.teardowns = 0
+        # نام پیکربندی سرور Asterisk که تماس روی آن originate شد
+        self.server: Optional[str] = None
+
+    def leg_of(self, event: Dict[str, str]) -> Optional[str]:
+        """
+        تشخیص leg جلسه از روی یک Event
+
+        Returns:
+            نام leg یا None اگر Event به کانال مشخصی از جلسه مربوط نباشد
+        """
+        uniqueid = event.get('Uniqueid')
+        channel = event.get('Channel')
+        for leg, value in self.uniqueids.items():
+            if value == uniqueid:
+                return leg
+        for leg, value in self.channels.items():
+            if value == channel:
+                return leg
+        return None
+
+
+class SessionRegistry:
+    """
+    registry جلسه‌های زنده این process
+
+    هر جلسه با session_id، نام کانال‌ها و Uniqueid/Linkedid کانال‌هایش
+    در dictهای جداگانه index می‌شود تا یک Event AMI یا یک درخواست HTTP
+    در O(1) به ماشین حالت درست برسد. جلسه‌های نهایی پس از retention
+    ثانیه و در صورت عبور از max_sessions زودتر حذف می‌شوند؛ جلسه زنده
+    هرگز حذف نمی‌شود تا Hangup آن گم نشود.
+    """
+
+    # حداکثر کلید Asterisk که از روی Eventها برای یک جلسه یاد گرفته می‌شود
+    MAX_KEYS_PER_SESSION = 16
+
+    def __init__(
+        self,
+        retention: Optional[float] = None,
+        max_sessions: Optional[int] = None
+    ):
+        """
+        Args:
+            retention: مدت نگهداری جلسه پس از رسیدن به حالت نهایی (ثانیه)
+                (پیش‌فرض: CALL_SESSION_RETENTION یا 600)
+            max_sessions: حداکثر تعداد جلسه در حافظه
+                (پیش‌فرض: CALL_SESSION_MAX یا 10000)
+        """
+        self.retention = retention if retention is not None else float(
+            os.getenv('CALL_SESSION_RETENTION', '600')
+        )
+        self.max_sessions = max_sessions or int(
+            os.getenv('CALL_SESSION_MAX', '10000')
+        )
+        self._sessions: 'OrderedDict[str, LiveSession]' = OrderedDict()
+        self._by_channel: Dict[str, LiveSession] = {}
+        self._by_uniqueid: Dict[str, LiveSession] = {}
+        # (finished_at, session_id) به ترتیب پایان جلسه‌ها
+        self._finished: deque = deque()
+        self._lock = threading.Lock()
+        self.evicted = 0
+        # تعداد ثبت‌هایی که با وجود پر بودن registry از جلسه‌های زنده انجام شد
+        self.overflows = 0
+
+    def register(
+        self,
+        state_machine: CallSessionStateMachine,
+        data: Optional[Dict[str, Any]] = None
+    ) -> LiveSession:
+        """
+        ثبت یک جلسه (ثبت دوباره همان جلسه، رکورد موجود را برمی‌گرداند)
+
+        Args:
+            state_machine: ماشین حالت جلسه
+            data: داده‌های دلخواه صاحب جلسه
+
+        Returns:
+            LiveSession
+        """
+        session_id = state_machine.get_session_id()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                if data is not None:
+                    entry.data = data
+                return entry
+            entry = LiveSession(state_machine, data)
+            self._sessions[session_id] = entry
+            if state_machine.is_final_state():
+                self._mark_finished(entry)
+            self._evict()
+            if len(self._sessions) > self.max_sessions:
+                # حذف جلسه زنده index کانال‌های آن را از بین می‌برد و
+                # supervisor دیگر Hangup آن را نمی‌بیند؛ registry موقتاً
+                # از max_sessions بزرگ‌تر می‌شود
+                self.overflows += 1
+                logger.warning(
+                    "registry جلسه‌ها پر است (%s جلسه زنده، حداکثر %s)",
+                    len(self._sessions) - len(self._finished),
+                    self.max_sessions
+                )
+        return entry
+
+    def bind(
+        self,
+        session_id: str,
+        leg: str,
+        channel: Optional[str] = None,
+        uniqueid: Optional[str] = None
+    ) -> bool:
+        """
+        ثبت نام کانال و/یا Uniqueid یک leg جلسه
+
+        Uniqueid قبل از ارسال Originate (ChannelId) ثبت می‌شود تا اولین
+        Eventهای کانال هم به جلسه برسند.
+
+        Args:
+            session_id: شناسه جلسه
+            leg: نام leg (مثلاً 'a' یا 'b')
+            channel: نام کانال Asterisk
+            uniqueid: Uniqueid کانال
+
+        Returns:
+            False اگر جلسه در registry نباشد
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return False
+            if channel:
+                entry.channels[leg] = channel
+                self._by_channel[channel] = entry
+            if uniqueid:
+                entry.uniqueids[leg] = uniqueid
+                self._by_uniqueid[uniqueid] = entry
+        return True
+
+    def get(self, session_id: str) -> Optional[LiveSession]:
+        """جلسه با session_id"""
+        return self._sessions.get(session_id)
+
+    def find_by_channel(self, channel: str) -> Optional[LiveSession]:
+        """جلسه‌ای که این نام کانال را دارد"""
+        return self._by_channel.get(channel)
+
+    def find_by_uniqueid(self, uniqueid: str) -> Optional[LiveSession]:
+        """جلسه‌ای که این Uniqueid یا Linkedid را دارد"""
+        return self._by_uniqueid.get(uniqueid)
+
+    def match_event(self, event: Dict[str, str]) -> Optional[LiveSession]:
+        """
+        یافتن جلسه مربوط به یک Event AMI
+
+        Uniqueid/Linkedid و سپس نام کانال بررسی می‌شوند. کلیدهای دیگر
+        همان Event (مثلاً کانال‌های فرزند Dial که Linkedid جلسه را دارند)
+        به جلسه اضافه می‌شوند تا Eventهای بعدی آن‌ها هم پیدا شوند.
+
+        Args:
+            event: دیکشنری هدرهای Event
+
+        Returns:
+            LiveSession یا None
+        """
+        entry = None
+        for header in UNIQUEID_HEADERS:
+            value = event.get(header)
+            if value:
+                entry = self._by_uniqueid.get(value)
+                if entry is not None:
+                    break
+        if entry is None:
+            for header in CHANNEL_HEADERS:
+                value = event.get(header)
+                if value:
+                    entry = self._by_channel.get(value)
+                    if entry is not None:
+                        break
+        if entry is None:
+            return None
+
+        self._learn(entry, event)
+        return entry
+
+    def _learn(self, entry: LiveSession, event: Dict[str, str]):
+        """index کردن کلیدهای جدید یک Event برای جلسه"""
+        uniqueids = [
+            event[header] for header in UNIQUEID_HEADERS[:2]
+            if event.get(header)
+            and self._by_uniqueid.get(event[header]) is not entry
+        ]
+        channel = event.get('Channel')
+        if channel and self._by_channel.get(channel) is entry:
+            channel = None
+        if not uniqueids and not channel:
+            return
+        with self._lock:
+            if entry.session_id not in self._sessions:
+                return
+            known = len(entry.uniqueids) + len(entry.channels)
+            for value in uniqueids:
+                if known >= self.MAX_KEYS_PER_SESSION:
+                    return
+                if value not in self._by_uniqueid:
+                    entry.uniqueids[f'linked-{known}'] = value
+                    self._by_uniqueid[value] = entry
+                    known += 1
+            if (
+                channel and channel not in self._by_channel and
+                known < self.MAX_KEYS_PER_SESSION
+            ):
+                entry.channels[f'linked-{known}'] = channel
+                self._by_channel[channel] = entry
+
+    def session_finished(self, state_machine: CallSessionStateMachine):
+        """
+        ثبت رسیدن جلسه به حالت نهایی (شروع retention)
+
+        Args:
+            state_machine: ماشین حالت جلسه
+        """
+        with self._lock:
+            entry = self._sessions.get(state_machine.get_session_id())
+            if entry is not None and entry.finished_at is None:
+                self._mark_finished(entry)
+            self._evict()
+
+    def _mark_finished(self, entry: LiveSession):
+        """باید داخل قفل صدا زده شود"""
+        entry.finished_at = time.monotonic()
+        self._finished.append((entry.finished_at, entry.session_id))
+
+    def _evict(self):
+        """
+        حذف جلسه‌های نهایی قدیمی‌تر از retention و در صورت عبور از
+        max_sessions قدیمی‌ترین جلسه‌های نهایی (باید داخل قفل صدا زده شود)
+        """
+        deadline = time.monotonic() - self.retention
+        finished = self._finished
+        while finished and (
+            finished[0][0] <= deadline or
+            len(self._sessions) > self.max_sessions
+        ):
+            _, session_id = finished.popleft()
+            self._remove(session_id)
+
+    def _remove(self, session_id: str):
+        """حذف جلسه و تمام indexهای آن (باید داخل قفل صدا زده شود)"""
+        entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            return
+        for channel in entry.channels.values():
+            if self._by_channel.get(channel) is entry:
+                del self._by_channel[channel]
+        for uniqueid in entry.uniqueids.values():
+            if self._by_uniqueid.get(uniqueid) is entry:
+                del self._by_uniqueid[uniqueid]
+        self.evicted += 1
+
+    def evict(self):
+        """اجرای دستی eviction (مثلاً از یک thread دوره‌ای)"""
+        with self._lock:
+            self._evict()
+
+    def sessions(self) -> List[LiveSession]:
+        """snapshot جلسه‌های موجود به ترتیب ثبت"""
+        with self._lock:
+            return list(self._sessions.values())
+
+    def live(self) -> List[LiveSession]:
+        """جلسه‌هایی که هنوز به حالت نهایی نرسیده‌اند"""
+        return [
+            entry for entry in self.sessions()
+            if not entry.state_machine.is_final_state()
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        """وضعیت registry"""
+        with self._lock:
+            self._evict()
+            total = len(self._sessions)
+            finished = len(self._finished)
+            return {
+                'sessions': total,
+                'live': total - finished,
+                'finished': finished,
+                'channels': len(self._by_channel),
+                'uniqueids': len(self._by_uniqueid),
+                'evicted': self.evicted,
+                'overflows': self.overflows,
+                'retention': self.retention,
+                'max_sessions': self.max_sessions,
+            }
+
+
+_registry: Optional[SessionRegistry] = None
+_registry_lock = threading.Lock()
+_registry_pid = os.getpid()
+
+
+def get_session_registry() -> SessionRegistry:
+    """
+    دریافت registry جلسه‌های این process
+
+    جلسه‌های زنده متعلق به همان process هستند؛ بعد از fork registry
+    خالی ساخته می‌شود.
+    """
+    global _registry, _registry_pid
+    with _registry_lock:
+        if _registry is None or _registry_pid != os.getpid():
+            _registry = SessionRegistry()
+            _registry_pid = os.getpid()
+        return _registry
+
+
+def _on_transition(
+    state_machine,
+    old_state,
+    new_state,
+    elapsed: float,
+    seq: int,
+    entered_at: float
+):
+    """شروع retention جلسه پس از رسیدن به حالت نهایی"""
+    if state_machine.is_final_state():
+        get_session_registry().session_finished(state_machine)
+
+
+# eviction جلسه‌های نهایی به این listener وابسته است و همراه ماژول ثبت می‌شود
+CallSessionStateMachine.add_transition_listener(_on_transition)
@@ -0,0 +1,416 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple
+
+from psycopg2.extras import execute_values
+
+from db import get_db_connection
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+SESSION_EVENTS_DROPPED = REGISTRY.counter(
+    'call_session_events_dropped_total',
+    'Call state transitions dropped because the write-behind queue was full'
+)
+SESSION_FLUSH_SECONDS = REGISTRY.histogram(
+    'call_session_flush_seconds',
+    'Time spent writing one batch of call state transitions'
+)
+SESSION_FLUSH_ROWS = REGISTRY.counter(
+    'call_session_transitions_persisted_total',
+    'Call state transitions written to the database'
+)
+
+
+# (session_id, seq, from_state, to_state, at, elapsed, is_final)
+Transition = Tuple[str, int, str, str, float, float, bool]
+
+
+class SessionStore:
+    """
+    ذخیره write-behind انتقال‌های حالت جلسه‌های تماس
+
+    transition_to فقط یک tuple را در صف حافظه قرار می‌دهد و یک thread
+    پس‌زمینه هر flush_interval ثانیه یا با رسیدن تعداد رویدادها به
+    batch_size آن‌ها را با یک multi-row INSERT در جداول call_sessions و
+    call_session_transitions می‌نویسد؛ بنابراین دیتابیس هیچ تأخیری به
+    مسیر تماس اضافه نمی‌کند. اگر صف پر باشد (دیتابیس در دسترس نیست)
+    رویدادهای جدید دور ریخته و شمرده می‌شوند.
+    """
+
+    def __init__(
+        self,
+        flush_interval: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        max_queue: Optional[int] = None
+    ):
+        """
+        Args:
+            flush_interval: حداکثر فاصله بین دو flush (ثانیه)
+            batch_size: تعداد رویدادی که flush فوری را فعال می‌کند
+            max_queue: حداکثر رویداد در انتظار نوشتن
+        """
+        self.flush_interval = flush_interval or (
+            int(os.getenv('SESSION_FLUSH_MS', '200')) / 1000.0
+        )
+        self.batch_size = batch_size or int(
+            os.getenv('SESSION_FLUSH_BATCH', '500')
+        )
+        self.max_queue = max_queue or int(
+            os.getenv('SESSION_QUEUE_MAX', '100000')
+        )
+        self._queue: deque = deque()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.flushed = 0
+        self.failures = 0
+
+    def start(self):
+        """راه‌اندازی thread پس‌زمینه (یک بار در هر process)"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='call-session-writer',
+                daemon=True
+            )
+            self._thread.start()
+
+    def record_transition(
+        self,
+        state_machine,
+        old_state,
+        new_state,
+        elapsed: float,
+        seq: int,
+        entered_at: float
+    ):
+        """
+        listener انتقال حالت تماس (CallSessionStateMachine.add_transition_listener)
+
+        Args:
+            state_machine: ماشین حالت جلسه
+            old_state: حالت قبلی
+            new_state: حالت جدید
+            elapsed: مدت ماندن در حالت قبلی (ثانیه)
+            seq: اندیس حالت جدید در تاریخچه جلسه
+            entered_at: زمان monotonic ورود به حالت جدید
+        """
+        if len(self._queue) >= self.max_queue:
+            SESSION_EVENTS_DROPPED.inc()
+            return
+        # seq و زمان ورود زیر قفل ماشین حالت ثبت شده‌اند؛ خواندن دوباره
+        # تاریخچه در انتقال‌های هم‌زمان seq تکراری می‌دهد
+        self._queue.append((
+            state_machine.session_id,
+            seq,
+            old_state.value,
+            new_state.value,
+            time.time() - (time.monotonic() - entered_at),
+            elapsed,
+            new_state in state_machine.FINAL_STATES,
+        ))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        if self._thread is None:
+            self.start()
+
+    def pending(self) -> int:
+        """تعداد رویدادهای در انتظار نوشتن"""
+        return len(self._queue)
+
+    def _run(self):
+        """flush دوره‌ای صف تا زمان stop"""
+        backoff = 0.0
+        while not self._stopped.is_set():
+            if backoff:
+                # دیتابیس در دسترس نیست؛ رسیدن به batch_size باعث تلاش
+                # مجدد فوری نمی‌شود
+                self._stopped.wait(backoff)
+            else:
+                self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            failures = self.failures
+            self.flush()
+            if self.failures != failures:
+                backoff = min(max(backoff * 2, self.flush_interval), 5.0)
+            else:
+                backoff = 0.0
+
+    def _drain(self) -> List[Transition]:
+        """برداشتن حداکثر batch_size رویداد از ابتدای صف"""
+        batch = []
+        popleft = self._queue.popleft
+        try:
+            for _ in range(self.batch_size):
+                batch.append(popleft())
+        except IndexError:
+            pass
+        return batch
+
+    def flush(self) -> int:
+        """
+        نوشتن تمام رویدادهای صف در دیتابیس
+
+        Returns:
+            تعداد انتقال‌های نوشته شده
+        """
+        written = 0
+        with self._flush_lock:
+            while self._queue:
+                batch = self._drain()
+                if not self._write(batch):
+                    # رویدادها به ابتدای صف برمی‌گردند تا در flush بعدی
+                    # دوباره تلاش شوند
+                    self._queue.extendleft(reversed(batch))
+                    break
+                written += len(batch)
+        return written
+
+    @staticmethod
+    def _timestamp(value: float) -> datetime:
+        return datetime.fromtimestamp(value, timezone.utc)
+
+    def _write(self, batch: List[Transition]) -> bool:
+        """نوشتن یک batch در یک تراکنش"""
+        if not batch:
+            return True
+        started = time.perf_counter()
+
+        # برای هر جلسه فقط آخرین حالت در call_sessions upsert می‌شود
+        sessions: Dict[str, List[Any]] = {}
+        for session_id, seq, _, to_state, at, elapsed, is_final in batch:
+            session = sessions.get(session_id)
+            if session is None:
+                sessions[session_id] = [
+                    session_id, to_state,
+                    self._timestamp(at - elapsed), self._timestamp(at),
+                    self._timestamp(at) if is_final else None, seq,
+                ]
+            elif seq >= session[5]:
+                session[1] = to_state
+                session[3] = self._timestamp(at)
+                session[4] = self._timestamp(at) if is_final else None
+                session[5] = seq
+
+        conn = get_db_connection()
+        if not conn:
+            self.failures += 1
+            return False
+        try:
+            cursor = conn.cursor()
+            execute_values(cursor, """
+                INSERT INTO call_sessions (
+                    session_id, state, created_at, updated_at,
+                    finished_at, seq
+                ) VALUES %s
+                ON CONFLICT (session_id) DO UPDATE SET
+                    state = EXCLUDED.state,
+                    updated_at = EXCLUDED.updated_at,
+                    finished_at = EXCLUDED.finished_at,
+                    seq = EXCLUDED.seq
+                WHERE call_sessions.seq < EXCLUDED.seq
+            """, list(sessions.values()), page_size=1000)
+            execute_values(cursor, """
+                INSERT INTO call_session_transitions (
+                    session_id, seq, from_state, to_state, at, elapsed
+                ) VALUES %s
+                ON CONFLICT (session_id, seq) DO NOTHING
+            """, [
+                (
+                    session_id, seq, from_state, to_state,
+                    self._timestamp(at), elapsed,
+                )
+                for session_id, seq, from_state, to_state, at, elapsed, _
+                in batch
+            ], page_size=1000)
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            logger.error("خطا در ثبت انتقال‌های جلسه تماس: %s", e)
+            self.failures += 1
+            conn.rollback()
+            conn.close()
+            return False
+
+        SESSION_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        SESSION_FLUSH_ROWS.inc(len(batch))
+        self.flushed += len(batch)
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        """توقف thread و flush نهایی صف"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """وضعیت صف write-behind"""
+        return {
+            'pending': len(self._queue),
+            'flushed': self.flushed,
+            'failures': self.failures,
+            'flush_interval': self.flush_interval,
+            'batch_size': self.batch_size,
+        }
+
+
+def load_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """
+    خواندن جلسه تماس و تاریخچه انتقال‌های آن از دیتابیس
+
+    Args:
+        session_id: شناسه جلسه
+
+    Returns:
+        دیکشنری جلسه یا None اگر جلسه یافت نشود
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT state, created_at, updated_at, finished_at
+            FROM call_sessions WHERE session_id = %s
+        """, (session_id,))
+        row = cursor.fetchone()
+        if not row:
+            cursor.close()
+            conn.close()
+            return None
+        cursor.execute("""
+            SELECT seq, from_state, to_state, at, elapsed
+            FROM call_session_transitions
+            WHERE session_id = %s
+            ORDER BY seq
+        """, (session_id,))
+        transitions = cursor.fetchall()
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        logger.error("خطا در خواندن جلسه %s: %s", session_id, e)
+        conn.rollback()
+        conn.close()
+        return None
+
+    state, created_at, updated_at, finished_at = row
+    history = [transitions[0][1]] if transitions else []
+    history.extend(t[2] for t in transitions)
+    return {
+        'session_id': session_id,
+        'state': state,
+        'is_final': finished_at is not None,
+        'state_history': history,
+        'transitions': [
+            {
+                'seq': seq,
+                'from': from_state,
+                'to': to_state,
+                'at': at.isoformat(),
+                'elapsed': elapsed,
+            }
+            for seq, from_state, to_state, at, elapsed in transitions
+        ],
+        'created_at': created_at.isoformat() if created_at else None,
+        'updated_at': updated_at.isoformat() if updated_at else None,
+        'finished_at': finished_at.isoformat() if finished_at else None,
+    }
+
+
+def list_sessions(
+    state: Optional[str] = None,
+    limit: int = 100
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    فهرست آخرین جلسه‌های تماس ثبت شده
+
+    Args:
+        state: فیلتر حالت فعلی (اختیاری)
+        limit: حداکثر تعداد جلسه
+
+    Returns:
+        لیست جلسه‌ها (جدیدترین اول) یا None در صورت خطا
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT session_id, state, created_at, updated_at, finished_at
+            FROM call_sessions
+            WHERE %(state)s IS NULL OR state = %(state)s
+            ORDER BY updated_at DESC
+            LIMIT %(limit)s
+        """, {'state': state, 'limit': limit})
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        logger.error("خطا در خواندن جلسه‌های تماس: %s", e)
+        conn.rollback()
+        conn.close()
+        return None
+
+    return [
+        {
+            'session_id': session_id,
+            'state': state,
+            'created_at': created_at.isoformat() if created_at else None,
+            'updated_at': updated_at.isoformat() if updated_at else None,
+            'finished_at': finished_at.isoformat() if finished_at else None,
+        }
+        for session_id, state, created_at, updated_at, finished_at in rows
+    ]
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+_store_pid = os.getpid()
+
+
+def get_session_store() -> SessionStore:
+    """
+    دریافت SessionStore این process
+
+    مانند pool دیتابیس به ازای هر process ساخته می‌شود؛ thread نوشتن
+    بعد از fork در workerهای gunicorn وجود ندارد.
+    """
+    global _store, _store_pid
+    with _store_lock:
+        if _store is None or _store_pid != os.getpid():
+            _store = SessionStore()
+            _store_pid = os.getpid()
+            atexit.register(_store.stop)
+        return _store
+
+
+def record_session_transition(
+    state_machine,
+    old_state,
+    new_state,
+    elapsed: float,
+    seq: int,
+    entered_at: float
+):
+    """listener انتقال حالت که رویداد را به SessionStore این process می‌سپارد"""
+    get_session_store().record_transition(
+        state_machine, old_state, new_state, elapsed, seq, entered_at
+    )
@@ -0,0 +1,231 @@
+import logging
+import os
+import threading
+from typing import Optional, Dict
+
+from db import get_db_connection, get_notification_listener
+
+logger = logging.getLogger(__name__)
+
+
+# کانال NOTIFY که create_trunk پس از تغییر trunkها ارسال می‌کند
+TRUNKS_CHANNEL = 'trunks_changed'
+
+# نام trunkی که در درخواست‌ها به trunk پیش‌فرض اشاره می‌کند
+EXTERNAL_TRUNK_ALIAS = 'trunk_external'
+
+
+def get_default_trunk() -> str:
+    """
+    نام trunk پیش‌فرض در Asterisk
+
+    Returns:
+        مقدار DEFAULT_TRUNK (پیش‌فرض: trunk خروجی Issabel)
+    """
+    return os.getenv('DEFAULT_TRUNK', '0utgoing-2191012787')
+
+
+def _positive(value, default: float) -> float:
+    """تبدیل مقدار تنظیمات trunk به عدد مثبت یا مقدار پیش‌فرض"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+
+class Trunk:
+    """
+    trunk آماده برای ساخت کانال
+
+    رشته dial یک بار هنگام ساخت trunk به پیشوند/پسوند تبدیل می‌شود و
+    ساخت کانال برای هر شماره فقط یک الحاق رشته است.
+    """
+
+    # قالب رشته dial برای هر technology
+    TEMPLATES = {
+        'SIP': 'SIP/{trunk}/{number}',
+        'PJSIP': 'PJSIP/{number}@{trunk}',
+        'IAX2': 'IAX2/{trunk}/{number}',
+    }
+
+    __slots__ = (
+        'name', 'technology', 'template', 'max_channels', 'cps',
+        '_prefix', '_suffix',
+    )
+
+    def __init__(
+        self,
+        name: str,
+        technology: str = 'SIP',
+        max_channels: Optional[int] = None,
+        cps: Optional[float] = None
+    ):
+        """
+        Args:
+            name: نام trunk در Asterisk
+            technology: technology کانال (SIP، PJSIP یا IAX2)
+            max_channels: حداکثر تماس هم‌زمان روی trunk
+                (پیش‌فرض: TRUNK_MAX_CHANNELS یا 30)
+            cps: حداکثر تماس جدید در ثانیه (پیش‌فرض: TRUNK_CPS یا 10)
+        """
+        technology = (technology or 'SIP').upper()
+        if technology not in self.TEMPLATES:
+            technology = 'SIP'
+        self.name = name
+        self.technology = technology
+        self.template = self.TEMPLATES[technology]
+        self.max_channels = int(_positive(
+            max_channels, int(os.getenv('TRUNK_MAX_CHANNELS', '30'))
+        ))
+        self.cps = _positive(cps, float(os.getenv('TRUNK_CPS', '10')))
+        self._prefix, self._suffix = self.template.replace(
+            '{trunk}', name
+        ).split('{number}')
+
+    def dial_string(self, number: str) -> str:
+        """
+        ساخت رشته dial برای یک شماره
+
+        Args:
+            number: شماره مقصد
+
+        Returns:
+            رشته کانال (مثال: SIP/trunk/09140916320)
+        """
+        return self._prefix + number + self._suffix
+
+    def to_dict(self) -> Dict[str, str]:
+        """نمایش trunk برای پاسخ API"""
+        return {
+            'name': self.name,
+            'technology': self.technology,
+            'template': self.template,
+            'max_channels': self.max_channels,
+            'cps': self.cps,
+        }
+
+
+class TrunkRegistry:
+    """
+    فهرست trunkها در حافظه process
+
+    trunkها یک بار از جدول trunks خوانده می‌شوند و با NOTIFY روی کانال
+    trunks_changed (ارسال شده از create_trunk) دوباره بارگذاری می‌شوند؛
+    یافتن trunk در مسیر تماس فقط یک جستجوی دیکشنری است.
+    """
+
+    def __init__(self, default_trunk: Optional[str] = None):
+        """
+        Args:
+            default_trunk: trunk جایگزین trunk_external
+                (پیش‌فرض: DEFAULT_TRUNK)
+        """
+        self.default_trunk = default_trunk or get_default_trunk()
+        self._trunks: Dict[str, Trunk] = {}
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def load(self) -> bool:
+        """
+        بارگذاری تمام trunkها از دیتابیس
+
+        در صورت خطا فهرست قبلی حفظ می‌شود.
+
+        Returns:
+            True در صورت موفقیت
+        """
+        conn = get_db_connection()
+        if not conn:
+            self._initialized = True
+            return False
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name, config FROM trunks")
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            logger.error("خطا در خواندن trunk از دیتابیس: %s", e)
+            conn.close()
+            # تلاش بعدی با NOTIFY یا اتصال مجدد listener انجام می‌شود
+            self._initialized = True
+            return False
+
+        trunks = {}
+        for name, config in rows:
+            config = config or {}
+            trunks[name] = Trunk(
+                name,
+                config.get('technology', 'SIP'),
+                max_channels=config.get('max_channels'),
+                cps=config.get('cps')
+            )
+
+        with self._lock:
+            self._trunks = trunks
+            self._initialized = True
+        return True
+
+    def on_notify(self, payload: Optional[str]):
+        """پردازش NOTIFY کانال trunks_changed"""
+        self.load()
+
+    def resolve(self, trunk_name: Optional[str]) -> Trunk:
+        """
+        تبدیل نام trunk درخواست به trunk واقعی در Asterisk
+
+        اگر trunk در دیتابیس باشد از آن استفاده می‌شود؛ trunk_external یا
+        نام خالی به trunk پیش‌فرض (DEFAULT_TRUNK) تبدیل می‌شود و بقیه
+        نام‌ها بدون تغییر با technology SIP استفاده می‌شوند.
+
+        Args:
+            trunk_name: نام trunk ارسال شده در درخواست
+
+        Returns:
+            Trunk
+        """
+        if not self._initialized:
+            self.load()
+
+        trunk = self._trunks.get(trunk_name)
+        if trunk is not None:
+            return trunk
+
+        if not trunk_name or trunk_name == EXTERNAL_TRUNK_ALIAS:
+            trunk = self._trunks.get(self.default_trunk)
+            if trunk is None:
+                trunk = Trunk(self.default_trunk)
+                with self._lock:
+                    self._trunks.setdefault(self.default_trunk, trunk)
+            return trunk
+        return Trunk(trunk_name)
+
+    def all(self) -> Dict[str, Trunk]:
+        """تمام trunkهای بارگذاری شده"""
+        if not self._initialized:
+            self.load()
+        return dict(self._trunks)
+
+
+_registry: Optional[TrunkRegistry] = None
+_registry_lock = threading.Lock()
+_registry_pid = os.getpid()
+
+
+def get_trunk_registry() -> TrunkRegistry:
+    """
+    دریافت فهرست trunk این process
+
+    فهرست در اولین فراخوانی هر process روی کانال NOTIFY ثبت می‌شود.
+    """
+    global _registry, _registry_pid
+    with _registry_lock:
+        if _registry is None or _registry_pid != os.getpid():
+            _registry = TrunkRegistry()
+            _registry_pid = os.getpid()
+            get_notification_listener().listen(
+                TRUNKS_CHANNEL, _registry.on_notify
+            )
+        return _registry
@@ -0,0 +1,358 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, List
+
+from ami_pool import AMIConnectionPool, get_ami_pool
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+TRUNK_STATUS_REFRESH_SECONDS = REGISTRY.histogram(
+    'trunk_status_refresh_seconds',
+    'Time spent loading the PJSIP endpoint and SIP peer lists'
+)
+TRUNK_STATUS_EVENTS = REGISTRY.counter(
+    'trunk_status_events_total',
+    'PeerStatus/ContactStatus events applied to the trunk status snapshot',
+    ('event',)
+)
+
+# وضعیت‌های قابل گزارش یک trunk
+REACHABLE = 'reachable'
+UNREACHABLE = 'unreachable'
+LAGGED = 'lagged'
+UNKNOWN = 'unknown'
+
+# مقدار PeerStatus / ContactStatus -> وضعیت trunk
+_EVENT_STATUS = {
+    'Reachable': REACHABLE,
+    'Registered': REACHABLE,
+    'Created': UNKNOWN,
+    'Unreachable': UNREACHABLE,
+    'Unregistered': UNREACHABLE,
+    'Rejected': UNREACHABLE,
+    'Lagged': LAGGED,
+    'Unknown': UNKNOWN,
+}
+
+
+def _endpoint_status(device_state: str) -> str:
+    """وضعیت endpoint PJSIP از روی DeviceState"""
+    if device_state == 'Unavailable':
+        return UNREACHABLE
+    if device_state in ('', 'Unknown', 'Invalid'):
+        return UNKNOWN
+    return REACHABLE
+
+
+def _peer_status(status: str) -> str:
+    """وضعیت peer chan_sip از روی Status (مثال: OK (5 ms))"""
+    if status.startswith('OK'):
+        return REACHABLE
+    if status.startswith('UNREACHABLE'):
+        return UNREACHABLE
+    if status.startswith('LAGGED'):
+        return LAGGED
+    return UNKNOWN
+
+
+def endpoint_entry(event: Dict[str, str]) -> Dict[str, Any]:
+    """تبدیل Event EndpointList به رکورد trunk"""
+    contacts = {
+        contact: UNKNOWN
+        for contact in event.get('Contacts', '').split(',')
+        if contact
+    }
+    return {
+        'name': event['ObjectName'],
+        'technology': 'PJSIP',
+        'reachability': _endpoint_status(event.get('DeviceState', '')),
+        'device_state': event.get('DeviceState'),
+        'active_channels': int(event.get('ActiveChannels') or 0),
+        'contacts': contacts,
+        'updated_at': time.time(),
+    }
+
+
+def peer_entry(event: Dict[str, str]) -> Dict[str, Any]:
+    """تبدیل Event PeerEntry به رکورد trunk"""
+    address = event.get('IPaddress') or ''
+    if address and address != '-none-' and event.get('IPport'):
+        address = f"{address}:{event['IPport']}"
+    return {
+        'name': event['ObjectName'],
+        'technology': 'SIP',
+        'reachability': _peer_status(event.get('Status', '')),
+        'device_state': event.get('Status'),
+        'address': address or None,
+        'contacts': {},
+        'updated_at': time.time(),
+    }
+
+
+class TrunkStatusCache:
+    """
+    snapshot وضعیت endpointهای PJSIP و peerهای chan_sip
+
+    فهرست کامل با PJSIPShowEndpoints و SIPpeers (تا EventList: Complete)
+    خوانده می‌شود و تا ttl ثانیه از حافظه برگردانده می‌شود. در این فاصله
+    Eventهای PeerStatus و ContactStatus روی event bus وضعیت هر trunk را
+    به‌روز می‌کنند؛ بارگذاری دوباره فقط Eventهای از دست رفته (مثلاً هنگام
+    قطع event bus) را جبران می‌کند.
+    """
+
+    def __init__(
+        self,
+        pool: Optional[AMIConnectionPool] = None,
+        ttl: Optional[float] = None
+    ):
+        """
+        Args:
+            pool: AMI pool برای actionهای لیستی و event bus
+            ttl: عمر snapshot به ثانیه (پیش‌فرض: TRUNK_STATUS_TTL یا 30)
+        """
+        self.pool = pool or get_ami_pool()
+        self.ttl = ttl or float(os.getenv('TRUNK_STATUS_TTL', '30'))
+        # نام trunk -> رکورد وضعیت
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._token: Optional[int] = None
+        self.refreshes = 0
+        self.events_applied = 0
+
+    def start(self):
+        """اشتراک روی Eventهای وضعیت peer/contact"""
+        with self._lock:
+            if self._token is None:
+                self._token = self.pool.event_bus.subscribe(self.handle_event)
+
+    def stop(self):
+        """لغو اشتراک event bus"""
+        with self._lock:
+            if self._token is not None:
+                self.pool.event_bus.unsubscribe(self._token)
+                self._token = None
+
+    def _is_fresh(self) -> bool:
+        loaded_at = self._loaded_at
+        return (
+            loaded_at is not None and
+            time.monotonic() - loaded_at < self.ttl
+        )
+
+    def _ensure_loaded(self) -> tuple[bool, str]:
+        """
+        بارگذاری دوباره snapshot در صورت منقضی شدن
+
+        فقط یک thread بارگذاری می‌کند؛ بقیه در این مدت snapshot قبلی را
+        می‌گیرند و فقط اگر هنوز snapshotی وجود نداشته باشد منتظر می‌مانند.
+        """
+        if self._is_fresh():
+            return True, ""
+        if not self._refresh_lock.acquire(blocking=self._loaded_at is None):
+            return True, ""
+        try:
+            if self._is_fresh():
+                return True, ""
+            return self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def refresh(self) -> tuple[bool, str]:
+        """
+        بارگذاری فوری فهرست کامل trunkها از Asterisk
+
+        Returns:
+            tuple (success, error_message)؛ در صورت خطا snapshot قبلی حفظ
+            می‌شود
+        """
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self) -> tuple[bool, str]:
+        started = time.perf_counter()
+        manager, error = self.pool.acquire()
+        if manager is None:
+            return False, error
+        try:
+            endpoints = manager.list_endpoints()
+            peers = manager.list_sip_peers() if endpoints is not None else None
+        finally:
+            self.pool.release(manager)
+        if endpoints is None or peers is None:
+            return False, "فهرست trunkها به طور کامل از Asterisk دریافت نشد"
+
+        entries: Dict[str, Dict[str, Any]] = {}
+        for event in peers:
+            if event.get('ObjectName'):
+                entries[event['ObjectName']] = peer_entry(event)
+        for event in endpoints:
+            if event.get('ObjectName'):
+                entries[event['ObjectName']] = endpoint_entry(event)
+
+        with self._lock:
+            self._entries = entries
+            self._loaded_at = time.monotonic()
+        self.refreshes += 1
+        TRUNK_STATUS_REFRESH_SECONDS.observe(time.perf_counter() - started)
+        logger.debug("وضعیت %d trunk بارگذاری شد", len(entries))
+        return True, ""
+
+    def invalidate(self):
+        """منقضی کردن snapshot (مثلاً پس از تغییر پیکربندی trunkها)"""
+        with self._lock:
+            if self._loaded_at is not None:
+                self._loaded_at -= self.ttl
+
+    def handle_event(self, event: Dict[str, str]):
+        """
+        اعمال PeerStatus / ContactStatus روی snapshot (در thread event bus)
+
+        Args:
+            event: دیکشنری هدرهای Event
+        """
+        name = event.get('Event')
+        if name == 'PeerStatus':
+            # Peer: PJSIP/trunk یا SIP/trunk
+            technology, _, trunk = event.get('Peer', '').partition('/')
+            status = event.get('PeerStatus', '')
+            contact = None
+        elif name == 'ContactStatus':
+            technology = 'PJSIP'
+            trunk = event.get('EndpointName') or event.get('AOR', '')
+            status = event.get('ContactStatus', '')
+            contact = f"{event.get('AOR', trunk)}/{event.get('URI', '')}"
+        else:
+            return
+        if not trunk:
+            return
+
+        with self._lock:
+            entry = self._entries.get(trunk)
+            if entry is None:
+                if self._loaded_at is None:
+                    return
+                # trunk بعد از آخرین بارگذاری اضافه شده است
+                entry = self._entries[trunk] = {
+                    'name': trunk,
+                    'technology': technology,
+                    'reachability': UNKNOWN,
+                    'device_state': None,
+                    'contacts': {},
+                }
+            if contact is None:
+                entry['reachability'] = _EVENT_STATUS.get(status, UNKNOWN)
+            else:
+                self._apply_contact(entry, contact, status)
+            entry['updated_at'] = time.time()
+        self.events_applied += 1
+        TRUNK_STATUS_EVENTS.labels(name).inc()
+
+    @staticmethod
+    def _apply_contact(entry: Dict[str, Any], contact: str, status: str):
+        """
+        به‌روزرسانی یک contact و وضعیت کلی endpoint (داخل قفل)
+
+        endpoint با حداقل یک contact در دسترس reachable است.
+        """
+        contacts = entry['contacts']
+        if status == 'Removed':
+            contacts.pop(contact, None)
+            if not contacts:
+                entry['reachability'] = UNREACHABLE
+                return
+        elif status == 'Updated':
+            # فقط جزئیات contact تغییر کرده است
+            contacts.setdefault(contact, UNKNOWN)
+        else:
+            contacts[contact] = _EVENT_STATUS.get(status, UNKNOWN)
+        statuses = set(contacts.values())
+        for candidate in (REACHABLE, LAGGED, UNREACHABLE):
+            if candidate in statuses:
+                entry['reachability'] = candidate
+                return
+
+    def snapshot(self) -> tuple[Optional[List[Dict[str, Any]]], str]:
+        """
+        فهرست وضعیت تمام trunkها
+
+        Returns:
+            tuple (entries, error_message)؛ entries None است اگر هنوز هیچ
+            snapshotی بارگذاری نشده و Asterisk در دسترس نباشد
+        """
+        success, error = self._ensure_loaded()
+        with self._lock:
+            if not success and self._loaded_at is None:
+                return None, error
+            return [
+                self._copy(entry)
+                for _, entry in sorted(self._entries.items())
+            ], ""
+
+    def get(
+        self,
+        trunk_name: str
+    ) -> tuple[bool, Optional[Dict[str, Any]], str]:
+        """
+        وضعیت یک trunk
+
+        Args:
+            trunk_name: نام endpoint یا peer
+
+        Returns:
+            tuple (available, entry, error_message)؛ entry None است اگر
+            trunk وجود نداشته باشد
+        """
+        success, error = self._ensure_loaded()
+        with self._lock:
+            if not success and self._loaded_at is None:
+                return False, None, error
+            entry = self._entries.get(trunk_name)
+            return True, self._copy(entry) if entry else None, ""
+
+    @staticmethod
+    def _copy(entry: Dict[str, Any]) -> Dict[str, Any]:
+        """کپی رکورد تا به‌روزرسانی‌های event bus روی پاسخ اثر نگذارند"""
+        return {**entry, 'contacts': dict(entry['contacts'])}
+
+    def age(self) -> Optional[float]:
+        """عمر snapshot فعلی به ثانیه"""
+        loaded_at = self._loaded_at
+        return time.monotonic() - loaded_at if loaded_at is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        """وضعیت cache"""
+        age = self.age()
+        return {
+            'trunks': len(self._entries),
+            'age': round(age, 3) if age is not None else None,
+            'ttl': self.ttl,
+            'refreshes': self.refreshes,
+            'events_applied': self.events_applied,
+        }
+
+
+_cache: Optional[TrunkStatusCache] = None
+_cache_lock = threading.Lock()
+_cache_pid = os.getpid()
+
+
+def get_trunk_status_cache() -> TrunkStatusCache:
+    """
+    دریافت cache وضعیت trunk این process
+
+    مانند AMI pool به ازای هر process ساخته می‌شود و در اولین فراخوانی
+    روی event bus مشترک می‌شود.
+    """
+    global _cache, _cache_pid
+    with _cache_lock:
+        if _cache is None or _cache_pid != os.getpid():
+            _cache = TrunkStatusCache()
+            _cache_pid = os.getpid()
+            _cache.start()
+        return _cache
@@ -0,0 +1,219 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, List, Callable
+
+from ami_router import get_asterisk_router
+from call_supervisor import get_call_supervisor
+from config_cache import get_config_cache
+from db import get_db_pool
+from health import get_health_monitor
+from metrics import REGISTRY
+from migrations import ensure_migrated
+from session_store import get_session_store
+from trunk_registry import get_trunk_registry
+from trunk_status import get_trunk_status_cache
+
+logger = logging.getLogger(__name__)
+
+
+WARMUP_SECONDS = REGISTRY.histogram(
+    'warmup_component_seconds',
+    'Time spent warming up one component at worker startup',
+    ('component', 'result')
+)
+
+# هر مرحله (success, message) یا None (موفق) برمی‌گرداند
+WarmupStep = Callable[[], Optional[tuple[bool, str]]]
+
+
+def _migrations() -> tuple[bool, str]:
+    if ensure_migrated():
+        return True, ""
+    return False, "migration اعمال نشد"
+
+
+def _db_pool() -> tuple[bool, str]:
+    opened = get_db_pool().warm()
+    return opened > 0, f"{opened} اتصال"
+
+
+def _config_cache() -> tuple[bool, str]:
+    loaded = get_config_cache().preload()
+    return True, f"{loaded} پیکربندی"
+
+
+def _trunk_registry() -> tuple[bool, str]:
+    # رشته dial هر trunk (prefix/suffix قالب) هنگام بارگذاری ساخته می‌شود
+    registry = get_trunk_registry()
+    if not registry.load():
+        return False, "خطا در بارگذاری trunkها"
+    return True, f"{len(registry.all())} trunk"
+
+
+def _ami_pool() -> tuple[bool, str]:
+    # سرورها از پیکربندی‌های بارگذاری شده در config_cache ساخته می‌شوند
+    router = get_asterisk_router()
+    warmed = []
+    errors = []
+    for server in router.servers():
+        sessions, error = router.pool(server).warm()
+        if error:
+            errors.append(f"{server}: {error}")
+        else:
+            warmed.append(f"{server}: {sessions} session")
+    return not errors, '; '.join(errors or warmed)
+
+
+def _trunk_status() -> tuple[bool, str]:
+    return get_trunk_status_cache().refresh()
+
+
+def _call_services() -> None:
+    # thread نوشتن جلسه‌ها و supervisor قبل از اولین تماس آماده می‌شوند
+    get_session_store().start()
+    get_call_supervisor()
+    # اولین بررسی سلامت وابستگی‌ها در thread خود monitor انجام می‌شود
+    get_health_monitor()
+
+
+# ترتیب مراحل مهم است: تنظیمات Asterisk از cache و trunkها از دیتابیس
+DEFAULT_STEPS: List[tuple[str, WarmupStep]] = [
+    ('migrations', _migrations),
+    ('db_pool', _db_pool),
+    ('config_cache', _config_cache),
+    ('trunk_registry', _trunk_registry),
+    ('ami_pool', _ami_pool),
+    ('trunk_status', _trunk_status),
+    ('call_services', _call_services),
+]
+
+
+class Warmup:
+    """
+    آماده‌سازی worker قبل از پذیرش ترافیک
+
+    pool دیتابیس و AMI باز و login می‌شوند و cacheهای تنظیمات، trunk و
+    وضعیت trunk بارگذاری می‌شوند تا اولین تماس‌ها بعد از deploy هزینه
+    cold start نپردازند. /is-ready تا پایان این مرحله 503 برمی‌گرداند.
+
+    شکست یک مرحله بقیه را متوقف نمی‌کند؛ آن بخش در اولین استفاده به
+    صورت lazy آماده می‌شود و خطای آن در report گزارش می‌شود.
+    """
+
+    def __init__(self, steps: Optional[List[tuple[str, WarmupStep]]] = None):
+        """
+        Args:
+            steps: لیست (نام، تابع) مراحل (پیش‌فرض: DEFAULT_STEPS)
+        """
+        self.steps = list(DEFAULT_STEPS if steps is None else steps)
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.started_at: Optional[float] = None
+        self.duration: Optional[float] = None
+        self._finished = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def add_step(self, name: str, step: WarmupStep):
+        """افزودن مرحله (قبل از start)"""
+        self.steps.append((name, step))
+
+    def start(self):
+        """اجرای مراحل در thread پس‌زمینه (فقط یک بار)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self.run,
+                name='warmup',
+                daemon=True
+            )
+            self._thread.start()
+
+    def run(self) -> bool:
+        """
+        اجرای تمام مراحل به ترتیب
+
+        Returns:
+            True اگر همه مراحل موفق باشند
+        """
+        self.started_at = time.monotonic()
+        try:
+            for name, step in self.steps:
+                self._run_step(name, step)
+        finally:
+            self.duration = time.monotonic() - self.started_at
+            self._finished.set()
+        failed = [
+            name for name, result in self.results.items() if not result['ok']
+        ]
+        if failed:
+            logger.warning(
+                "warm-up در %.2f ثانیه با خطا در %s تمام شد",
+                self.duration, ', '.join(failed)
+            )
+        else:
+            logger.info("warm-up در %.2f ثانیه تمام شد", self.duration)
+        return not failed
+
+    def _run_step(self, name: str, step: WarmupStep):
+        started = time.perf_counter()
+        try:
+            result = step()
+            success, message = result if result is not None else (True, "")
+        except Exception as e:
+            logger.exception("خطا در warm-up %s", name)
+            success, message = False, str(e)
+        elapsed = time.perf_counter() - started
+        WARMUP_SECONDS.labels(name, 'ok' if success else 'error').observe(
+            elapsed
+        )
+        self.results[name] = {
+            'ok': success,
+            'seconds': round(elapsed, 4),
+            'message': message,
+        }
+        logger.debug("warm-up %s: %.3fs %s", name, elapsed, message)
+
+    def is_finished(self) -> bool:
+        return self._finished.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """انتظار برای پایان warm-up"""
+        return self._finished.wait(timeout)
+
+    def report(self) -> Dict[str, Any]:
+        """وضعیت و زمان هر مرحله"""
+        running = self.started_at is not None and not self.is_finished()
+        return {
+            'finished': self.is_finished(),
+            'seconds': round(
+                self.duration if self.duration is not None else (
+                    time.monotonic() - self.started_at if running else 0.0
+                ), 4
+            ),
+            'components': dict(self.results),
+            'pending': [
+                name for name, _ in self.steps if name not in self.results
+            ],
+        }
+
+
+_warmup: Optional[Warmup] = None
+_warmup_lock = threading.Lock()
+_warmup_pid = os.getpid()
+
+
+def get_warmup() -> Warmup:
+    """
+    دریافت warm-up این process
+
+    هر worker بعد از fork pool و cacheهای خودش را آماده می‌کند.
+    """
+    global _warmup, _warmup_pid
+    with _warmup_lock:
+        if _warmup is None or _warmup_pid != os.getpid():
+            _warmup = Warmup()
+            _warmup_pid = os.getpid()
+        return _warmup